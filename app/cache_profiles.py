@@ -0,0 +1,60 @@
+"""
+Профили настроек CACHES. Профиль выбирается переменной окружения
+CACHE_PROFILE (см. settings.CACHES):
+
+- file: файлы в CACHE_DIR - общий кэш для всех воркеров на одной машине
+  без отдельного сервиса;
+- redis: Redis или совместимый сервер (Valkey, KeyDB) по REDIS_URL -
+  общий кэш для нескольких машин, incr атомарен;
+- locmem: память процесса. Подходит только для одного процесса: OTP,
+  подтвержденный в одном воркере, другие не видят. Используется в тестах.
+
+Ключи всех профилей получают префикс CACHE_KEY_PREFIX и версию
+CACHE_VERSION: смена версии при выкладке делает старые записи невидимыми.
+"""
+import os
+
+CACHE_KEY_PREFIX = 'beauty_salon'
+# Сколько ключей держит файловый кэш, прежде чем удалять треть
+FILE_CACHE_MAX_ENTRIES = 10_000
+
+
+def _common(environ):
+    return {
+        'KEY_PREFIX': environ.get('CACHE_KEY_PREFIX', CACHE_KEY_PREFIX),
+        'VERSION': int(environ.get('CACHE_VERSION', 1)),
+    }
+
+
+def locmem_cache(environ=os.environ):
+    return {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        **_common(environ),
+    }
+
+
+def file_cache(path, environ=os.environ):
+    return {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': environ.get('CACHE_DIR', str(path)),
+        'OPTIONS': {'MAX_ENTRIES': int(environ.get('CACHE_MAX_ENTRIES', FILE_CACHE_MAX_ENTRIES))},
+        **_common(environ),
+    }
+
+
+def redis_cache(environ=os.environ):
+    return {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0'),
+        **_common(environ),
+    }
+
+
+def cache_profile(name, base_dir):
+    if name == 'file':
+        return file_cache(base_dir / 'cache')
+    if name == 'redis':
+        return redis_cache()
+    if name == 'locmem':
+        return locmem_cache()
+    raise ValueError(f'Unknown CACHE_PROFILE {name!r}: use file, redis or locmem')
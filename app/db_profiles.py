@@ -0,0 +1,81 @@
+"""
+Профили настроек DATABASES. Профиль выбирается переменной окружения
+DB_PROFILE (см. settings.DATABASES):
+
+- sqlite: файл db.sqlite3 с журналом отката. Демо-база лежит в git:
+  WAL переписал бы ее заголовок и оставил рядом -wal и -shm;
+- sqlite-wal: файл SQLITE_PATH (по умолчанию тот же db.sqlite3) в
+  режиме WAL - читатели не ждут писателя. Для развертывания, на
+  файловых системах с поддержкой WAL (не сетевые диски);
+- postgres: PostgreSQL с пулом соединений psycopg (Django 5.1+) или
+  с постоянными соединениями при DB_POOL=0.
+"""
+import os
+
+# PRAGMA выполняются на каждом новом соединении (OPTIONS['init_command'])
+SQLITE_PRAGMAS = {
+    # Читатели работают параллельно с писателем, коммит - запись в конец журнала
+    'journal_mode': 'WAL',
+    # В WAL fsync нужен только на checkpoint; после сбоя ОС теряются последние коммиты, но не целостность
+    'synchronous': 'NORMAL',
+    # Чтение страниц через mmap без копирования в буфер SQLite (256 МБ)
+    'mmap_size': 256 * 1024 * 1024,
+    # Кэш страниц на соединение, в КБ (отрицательное значение) - 64 МБ
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+# Сколько ждать блокировку на запись, секунды (busy_timeout соединения)
+SQLITE_BUSY_TIMEOUT = 20
+
+
+def sqlite_database(path, wal=True, environ=os.environ):
+    pragmas = SQLITE_PRAGMAS if wal else {'journal_mode': 'DELETE'}
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        # Соединение (и его PRAGMA) переиспользуется между запросами потока
+        'CONN_MAX_AGE': int(environ.get('DB_CONN_MAX_AGE', 600)),
+        'OPTIONS': {
+            # Транзакция сразу берет блокировку на запись: проверка занятости мастера
+            # и вставка записи не перемешиваются с другими процессами
+            'transaction_mode': 'IMMEDIATE',
+            # sqlite3.connect(timeout=) выставляет busy_timeout соединения
+            'timeout': SQLITE_BUSY_TIMEOUT,
+            'init_command': ';'.join(f'PRAGMA {name} = {value}' for name, value in pragmas.items()),
+        },
+    }
+
+
+def postgres_database(environ=os.environ):
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': environ.get('POSTGRES_DB', 'beauty_salon'),
+        'USER': environ.get('POSTGRES_USER', 'postgres'),
+        'PASSWORD': environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': environ.get('POSTGRES_PORT', '5432'),
+        'OPTIONS': {},
+    }
+    if environ.get('DB_POOL', '1') == '1':
+        # Пул psycopg: соединение возвращается в пул в конце запроса.
+        # С пулом Django требует CONN_MAX_AGE = 0
+        database['OPTIONS']['pool'] = {
+            'min_size': int(environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(environ.get('DB_POOL_MAX_SIZE', 20)),
+            'timeout': int(environ.get('DB_POOL_TIMEOUT', 10)),
+        }
+    else:
+        # Без пула - постоянные соединения на поток с проверкой перед запросом
+        database['CONN_MAX_AGE'] = int(environ.get('DB_CONN_MAX_AGE', 600))
+        database['CONN_HEALTH_CHECKS'] = True
+    return database
+
+
+def database_profile(name, base_dir, environ=os.environ):
+    if name == 'sqlite':
+        return sqlite_database(base_dir / 'db.sqlite3', wal=False, environ=environ)
+    if name == 'sqlite-wal':
+        return sqlite_database(environ.get('SQLITE_PATH', base_dir / 'db.sqlite3'), environ=environ)
+    if name == 'postgres':
+        return postgres_database(environ)
+    raise ValueError(f'Unknown DB_PROFILE {name!r}: use sqlite, sqlite-wal or postgres')
@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .cache_profiles import cache_profile
+from .db_profiles import database_profile
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,6 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым: время запроса включает всю остальную цепочку
+    'beauty_salon.metrics.RequestMetricsMiddleware',
+    'beauty_salon.querywatch.QueryWatchMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -80,13 +87,45 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Профиль выбирается DB_PROFILE: sqlite (по умолчанию), sqlite-wal или postgres
+DB_PROFILE = os.environ.get('DB_PROFILE', 'sqlite')
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_profile(DB_PROFILE, BASE_DIR),
+}
+
+# OTP, токены и версии кэшей должны быть общими для всех воркеров
+CACHE_PROFILE = os.environ.get('CACHE_PROFILE', 'file')
+
+CACHES = {
+    'default': cache_profile(CACHE_PROFILE, BASE_DIR),
 }
 
+# Доля запросов, для которых собираются метрики (0 - middleware отключается)
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1))
+# Писать замер каждого запроса строкой JSON в лог beauty_salon.metrics
+METRICS_LOG = os.environ.get('METRICS_LOG', '0') == '1'
+# Если задан, /metrics требует заголовок Authorization: Bearer <токен>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Без токена /metrics отвечает 404, кроме DEBUG; открыть его всем можно только явно
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', '0') == '1'
+
+# Поиск N+1 и медленных запросов (beauty_salon.querywatch) - по умолчанию только при DEBUG
+QUERYWATCH = os.environ.get('QUERYWATCH', '1' if DEBUG else '0') == '1'
+QUERYWATCH_REPEAT_THRESHOLD = int(os.environ.get('QUERYWATCH_REPEAT_THRESHOLD', 5))
+QUERYWATCH_SLOW_MS = int(os.environ.get('QUERYWATCH_SLOW_MS', 100))
+
+# Фоновые выгрузки в Excel (beauty_salon/export_jobs.py): процессов в пуле,
+# 0 - файл собирается прямо в запросе POST /api/exports/
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 2))
+# Одинаковый запрос выгрузки в течение окна получает уже созданное задание и его файл
+EXPORT_REUSE_SECONDS = int(os.environ.get('EXPORT_REUSE_SECONDS', 300))
+# Сколько хранить задания и файлы выгрузок (manage.py run_export_jobs --purge)
+EXPORT_KEEP_HOURS = float(os.environ.get('EXPORT_KEEP_HOURS', 24))
+
+# Тесты работают с чистым кэшем в памяти и падают на N+1 (app/test_runner.py)
+TEST_RUNNER = 'app.test_runner.TestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -143,12 +182,13 @@ CSRF_TRUSTED_ORIGINS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'beauty_salon.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'beauty_salon.pagination.IdCursorPagination',
 }
 
 AUTHENTICATION_BACKENDS = [
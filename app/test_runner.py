@@ -0,0 +1,60 @@
+import unittest
+
+from django.core.cache import cache
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .cache_profiles import locmem_cache
+
+
+class TestRunner(DiscoverRunner):
+    """
+    - Тесты получают кэш в памяти: записи общего файлового кэша или Redis
+      (версии статистики, токены) от другой БД испортили бы результаты.
+    - Включен поиск N+1 (beauty_salon.querywatch): повторяющийся запрос
+      из api.py внутри одного HTTP-запроса валит тест. Медленные запросы
+      не ищем - время в CI зависит от нагрузки машины.
+    - Кэш очищается перед каждым тестом: снимки статистики сбрасываются
+      только после коммита, а TestCase не коммитит, и снимок с данными
+      предыдущего теста пережил бы его откат.
+    - Выгрузки собираются прямо в запросе: процессы пула не видят
+      тестовую БД в памяти.
+    """
+    # Находки в этих файлах - ошибка, в остальных - предупреждение в логе
+    querywatch_raise_for = ('beauty_salon/api.py',)
+
+    def __init__(self, querywatch=True, **kwargs):
+        super().__init__(**kwargs)
+        self.querywatch = querywatch
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--no-querywatch', action='store_false', dest='querywatch',
+            help='Do not fail tests on N+1 queries from beauty_salon/api.py.',
+        )
+
+    def get_resultclass(self):
+        base = super().get_resultclass() or unittest.TextTestResult
+
+        class CacheClearingResult(base):
+            def startTest(self, test):
+                cache.clear()
+                super().startTest(test)
+
+        return CacheClearingResult
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        overrides = {'CACHES': {'default': locmem_cache()}, 'EXPORT_WORKERS': 0}
+        if self.querywatch:
+            overrides.update(
+                QUERYWATCH=True, QUERYWATCH_SLOW_MS=None, QUERYWATCH_RAISE_FOR=self.querywatch_raise_for,
+            )
+        self._settings_override = override_settings(**overrides)
+        self._settings_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._settings_override.disable()
+        super().teardown_test_environment(**kwargs)
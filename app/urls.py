@@ -17,10 +17,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from beauty_salon.views import ShowClients, login, logout
+from beauty_salon import async_views
+from beauty_salon.metrics import metrics_view
 from rest_framework import routers
 from beauty_salon.api import (
     ClientViewSet, ServiceViewSet, MasterViewSet, 
-    AppointmentViewSet, ReviewViewSet, UserViewSet
+    AppointmentViewSet, ReviewViewSet, UserViewSet, SearchViewSet, AnalyticsViewSet,
+    ExportJobViewSet
 )
 from django.conf import settings
 from django.conf.urls.static import static
@@ -35,6 +38,9 @@ router.register("masters", MasterViewSet, basename="masters")
 router.register("appointments", AppointmentViewSet, basename="appointments")
 router.register("reviews", ReviewViewSet, basename="reviews")
 router.register("users", UserViewSet, basename="users")
+router.register("search", SearchViewSet, basename="search")
+router.register("analytics", AnalyticsViewSet, basename="analytics")
+router.register("exports", ExportJobViewSet, basename="exports")
 
 @ensure_csrf_cookie
 def get_csrf_token(request):
@@ -48,6 +54,13 @@ urlpatterns = [
     path('api/auth/login/', login),
     path('api/auth/logout/', logout, name='logout'),
     path('api/auth/csrf/', get_csrf_token, name='csrf'),
+    # Асинхронные копии горячих GET-эндпоинтов (для запуска под ASGI)
+    path('api/async/services/', async_views.services),
+    path('api/async/masters/', async_views.masters),
+    path('api/async/appointments/free-slots/', async_views.free_slots),
+    path('api/async/<str:scope>/stats/', async_views.stats),
+    # Метрики запросов в формате Prometheus
+    path('metrics', metrics_view),
 ]
 
 if settings.DEBUG:
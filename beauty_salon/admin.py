@@ -1,33 +1,172 @@
+from datetime import datetime
+
 from django.contrib import admin
-from .models import Client, Service, Master, Appointment, Review
+from django.core import checks
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Max, Min, Q, QuerySet
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .models import Client, Service, Master, Appointment, Review, ServiceRating
+from .search import KINDS, search_ids_sql
+
+
+class FullTextSearchMixin:
+    """
+    Поиск в админке через полнотекстовый индекс вместо LIKE '%...%' по всей
+    таблице. Каждое поле search_fields должно быть в индексе (search.KINDS) -
+    у самой модели или у связанной (client__name): связанные объекты ищутся
+    в индексе, строки выбираются по их id через индекс внешнего ключа.
+    Поле вне индекса - ошибка проверки (manage.py check), а не LIKE.
+    """
+    def search_lookup(self, field):
+        """(путь к объекту, вид в индексе) для поля search_fields или None"""
+        *path, name = field.split('__')
+        model = self.model
+        for part in path:
+            model = model._meta.get_field(part).related_model
+        for kind, (model_name, _, fields) in KINDS.items():
+            if model_name == model.__name__ and name in fields:
+                return '__'.join(path) or 'pk', kind
+        return None
+
+    def check(self, **kwargs):
+        errors = super().check(**kwargs)
+        for field in self.search_fields:
+            if self.search_lookup(field) is None:
+                errors.append(checks.Error(
+                    f'search_fields entry {field!r} is not covered by the full-text index (search.KINDS)',
+                    obj=self.__class__, id='beauty_salon.E001',
+                ))
+        return errors
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        condition = Q()
+        for path, kind in {self.search_lookup(field) for field in self.search_fields}:
+            condition |= Q(**{f'{path}__in': RawSQL(*search_ids_sql(kind, search_term))})
+        return queryset.filter(condition), False
+
+
+# До этого числа строк список в админке считается точным COUNT(*)
+EXACT_COUNT_LIMIT = 10_000
+
+
+def estimated_row_count(model):
+    """
+    Число строк таблицы из статистики планировщика (pg_class.reltuples,
+    sqlite_stat1 после ANALYZE), без статистики - наибольший id.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            if row and row[0] > 0:
+                return row[0]
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone():
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+                row = cursor.fetchone()
+                if row:
+                    return int(row[0].split()[0])
+    return model._default_manager.aggregate(last=Max('pk'))['last'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    COUNT(*) по миллионам строк дороже самой страницы. Считаем точно не
+    больше EXACT_COUNT_LIMIT строк, дальше без фильтров берем оценку по
+    статистике таблицы, с фильтрами - останавливаемся на границе.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limited = queryset.order_by()[:EXACT_COUNT_LIMIT + 1].count()
+        if limited <= EXACT_COUNT_LIMIT or queryset.query.has_filters():
+            return limited
+        return max(limited, estimated_row_count(queryset.model))
+
+
+class YearBoundedQuerySet(QuerySet):
+    """
+    Верхний уровень date_hierarchy без SELECT DISTINCT strftime(...) по
+    всей таблице: годы берутся из MIN/MAX даты - два поиска по индексу.
+    Год без единой записи тоже попадет в список, на больших таблицах
+    таких почти не бывает. Месяцы и дни считаются как обычно - по
+    диапазону выбранного года или месяца.
+    """
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        if kind != 'year':
+            return super().datetimes(field_name, kind, order, tzinfo)
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        tzinfo = tzinfo or timezone.get_current_timezone()
+        first, last = (timezone.localtime(bounds[key], tzinfo).year for key in ('first', 'last'))
+        years = [datetime(year, 1, 1, tzinfo=tzinfo) for year in range(first, last + 1)]
+        return years if order == 'ASC' else years[::-1]
+
+
+class LargeTableAdminMixin:
+    """
+    Список большой таблицы: оценка числа строк вместо COUNT(*), без
+    второго подсчета всей таблицы и навигация по датам по индексу (date, id).
+    Уровень месяцев и дней - DISTINCT по строкам выбранного года или
+    месяца: диапазон по индексу, но читает все его строки.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    date_hierarchy = 'date'
+    # ChangeList добавит -pk: порядок совпадает с индексом (date, id)
+    ordering = ['-date']
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return YearBoundedQuerySet(queryset.model, queryset.query.chain(), queryset.db)
 
 @admin.register(Client)
 class ClientAdmin(admin.ModelAdmin):
     list_display = ['id', 'name', 'phone', 'email', 'service']
+    list_select_related = ['service']
     search_fields = ['name', 'phone']
+    raw_id_fields = ['user']
 
 @admin.register(Service)
-class ServiceAdmin(admin.ModelAdmin):
+class ServiceAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['id', 'name', 'price', 'duration', 'picture']
     search_fields = ['name']
     
 @admin.register(Master)
-class MasterAdmin(admin.ModelAdmin):
+class MasterAdmin(FullTextSearchMixin, admin.ModelAdmin):
     list_display = ['id', 'name', 'specialization']
-    search_fields = ['name']
+    search_fields = ['name', 'specialization']
     filter_horizontal = ['services']
 
 @admin.register(Appointment)
-class AppointmentAdmin(admin.ModelAdmin):
+class AppointmentAdmin(FullTextSearchMixin, LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'client', 'service', 'master', 'date']
+    list_select_related = ['client', 'service', 'master']
     list_filter = ['date', 'service', 'master']
     search_fields = ['client__name']
+    # Клиентов слишком много для <select> и даже для автодополнения по LIKE
+    raw_id_fields = ['client']
+    autocomplete_fields = ['service', 'master']
 
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(FullTextSearchMixin, LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'client', 'service', 'rating', 'date']
+    list_select_related = ['client', 'service']
     list_filter = ['rating', 'date', 'service']
+    raw_id_fields = ['client']
+    autocomplete_fields = ['service']
     search_fields = ['client__name', 'comment']
 
-
-
+@admin.register(ServiceRating)
+class ServiceRatingAdmin(admin.ModelAdmin):
+    list_display = ['service', 'count', 'average', 'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5']
+    list_select_related = ['service']
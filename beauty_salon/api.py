@@ -1,24 +1,42 @@
-from rest_framework import viewsets, serializers
+import logging
+
+from rest_framework import mixins, viewsets, serializers
 from rest_framework.decorators import action
+from rest_framework.request import Request
 from rest_framework.response import Response
-from django.db.models import Avg, Count, Max, Min, Sum
+from rest_framework.reverse import reverse
+from django.db.models import Avg, Count, Max, Min, Prefetch, Q, Sum
 from django.contrib.auth.models import User
-from .models import Client, Service, Master, Appointment, Review
+from django.http import FileResponse, HttpRequest
+from django.db import transaction
+from .models import Client, Service, Master, Appointment, Review, ServiceRating, ExportJob
 from .serializers import (
     ClientSerializer, ServiceSerializer, MasterSerializer, 
-    AppointmentSerializer, ReviewSerializer
+    AppointmentSerializer, ReviewSerializer, FreeSlotsQuerySerializer,
+    SearchQuerySerializer, SearchResultSerializer, TimeseriesQuerySerializer,
+    UtilizationQuerySerializer, ExportJobSerializer
 )
 from rest_framework import serializers
 from django.core.cache import cache
 import pyotp
-from .permissions import OTPRequired
-from rest_framework.permissions import IsAuthenticated
-from django.http import HttpResponse
-import openpyxl
-from openpyxl.styles import Font
+from .permissions import OTPRequired, is_otp_verified, mark_otp_verified, otp_cache_key
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from datetime import datetime
+from .authentication import client_for
+from .availability import find_free_slots
+from .booking import BatchBookingConflict, booking_guard, bulk_booking_guard
+from .conditional import ConditionalListMixin
+from .export_jobs import request_export, visible_jobs
+from .exports import EXPORT_CHUNK_SIZE, XLSX_CONTENT_TYPE, xlsx_response
+from .pagination import DateCursorPagination
+from .rollups import timeseries, total_revenue
+from .search import search
+from .utilization import master_utilization
+from .stats import day_range, get_cached_stats, month_range, stats_owner
 from rest_framework import status
 
+logger = logging.getLogger(__name__)
+
 class BaseModelViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     
@@ -35,8 +53,7 @@ class BaseModelViewSet(viewsets.ModelViewSet):
         
         success = False
         if serializer.validated_data['code'] == DEMO_OTP:
-            # OTP действителен 30 минут
-            cache.set(f'otp_good_{request.user.id}', True, 30 * 60)
+            mark_otp_verified(request.user.id)
             success = True
 
         return Response({
@@ -46,7 +63,7 @@ class BaseModelViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['GET'], url_path='otp-status')
     def get_otp_status(self, request):
-        otp_verified = cache.get(f'otp_good_{request.user.id}', False)
+        otp_verified = is_otp_verified(request.user.id)
         return Response({
             'otp_verified': otp_verified
         })
@@ -54,17 +71,44 @@ class BaseModelViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['GET'], url_path='check-otp-status')
     def check_otp_status(self, request):
         """Endpoint для отладки OTP статуса"""
-        current_user_otp = cache.get(f'otp_good_{request.user.id}')
+        current_user_otp = cache.get(otp_cache_key(request.user.id))
         
         return Response({
             'user_id': request.user.id,
             'username': request.user.username,
             'current_user_otp': current_user_otp,
-            'otp_key': f'otp_good_{request.user.id}'
+            'otp_key': otp_cache_key(request.user.id)
         })
 
+    # Ключ кэша статистики: раздел и чьи данные в нем лежат
+    stats_scope = None
+    stats_per_user = True
+
+    def get_stats_owner(self, user):
+        return stats_owner(user, per_user=self.stats_per_user)
+
+    def cached_stats(self):
+        return get_cached_stats(
+            self.stats_scope, self.get_stats_owner(self.request.user), self.compute_stats
+        )
+
+    # Форма queryset'а для каждого action: какие связи джойнить
+    # (select_related), какие подгружать отдельным запросом (prefetch_related)
+    # и какие колонки читать (only). Ключ 'default' - для остальных action.
+    queryset_shapes = {}
+
+    def shape_queryset(self, qs):
+        shape = self.queryset_shapes.get(self.action, self.queryset_shapes.get('default', {}))
+        if shape.get('select_related'):
+            qs = qs.select_related(*shape['select_related'])
+        if shape.get('prefetch_related'):
+            qs = qs.prefetch_related(*shape['prefetch_related'])
+        if shape.get('only'):
+            qs = qs.only(*shape['only'])
+        return qs
+
     def get_queryset(self):
-        qs = super().get_queryset()
+        qs = self.shape_queryset(super().get_queryset())
         # Для моделей Service, Master и Client возвращаем все записи
         if isinstance(self, (ServiceViewSet, MasterViewSet, ClientViewSet)):
             return qs
@@ -81,29 +125,126 @@ class BaseModelViewSet(viewsets.ModelViewSet):
 
     def destroy(self, request, *args, **kwargs):
         try:
-            print(f"Attempting to delete object with kwargs: {kwargs}")  # Отладка
-            print(f"User: {request.user}, is_authenticated: {request.user.is_authenticated}")  # Отладка
             instance = self.get_object()
-            print(f"Found instance: {instance}")  # Отладка
             self.perform_destroy(instance)
-            print("Instance deleted successfully")  # Отладка
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Exception as e:
-            print(f"Error during deletion: {str(e)}")  # Отладка
+            logger.warning('Error deleting %s %s: %s', self.basename, kwargs, e)
             return Response(
                 {'detail': str(e)}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
 
     def get_permissions(self):
-        if self.action in ['update', 'partial_update']:
+        if self.action in ['update', 'partial_update', 'bulk_update']:
             return [IsAuthenticated(), OTPRequired()]
-        return [IsAuthenticated()]
+        # permission_classes класса или action(permission_classes=...)
+        return super().get_permissions()
+
+class ExcelExportMixin:
+    """
+    GET export-excel - выгрузка прямо в запросе. Те же таблицы собирает
+    фоновое задание POST /api/exports/ (export_jobs.py) - для больших
+    выгрузок, которые не должны держать поток веб-сервера.
+    """
+    def export_table(self):
+        """(имя файла, лист, заголовки, строки) выгрузки"""
+        raise NotImplementedError
+
+    @action(detail=False, methods=['GET'], url_path='export-excel')
+    def export_excel(self, request):
+        return xlsx_response(*self.export_table())
+
+class BulkWriteMixin:
+    """
+    /bulk/ для пакетной записи: POST - создать, PUT - обновить (у каждого
+    элемента есть id), DELETE - удалить по списку id. Пакет пишется в одной
+    транзакции целиком или не пишется вовсе; ошибки возвращаются по индексам.
+    """
+    bulk_max_items = 500
+
+    def bulk_items(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise serializers.ValidationError({'errors': ['Expected a list of objects']})
+        if not items:
+            raise serializers.ValidationError({'errors': ['Empty list']})
+        if len(items) > self.bulk_max_items:
+            raise serializers.ValidationError(
+                {'errors': [f'No more than {self.bulk_max_items} objects per request']}
+            )
+        return items
+
+    def bulk_error_response(self, errors, status_code=status.HTTP_400_BAD_REQUEST):
+        # ListSerializer отдает ошибки списком или словарем в зависимости от версии DRF
+        pairs = errors.items() if isinstance(errors, dict) else enumerate(errors)
+        return Response(
+            {'errors': [{'index': index, 'errors': error} for index, error in pairs if error]},
+            status=status_code
+        )
+
+    def get_bulk_client(self):
+        # Один запрос на весь пакет вместо запроса на каждый объект
+        client = client_for(self.request.user)
+        if not client:
+            raise serializers.ValidationError("Client profile not found for current user")
+        return client
+
+    def perform_bulk_create(self, serializer, client):
+        with transaction.atomic():
+            serializer.save(client=client)
+
+    def perform_bulk_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+    @action(detail=False, methods=['POST'], url_path='bulk')
+    def bulk_create(self, request):
+        serializer = self.get_serializer(data=self.bulk_items(request), many=True)
+        if not serializer.is_valid():
+            return self.bulk_error_response(serializer.errors)
+        try:
+            self.perform_bulk_create(serializer, self.get_bulk_client())
+        except BatchBookingConflict as e:
+            return self.bulk_error_response(e.item_errors, e.status_code)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @bulk_create.mapping.put
+    def bulk_update(self, request):
+        items = self.bulk_items(request)
+        ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+        instances = self.get_queryset().in_bulk([pk for pk in ids if isinstance(pk, int)])
+        missing = [
+            (index, {'id': ['Object not found']})
+            for index, pk in enumerate(ids) if instances.get(pk) is None
+        ]
+        if missing:
+            return self.bulk_error_response(dict(missing))
+        serializer = self.get_serializer(
+            instance=[instances[pk] for pk in ids], data=items, many=True
+        )
+        if not serializer.is_valid():
+            return self.bulk_error_response(serializer.errors)
+        try:
+            self.perform_bulk_update(serializer)
+        except BatchBookingConflict as e:
+            return self.bulk_error_response(e.item_errors, e.status_code)
+        return Response(serializer.data)
+
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request):
+        ids = self.bulk_items(request)
+        if not all(isinstance(pk, int) for pk in ids):
+            raise serializers.ValidationError({'errors': ['Expected a list of ids']})
+        with transaction.atomic():
+            deleted, _ = self.get_queryset().filter(pk__in=ids).delete()
+        return Response({'deleted': deleted})
 
 class ClientViewSet(BaseModelViewSet):
     queryset = Client.objects.all()
     serializer_class = ClientSerializer
     http_method_names = ['get', 'post', 'put', 'delete']
+    stats_scope = 'clients'
     permission_classes = [IsAuthenticated]
 
     class StatsSerializer(serializers.Serializer):
@@ -114,41 +255,61 @@ class ClientViewSet(BaseModelViewSet):
 
     @action(detail=False, methods=["GET"], url_path="stats")
     def get_stats(self, request):
+        stats = self.cached_stats()
+        serializer = self.StatsSerializer(instance=stats)
+        return Response(serializer.data)
+
+    def compute_stats(self):
         queryset = self.get_queryset()
-        if not queryset.exists():
-            return Response({
+        # Один проход: LEFT JOIN на записи, клиенты считаются через DISTINCT
+        counts = queryset.aggregate(
+            total_clients=Count('id', distinct=True),
+            clients_with_email=Count('id', distinct=True, filter=~Q(email='')),
+            total_appointments=Count('appointment'),
+        )
+        if not counts['total_clients']:
+            return {
                 'total_clients': 0,
                 'clients_with_email': 0,
                 'most_popular_service': None,
                 'appointments_per_client': None
-            })
+            }
 
         service_stats = queryset.values('service__name')\
             .annotate(count=Count('service'))\
             .order_by('-count').first()
 
-        stats = {
-            'total_clients': queryset.count(),
-            'clients_with_email': queryset.exclude(email='').count(),
+        return {
+            'total_clients': counts['total_clients'],
+            'clients_with_email': counts['clients_with_email'],
             'most_popular_service': service_stats['service__name'] if service_stats else None,
-            'appointments_per_client': Appointment.objects.filter(
-                client__in=queryset
-            ).count() / queryset.count() if queryset.exists() else None
+            'appointments_per_client': counts['total_appointments'] / counts['total_clients']
         }
-        
-        serializer = self.StatsSerializer(instance=stats)
-        return Response(serializer.data)
 
     def get_queryset(self):
-        return Client.objects.filter(user=self.request.user)
+        return self.shape_queryset(Client.objects.filter(user=self.request.user))
+
+    def get_stats_owner(self, user):
+        # Клиенты всегда только свои, даже у суперпользователя
+        return user.id
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class ServiceViewSet(BaseModelViewSet):
+class ServiceViewSet(ExcelExportMixin, ConditionalListMixin, BaseModelViewSet):
     queryset = Service.objects.all()
     serializer_class = ServiceSerializer
     http_method_names = ['get', 'post', 'put', 'delete']
+    stats_scope = 'services'
+    stats_per_user = False
+    # Версия 'service' меняется и с отзывами - в списке есть рейтинг
+    conditional_tables = ('service',)
+    queryset_shapes = {
+        # Рейтинг в ServiceSerializer читается из сводки - джойним ее в тот же запрос
+        'default': {'select_related': ('rating_summary',)},
+        'export_excel': {},
+        'get_stats': {},
+    }
 
     def get_permissions(self):
         if self.action == 'destroy':
@@ -167,70 +328,41 @@ class ServiceViewSet(BaseModelViewSet):
 
     @action(detail=False, methods=["GET"], url_path="stats")
     def get_stats(self, request):
-        queryset = self.get_queryset()
-        if not queryset.exists():
-            return Response({
-                'total_services': 0,
-                'avg_price': 0,
-                'max_price': 0,
-                'min_price': 0,
-                'avg_duration': 0,
-                'total_revenue': 0
-            })
-        
-        stats = queryset.aggregate(
+        stats = self.cached_stats()
+        serializer = self.StatsSerializer(instance=stats)
+        return Response(serializer.data)
+
+    def compute_stats(self):
+        stats = self.get_queryset().aggregate(
             total_services=Count("*"),
             avg_price=Avg("price"),
             max_price=Max("price"),
             min_price=Min("price"),
             avg_duration=Avg("duration"),
-            total_revenue=Sum("price")
         )
-        serializer = self.StatsSerializer(instance=stats)
-        return Response(serializer.data)
+        if not stats['total_services']:
+            return {
+                'total_services': 0,
+                'avg_price': 0,
+                'max_price': 0,
+                'min_price': 0,
+                'avg_duration': 0,
+                'total_revenue': 0
+            }
+        # Выручка - цены услуг по всем записям, из дневной сводки, а не сумма прайс-листа
+        return {**stats, 'total_revenue': total_revenue()}
 
     def perform_create(self, serializer):
         serializer.save()
 
-    @action(detail=False, methods=['GET'], url_path='export-excel')
-    def export_excel(self, request):
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Услуги"
-
-        # Заголовки
+    def export_table(self):
         headers = ['Название', 'Цена', 'Длительность (мин)']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col)
-            cell.value = header
-            cell.font = Font(bold=True)
-
-        # Данные
-        queryset = self.get_queryset()
-        for row, service in enumerate(queryset, 2):
-            ws.cell(row=row, column=1, value=service.name)
-            ws.cell(row=row, column=2, value=float(service.price))
-            ws.cell(row=row, column=3, value=service.duration)
-
-        # Автоатическая ширина колонок
-        for column in ws.columns:
-            max_length = 0
-            column_letter = openpyxl.utils.get_column_letter(column[0].column)
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column_letter].width = adjusted_width
-
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        queryset = self.get_queryset().values_list('name', 'price', 'duration')
+        rows = (
+            (name, float(price), duration)
+            for name, price, duration in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
         )
-        response['Content-Disposition'] = 'attachment; filename=services.xlsx'
-        wb.save(response)
-        return response
+        return 'services.xlsx', "Услуги", headers, rows
 
     def destroy(self, request, *args, **kwargs):
         try:
@@ -238,16 +370,28 @@ class ServiceViewSet(BaseModelViewSet):
             self.perform_destroy(instance)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Exception as e:
-            print(f"Error deleting service: {str(e)}")  # Для отладки
+            logger.warning('Error deleting service %s: %s', kwargs, e)
             return Response(
                 {'detail': str(e)}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-class MasterViewSet(BaseModelViewSet):
+class MasterViewSet(ExcelExportMixin, ConditionalListMixin, BaseModelViewSet):
     queryset = Master.objects.all()
     serializer_class = MasterSerializer
     http_method_names = ['get', 'post', 'put', 'delete']
+    stats_scope = 'masters'
+    stats_per_user = False
+    conditional_tables = ('master',)
+    queryset_shapes = {
+        # MasterSerializer отдает список id услуг - без prefetch это запрос на каждого мастера
+        'default': {'prefetch_related': ('services',)},
+        'export_excel': {
+            'prefetch_related': (Prefetch('services', queryset=Service.objects.only('id', 'name')),),
+        },
+        'get_stats': {},
+        'utilization': {},
+    }
 
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
@@ -262,76 +406,90 @@ class MasterViewSet(BaseModelViewSet):
 
     @action(detail=False, methods=["GET"], url_path="stats")
     def get_stats(self, request):
+        stats = self.cached_stats()
+        serializer = self.StatsSerializer(instance=stats)
+        return Response(serializer.data)
+
+    def compute_stats(self):
         queryset = self.get_queryset()
-        if not queryset.exists():
-            return Response({
+        # LEFT JOIN на услуги: мастера считаем через DISTINCT, связи - все строки
+        counts = queryset.aggregate(
+            total_masters=Count('id', distinct=True),
+            service_links=Count('services'),
+        )
+        if not counts['total_masters']:
+            return {
                 'total_masters': 0,
                 'avg_services_per_master': None,
                 'most_common_specialization': None,
                 'busiest_master': None
-            })
+            }
 
         busiest = queryset.annotate(
             appointments_count=Count('appointment')
-        ).order_by('-appointments_count').first()
+        ).order_by('-appointments_count').values('name').first()
 
         spec_stats = queryset.values('specialization')\
             .annotate(count=Count('specialization'))\
             .order_by('-count').first()
 
-        stats = {
-            'total_masters': queryset.count(),
-            'avg_services_per_master': queryset.annotate(
-                service_count=Count('services')
-            ).aggregate(avg=Avg('service_count'))['avg'],
+        return {
+            'total_masters': counts['total_masters'],
+            'avg_services_per_master': counts['service_links'] / counts['total_masters'],
             'most_common_specialization': spec_stats['specialization'] if spec_stats else None,
-            'busiest_master': busiest.name if busiest else None
+            'busiest_master': busiest['name'] if busiest else None
         }
-        
-        serializer = self.StatsSerializer(instance=stats)
-        return Response(serializer.data)
-
-    @action(detail=False, methods=['GET'], url_path='export-excel')
-    def export_excel(self, request):
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Мастера"
 
+    def export_table(self):
         headers = ['ФИО', 'Специализация', 'Услуги']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col)
-            cell.value = header
-            cell.font = Font(bold=True)
-
+        # prefetch_related работает вместе с iterator() при заданном chunk_size:
+        # услуги подгружаются одним запросом на каждую пачку мастеров
         queryset = self.get_queryset()
-        for row, master in enumerate(queryset, 2):
-            ws.cell(row=row, column=1, value=master.name)
-            ws.cell(row=row, column=2, value=master.specialization)
-            ws.cell(row=row, column=3, value=', '.join([s.name for s in master.services.all()]))
-
-        for column in ws.columns:
-            max_length = 0
-            column_letter = openpyxl.utils.get_column_letter(column[0].column)
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column_letter].width = adjusted_width
-
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        rows = (
+            (master.name, master.specialization, ', '.join([s.name for s in master.services.all()]))
+            for master in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
         )
-        response['Content-Disposition'] = 'attachment; filename=masters.xlsx'
-        wb.save(response)
-        return response
+        return 'masters.xlsx', "Мастера", headers, rows
+
+    @action(detail=False, methods=['GET'], url_path='utilization', permission_classes=[IsAdminUser])
+    def utilization(self, request):
+        """
+        Загрузка мастеров за ?from=&to= (необязательно &master=): доля
+        занятых минут по дням недели и часам, средняя и перцентили по часам
+        рабочего дня. Только для персонала, как и аналитика.
+        """
+        query = UtilizationQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        masters = self.get_queryset()
+        if 'master' in params:
+            masters = masters.filter(pk=params['master'].pk)
+        names = dict(masters.order_by('id').values_list('id', 'name'))
+
+        def compute():
+            return master_utilization(params['from'], params['to'], list(names), filter_masters='master' in params)
+
+        owner = params['master'].pk if 'master' in params else 'all'
+        result = get_cached_stats('utilization', owner, compute, params['from'], params['to'])
+        return Response({
+            'from': params['from'],
+            'to': params['to'],
+            'masters': [dict(item, name=names[item['master']]) for item in result],
+        })
 
-class AppointmentViewSet(BaseModelViewSet):
+class AppointmentViewSet(ExcelExportMixin, BulkWriteMixin, BaseModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
     http_method_names = ['get', 'post', 'put', 'delete']
+    stats_scope = 'appointments'
+    pagination_class = DateCursorPagination
+    queryset_shapes = {
+        # В выгрузке нужны только имена связанных объектов - один JOIN вместо трех запросов на строку
+        'export_excel': {
+            'select_related': ('client', 'service', 'master'),
+            'only': ('date', 'client__name', 'service__name', 'master__name'),
+        },
+    }
 
     class StatsSerializer(serializers.Serializer):
         total_appointments = serializers.IntegerField()
@@ -342,21 +500,33 @@ class AppointmentViewSet(BaseModelViewSet):
 
     @action(detail=False, methods=["GET"], url_path="stats")
     def get_stats(self, request):
+        stats = self.cached_stats()
+        serializer = self.StatsSerializer(instance=stats)
+        return Response(serializer.data)
+
+    def compute_stats(self):
         from django.utils import timezone
         from django.db.models.functions import TruncDate
 
         queryset = self.get_queryset()
-        if not queryset.exists():
-            return Response({
+        today = timezone.localdate()
+        day_start, day_end = day_range(today)
+        month_start, month_end = month_range(today)
+
+        counts = queryset.aggregate(
+            total_appointments=Count('id'),
+            appointments_today=Count('id', filter=Q(date__gte=day_start, date__lt=day_end)),
+            appointments_this_month=Count('id', filter=Q(date__gte=month_start, date__lt=month_end)),
+        )
+        if not counts['total_appointments']:
+            return {
                 'total_appointments': 0,
                 'appointments_today': 0,
                 'appointments_this_month': 0,
                 'most_popular_service': None,
                 'busiest_day': None
-            })
+            }
 
-        today = timezone.now().date()
-        
         service_stats = queryset.values('service__name')\
             .annotate(count=Count('service'))\
             .order_by('-count').first()
@@ -367,19 +537,11 @@ class AppointmentViewSet(BaseModelViewSet):
         .annotate(count=Count('id'))\
         .order_by('-count').first()
 
-        stats = {
-            'total_appointments': queryset.count(),
-            'appointments_today': queryset.filter(date__date=today).count(),
-            'appointments_this_month': queryset.filter(
-                date__year=today.year,
-                date__month=today.month
-            ).count(),
+        return {
+            **counts,
             'most_popular_service': service_stats['service__name'] if service_stats else None,
             'busiest_day': busiest_day['date_only'] if busiest_day else None
         }
-        
-        serializer = self.StatsSerializer(instance=stats)
-        return Response(serializer.data)
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -387,63 +549,81 @@ class AppointmentViewSet(BaseModelViewSet):
             return qs.filter(client__user=self.request.user)
         return qs
 
+    @action(detail=False, methods=['GET'], url_path='free-slots')
+    def free_slots(self, request):
+        query = FreeSlotsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        service = query.validated_data['service']
+
+        masters = Master.objects.filter(services=service)
+        if 'master' in query.validated_data:
+            masters = masters.filter(pk=query.validated_data['master'].pk)
+        master_names = dict(masters.order_by('id').values_list('id', 'name'))
+
+        slots = find_free_slots(
+            master_names,
+            service.duration,
+            query.validated_data['date_from'],
+            query.validated_data['date_to'],
+        )
+        return Response([
+            {'master': master_id, 'master_name': master_names[master_id], 'start': start}
+            for master_id, start in slots
+        ])
+
     def perform_create(self, serializer):
         # Берем первого клиента пользователя
-        client = Client.objects.filter(user=self.request.user).first()
+        client = client_for(self.request.user)
         if not client:
             raise serializers.ValidationError("Client profile not found for current user")
-        serializer.save(client=client)
+        data = serializer.validated_data
+        with booking_guard(data['master'], data['service'], data['date']):
+            serializer.save(client=client)
 
-    @action(detail=False, methods=['GET'], url_path='export-excel')
-    def export_excel(self, request):
-        # Создаем новый excel файл
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Записи"
+    def perform_bulk_create(self, serializer, client):
+        items = [(data['master'].pk, data['date'], data['service'].duration)
+                 for data in serializer.validated_data]
+        with bulk_booking_guard(items):
+            serializer.save(client=client)
 
-        # аголовки
+    def perform_bulk_update(self, serializer):
+        items = [(data['master'].pk, data['date'], data['service'].duration)
+                 for data in serializer.validated_data]
+        with bulk_booking_guard(items, exclude_ids=[obj.pk for obj in serializer.instance]):
+            serializer.save()
+
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        data = serializer.validated_data
+        with booking_guard(
+            data.get('master', instance.master),
+            data.get('service', instance.service),
+            data.get('date', instance.date),
+            exclude_id=instance.pk,
+        ):
+            serializer.save()
+
+    def export_table(self):
         headers = ['Клиент', 'Услуга', 'Мастер', 'Дата', 'Время']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col)
-            cell.value = header
-            cell.font = Font(bold=True)
-
-        # Данные
         queryset = self.get_queryset()
-        for row, appointment in enumerate(queryset, 2):
-            ws.cell(row=row, column=1, value=appointment.client.name)
-            ws.cell(row=row, column=2, value=appointment.service.name)
-            ws.cell(row=row, column=3, value=appointment.master.name)
-            ws.cell(row=row, column=4, value=appointment.date.strftime('%d.%m.%Y'))
-            ws.cell(row=row, column=5, value=appointment.date.strftime('%H:%M'))
-
-        # Автоматическая ширина колонок
-        for column in ws.columns:
-            max_length = 0
-            column_letter = openpyxl.utils.get_column_letter(column[0].column)
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column_letter].width = adjusted_width
-
-        # Создаем HTTP response
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        rows = (
+            (
+                appointment.client.name,
+                appointment.service.name,
+                appointment.master.name,
+                appointment.date.strftime('%d.%m.%Y'),
+                appointment.date.strftime('%H:%M'),
+            )
+            for appointment in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
         )
-        response['Content-Disposition'] = 'attachment; filename=appointments.xlsx'
+        return 'appointments.xlsx', "Записи", headers, rows
 
-        # Сохраняем файл
-        wb.save(response)
-        return response
-
-class ReviewViewSet(BaseModelViewSet):
+class ReviewViewSet(BulkWriteMixin, BaseModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
     http_method_names = ['get', 'post', 'put', 'delete']
+    stats_scope = 'reviews'
+    pagination_class = DateCursorPagination
 
     class StatsSerializer(serializers.Serializer):
         total_reviews = serializers.IntegerField()
@@ -454,30 +634,54 @@ class ReviewViewSet(BaseModelViewSet):
 
     @action(detail=False, methods=["GET"], url_path="stats")
     def get_stats(self, request):
+        stats = self.cached_stats()
+        serializer = self.StatsSerializer(instance=stats)
+        return Response(serializer.data)
+
+    def compute_stats(self):
+        if self.request.user.is_superuser:
+            return self.compute_summary_stats()
         queryset = self.get_queryset()
-        if not queryset.exists():
-            return Response({
+        counts = queryset.aggregate(
+            total_reviews=Count('id'),
+            avg_rating=Avg('rating'),
+            five_star_reviews=Count('id', filter=Q(rating=5)),
+            one_star_reviews=Count('id', filter=Q(rating=1)),
+        )
+        if not counts['total_reviews']:
+            return {
                 'total_reviews': 0,
                 'avg_rating': None,
                 'five_star_reviews': 0,
                 'one_star_reviews': 0,
                 'most_reviewed_service': None
-            })
+            }
 
         service_stats = queryset.values('service__name')\
             .annotate(count=Count('service'))\
             .order_by('-count').first()
 
-        stats = {
-            'total_reviews': queryset.count(),
-            'avg_rating': queryset.aggregate(Avg('rating'))['rating__avg'],
-            'five_star_reviews': queryset.filter(rating=5).count(),
-            'one_star_reviews': queryset.filter(rating=1).count(),
+        return {
+            **counts,
             'most_reviewed_service': service_stats['service__name'] if service_stats else None
         }
-        
-        serializer = self.StatsSerializer(instance=stats)
-        return Response(serializer.data)
+
+    def compute_summary_stats(self):
+        # Суперпользователь видит все отзывы - их сводка уже лежит в ServiceRating
+        summaries = ServiceRating.objects.filter(count__gt=0)
+        totals = summaries.aggregate(
+            total_reviews=Sum('count', default=0),
+            rating_sum=Sum('total', default=0),
+            five_star_reviews=Sum('stars_5', default=0),
+            one_star_reviews=Sum('stars_1', default=0),
+        )
+        rating_sum = totals.pop('rating_sum')
+        return {
+            **totals,
+            'avg_rating': rating_sum / totals['total_reviews'] if totals['total_reviews'] else None,
+            'most_reviewed_service': summaries.order_by('-count')
+                .values_list('service__name', flat=True).first(),
+        }
 
     def get_queryset(self):
         qs = super().get_queryset()
@@ -488,13 +692,119 @@ class ReviewViewSet(BaseModelViewSet):
     def perform_create(self, serializer):
         try:
             # Используем filter().first() вместо get()
-            client = Client.objects.filter(user=self.request.user).first()
+            client = client_for(self.request.user)
             if not client:
                 raise serializers.ValidationError("Client profile not found for current user")
             serializer.save(client=client)
         except Exception as e:
             raise serializers.ValidationError(str(e))
 
+class SearchViewSet(viewsets.ViewSet):
+    """
+    /api/search/?q= - полнотекстовый поиск по услугам, мастерам и отзывам,
+    по убыванию релевантности. Страницы - ?page=&page_size=.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def list(self, request):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        page, page_size = params['page'], params['page_size']
+        # Лишняя строка показывает, есть ли следующая страница, без COUNT по индексу
+        results = search(
+            params['q'], kinds=params.get('kind'), user=request.user,
+            limit=page_size + 1, offset=(page - 1) * page_size,
+        )
+        return Response({
+            'next': self.page_url(request, page + 1) if len(results) > page_size else None,
+            'previous': self.page_url(request, page - 1) if page > 1 else None,
+            'results': SearchResultSerializer(results[:page_size], many=True).data,
+        })
+
+    @staticmethod
+    def page_url(request, page):
+        query = request.query_params.copy()
+        query['page'] = page
+        return request.build_absolute_uri(f'{request.path}?{query.urlencode()}')
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    """
+    Графики по сводкам записей (rollups.py): /api/analytics/timeseries/?metric=
+    &granularity=&from=&to=, необязательно &service= и &master=. Выручка
+    всего салона - только персоналу.
+    """
+    permission_classes = [IsAdminUser]
+
+    @action(detail=False, methods=['GET'])
+    def timeseries(self, request):
+        query = TimeseriesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        points = timeseries(
+            params['metric'], params['granularity'], params['from'], params['to'],
+            service_id=params.get('service'), master_id=params.get('master'),
+        )
+        return Response({
+            'metric': params['metric'],
+            'granularity': params['granularity'],
+            'points': [{'start': start, 'value': value} for start, value in points],
+        })
+
+# Вид фоновой выгрузки -> ViewSet, который описывает ее таблицу
+EXPORT_VIEWSETS = {
+    'appointments': AppointmentViewSet,
+    'masters': MasterViewSet,
+    'services': ServiceViewSet,
+}
+
+def export_table(kind, user):
+    """Таблица выгрузки kind такой, какой ее получил бы user из GET export-excel"""
+    request = Request(HttpRequest())
+    request.user = user
+    view = EXPORT_VIEWSETS[kind](action='export_excel', request=request, args=(), kwargs={}, format_kwarg=None)
+    return view.export_table()
+
+class ExportJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                       mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Фоновые выгрузки (export_jobs.py): POST {"kind": ...} ставит задание в
+    очередь или возвращает свежее такое же, GET /<id>/ - статус,
+    /<id>/download/ - готовый файл.
+    """
+    serializer_class = ExportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return visible_jobs(self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job, _ = request_export(serializer.validated_data['kind'], request.user)
+        # 202 - файл еще собирается, статус нужно опрашивать по Location
+        in_progress = job.status in (ExportJob.PENDING, ExportJob.RUNNING)
+        return Response(
+            self.get_serializer(job).data,
+            status=status.HTTP_202_ACCEPTED if in_progress else status.HTTP_200_OK,
+            headers={'Location': reverse('exports-detail', args=[job.pk], request=request)},
+        )
+
+    @action(detail=True, methods=['GET'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ExportJob.DONE:
+            return Response(
+                {'detail': f'Export is {job.status}', 'status': job.status},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return FileResponse(
+            job.file.open('rb'),
+            as_attachment=True,
+            filename=f'{job.kind}.xlsx',
+            content_type=XLSX_CONTENT_TYPE,
+        )
+
 class UserViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     
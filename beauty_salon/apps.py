@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BeautySalonConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'beauty_salon'
+
+    def ready(self):
+        from . import signals  # noqa: F401
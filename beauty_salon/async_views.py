@@ -0,0 +1,170 @@
+"""
+Асинхронные версии горячих GET-эндпоинтов для запуска под ASGI.
+
+DRF-представления синхронные и под ASGI выполняются по одному в
+thread-sensitive адаптере. Здесь чтение идет через асинхронный ORM
+(aget, async for) и асинхронный кэш, поэтому один воркер обслуживает
+много медленных клиентов одновременно. Формат ответов совпадает с /api/.
+"""
+from functools import wraps
+
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_GET
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor
+from rest_framework.request import Request
+
+from .api import (
+    ClientViewSet, ServiceViewSet, MasterViewSet, AppointmentViewSet, ReviewViewSet
+)
+from .authentication import aauthenticate_token
+from .availability import afind_free_slots
+from .conditional import atable_versions, conditional_response, set_validators
+from .models import Service, Master
+from .pagination import IdCursorPagination
+from .serializers import ServiceSerializer, MasterSerializer, SlotRangeSerializer
+from .stats import aget_cached_stats
+
+STATS_VIEWSETS = {
+    'clients': ClientViewSet,
+    'services': ServiceViewSet,
+    'masters': MasterViewSet,
+    'appointments': AppointmentViewSet,
+    'reviews': ReviewViewSet,
+}
+
+
+async def aauthenticate(request):
+    """Token из заголовка Authorization, иначе пользователь сессии"""
+    keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword == 'Token' and key:
+        return await aauthenticate_token(key.strip())
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+def login_required_async(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await aauthenticate(request)
+        if user is None:
+            return JsonResponse(
+                {'detail': 'Authentication credentials were not provided.'}, status=401
+            )
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def paginated(request, queryset, serializer_class):
+    """
+    Страница по id с теми же курсорами ?cursor=, что у IdCursorPagination:
+    ссылки next и previous можно передавать между /api/ и /api/async/.
+    """
+    paginator = IdCursorPagination()
+    # Сериализаторы ждут DRF Request (для ?fields= и абсолютных URL картинок)
+    drf_request = Request(request)
+    try:
+        cursor = paginator.decode_cursor(drf_request)
+    except NotFound:
+        raise Http404
+    page_size = paginator.get_page_size(drf_request)
+    paginator.base_url = request.build_absolute_uri()
+
+    reverse = cursor is not None and cursor.reverse
+    if cursor is None:
+        queryset = queryset.order_by('id')
+    elif reverse:
+        queryset = queryset.filter(id__lt=cursor.position).order_by('-id')
+    else:
+        queryset = queryset.filter(id__gt=cursor.position).order_by('id')
+    objects = [obj async for obj in queryset[:page_size + 1]]
+    has_more = len(objects) > page_size
+    objects = objects[:page_size]
+    if reverse:
+        objects.reverse()
+    # Шаг назад значит, что впереди есть страница; шаг вперед - что есть позади
+    has_next = has_more or reverse
+    has_previous = has_more if reverse else cursor is not None
+
+    def link(position, reverse):
+        return paginator.encode_cursor(Cursor(offset=0, reverse=reverse, position=str(position)))
+
+    return JsonResponse({
+        'next': link(objects[-1].id, False) if objects and has_next else None,
+        'previous': link(objects[0].id, True) if objects and has_previous else None,
+        'results': serializer_class(objects, many=True, context={'request': drf_request}).data,
+    })
+
+
+async def conditional(request, viewset_class, queryset, serializer_class):
+    # Те же версии таблиц, что у DRF-списка: 304 без запросов к БД
+    versions = await atable_versions(viewset_class.conditional_tables)
+    response = conditional_response(request, versions)
+    if response is None:
+        response = await paginated(request, queryset, serializer_class)
+    return set_validators(response, versions)
+
+
+@require_GET
+@login_required_async
+async def services(request):
+    return await conditional(
+        request, ServiceViewSet, Service.objects.select_related('rating_summary'), ServiceSerializer
+    )
+
+
+@require_GET
+@login_required_async
+async def masters(request):
+    return await conditional(
+        request, MasterViewSet, Master.objects.prefetch_related('services'), MasterSerializer
+    )
+
+
+class FreeSlotsParamsSerializer(SlotRangeSerializer):
+    # id без проверки через БД: синхронный PrimaryKeyRelatedField здесь недоступен
+    service = serializers.IntegerField()
+    master = serializers.IntegerField(required=False)
+
+
+@require_GET
+@login_required_async
+async def free_slots(request):
+    params = FreeSlotsParamsSerializer(data=request.GET)
+    if not params.is_valid():
+        return JsonResponse(params.errors, status=400)
+    data = params.validated_data
+    try:
+        service = await Service.objects.aget(pk=data['service'])
+    except Service.DoesNotExist:
+        return JsonResponse({'service': ['Object does not exist.']}, status=400)
+
+    masters = Master.objects.filter(services=service)
+    if 'master' in data:
+        masters = masters.filter(pk=data['master'])
+    master_names = {
+        master_id: name
+        async for master_id, name in masters.order_by('id').values_list('id', 'name')
+    }
+
+    slots = await afind_free_slots(master_names, service.duration, data['date_from'], data['date_to'])
+    return JsonResponse([
+        {'master': master_id, 'master_name': master_names[master_id], 'start': start.isoformat()}
+        for master_id, start in slots
+    ], safe=False)
+
+
+@require_GET
+@login_required_async
+async def stats(request, scope):
+    viewset_class = STATS_VIEWSETS.get(scope)
+    if viewset_class is None:
+        raise Http404
+    # Экземпляр ViewSet нужен только ради get_queryset/compute_stats на промахе кэша
+    view = viewset_class(request=request, action='get_stats', format_kwarg=None, kwargs={})
+    result = await aget_cached_stats(
+        view.stats_scope, view.get_stats_owner(request.user), view.compute_stats
+    )
+    return JsonResponse(view.StatsSerializer(instance=result).data)
@@ -0,0 +1,96 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import Client
+
+# Сколько живет закэшированный токен, даже если сигнал об изменении потерялся
+TOKEN_CACHE_TIMEOUT = 5 * 60
+
+PRINCIPAL_FIELDS = (
+    'id', 'username', 'email', 'first_name', 'last_name',
+    'is_active', 'is_staff', 'is_superuser', 'date_joined',
+)
+
+
+def token_cache_key(key):
+    return f'auth_token:{key}'
+
+
+def forget_token(key):
+    cache.delete(token_cache_key(key))
+
+
+def forget_user_tokens(user_id):
+    # Токенов мало и меняются они редко - ключ берем из БД только при записи
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        forget_token(key)
+
+
+def user_principal(user, client_id):
+    """Компактный пользователь для кэша: поля User и id его клиента"""
+    principal = {field: getattr(user, field) for field in PRINCIPAL_FIELDS}
+    principal['client_id'] = client_id
+    return principal
+
+
+def principal_to_user(principal):
+    """User без обращения к БД; id клиента лежит в cached_client_id"""
+    user = User(**{field: principal[field] for field in PRINCIPAL_FIELDS})
+    user._state.adding = False
+    user._state.db = 'default'
+    user.cached_client_id = principal['client_id']
+    return user
+
+
+def client_for(user):
+    """
+    Профиль клиента пользователя. Для пользователя из CachedTokenAuthentication
+    запроса нет: возвращается Client только с id - этого достаточно, чтобы
+    сохранить внешний ключ.
+    """
+    if hasattr(user, 'cached_client_id'):
+        if user.cached_client_id is None:
+            return None
+        return Client(pk=user.cached_client_id, user_id=user.pk)
+    return Client.objects.filter(user=user).first()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication, которая хранит в кэше компактного пользователя
+    (поля User и id его клиента) по ключу токена. В установившемся режиме
+    запрос проходит аутентификацию без запросов к БД. Кэш сбрасывается
+    при logout, удалении токена и сохранении пользователя или клиента.
+    """
+
+    def authenticate_credentials(self, key):
+        principal = cache.get(token_cache_key(key))
+        if principal is None:
+            user, _ = super().authenticate_credentials(key)
+            client_id = Client.objects.filter(user=user).values_list('id', flat=True).first()
+            principal = user_principal(user, client_id)
+            cache.set(token_cache_key(key), principal, TOKEN_CACHE_TIMEOUT)
+        user = principal_to_user(principal)
+        return (user, Token(key=key, user=user))
+
+
+async def aauthenticate_token(key):
+    """
+    Асинхронный CachedTokenAuthentication: пользователь по ключу токена
+    или None. Промах заполняет тот же кэш, поэтому синхронные и
+    асинхронные эндпоинты получают одинакового пользователя.
+    """
+    principal = await cache.aget(token_cache_key(key))
+    if principal is None:
+        try:
+            token = await Token.objects.select_related('user').aget(key=key)
+        except Token.DoesNotExist:
+            return None
+        if not token.user.is_active:
+            return None
+        client_id = await Client.objects.filter(user_id=token.user_id).values_list('id', flat=True).afirst()
+        principal = user_principal(token.user, client_id)
+        await cache.aset(token_cache_key(key), principal, TOKEN_CACHE_TIMEOUT)
+    return principal_to_user(principal)
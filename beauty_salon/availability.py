@@ -0,0 +1,234 @@
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, time, timedelta
+from time import time_ns
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Appointment
+
+# Рабочее время салона и шаг сетки, по которой предлагаются слоты
+WORKDAY_START = time(9, 0)
+WORKDAY_END = time(21, 0)
+SLOT_STEP = timedelta(minutes=30)
+# Максимальный диапазон поиска свободных слотов за один запрос
+MAX_SLOT_SEARCH_RANGE = timedelta(days=31)
+# Прошлые записи старше этого не нужны для поиска будущих слотов
+INDEX_HORIZON = timedelta(days=1)
+AVAILABILITY_VERSION_KEY = 'availability_version'
+
+
+class BookingIndex:
+    """
+    Занятые интервалы [date, date + duration) каждого мастера в памяти процесса.
+
+    Строится одним запросом и дальше обновляется сигналами на запись
+    Appointment. Другие процессы сообщают о своих изменениях через
+    счетчик версии в кэше: если он ушел вперед, индекс перестраивается.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Время хранится в секундах epoch: сравнение int заметно быстрее aware datetime
+        self._intervals = {}  # master_id -> отсортированный список (start, end, appointment_id)
+        self._by_appointment = {}  # appointment_id -> (master_id, start, end)
+        self._max_length = 0
+        self._version = None
+        self._built = False
+
+    @staticmethod
+    def _rows():
+        horizon = timezone.now() - INDEX_HORIZON
+        return Appointment.objects.filter(date__gte=horizon)\
+            .values_list('id', 'master_id', 'date', 'service__duration')
+
+    def rebuild(self):
+        # Версию читаем до запроса: изменение во время чтения вызовет еще одну перестройку
+        version = current_version()
+        self._load(self._rows().iterator(chunk_size=5000), version)
+
+    async def arebuild(self):
+        version = await acurrent_version()
+        # aiterator() для values_list в Django 5.x выполняет запрос синхронно, поэтому async for по queryset
+        rows = [row async for row in self._rows()]
+        self._load(rows, version)
+
+    def _load(self, rows, version):
+        intervals = {}
+        by_appointment = {}
+        max_length = 0
+        for appointment_id, master_id, date, duration in rows:
+            start = int(date.timestamp())
+            length = duration * 60
+            end = start + length
+            intervals.setdefault(master_id, []).append((start, end, appointment_id))
+            by_appointment[appointment_id] = (master_id, start, end)
+            max_length = max(max_length, length)
+        for master_intervals in intervals.values():
+            master_intervals.sort()
+        with self._lock:
+            self._intervals = intervals
+            self._by_appointment = by_appointment
+            self._max_length = max_length
+            self._version = version
+            self._built = True
+
+    def invalidate(self):
+        """Сбросить индекс во всех процессах (например, после смены длительности услуги)"""
+        bump_version()
+        with self._lock:
+            self._version = None
+
+    def ensure_fresh(self):
+        if not self._built or self._version != current_version():
+            self.rebuild()
+
+    async def aensure_fresh(self):
+        if not self._built or self._version != await acurrent_version():
+            await self.arebuild()
+
+    def _remove(self, appointment_id):
+        old = self._by_appointment.pop(appointment_id, None)
+        if old is None:
+            return
+        master_id, start, end = old
+        master_intervals = self._intervals.get(master_id, [])
+        pos = bisect_left(master_intervals, (start, end, appointment_id))
+        if pos < len(master_intervals) and master_intervals[pos][2] == appointment_id:
+            del master_intervals[pos]
+
+    def _apply(self, change):
+        """Применяет локальное изменение и сдвигает версию вслед за кэшем"""
+        new_version = bump_version()
+        with self._lock:
+            if not self._built:
+                return
+            change()
+            if self._version is not None and new_version == self._version + 1:
+                self._version = new_version
+            else:
+                # Между нашими изменениями писал кто-то еще - перестроимся при поиске
+                self._version = None
+
+    def add(self, appointment_id, master_id, start, duration):
+        def change():
+            self._remove(appointment_id)
+            if start + timedelta(minutes=duration) < timezone.now() - INDEX_HORIZON:
+                return
+            length = duration * 60
+            begin = int(start.timestamp())
+            end = begin + length
+            insort(self._intervals.setdefault(master_id, []), (begin, end, appointment_id))
+            self._by_appointment[appointment_id] = (master_id, begin, end)
+            self._max_length = max(self._max_length, length)
+        self._apply(change)
+
+    def remove(self, appointment_id):
+        self._apply(lambda: self._remove(appointment_id))
+
+    def busy(self, master_id, start, end):
+        """Объединенные занятые интервалы мастера, пересекающие [start, end) (в секундах epoch)"""
+        with self._lock:
+            master_intervals = self._intervals.get(master_id, [])
+            lo = bisect_left(master_intervals, (start - self._max_length,))
+            hi = bisect_left(master_intervals, (end,))
+            candidates = master_intervals[lo:hi]
+        merged = []
+        for busy_start, busy_end, _ in candidates:
+            if busy_end <= start:
+                continue
+            if merged and busy_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], busy_end)
+            else:
+                merged.append([busy_start, busy_end])
+        return merged
+
+    def is_free(self, master_id, start, end):
+        return not self.busy(master_id, int(start.timestamp()), int(end.timestamp()))
+
+
+def _initial_version():
+    # Если ключ вытеснен из кэша, новая версия не должна совпасть с версией индекса
+    return time_ns()
+
+
+def current_version():
+    return cache.get_or_set(AVAILABILITY_VERSION_KEY, _initial_version, None)
+
+
+async def acurrent_version():
+    return await cache.aget_or_set(AVAILABILITY_VERSION_KEY, _initial_version, None)
+
+
+def bump_version():
+    try:
+        return cache.incr(AVAILABILITY_VERSION_KEY)
+    except ValueError:
+        version = _initial_version()
+        cache.set(AVAILABILITY_VERSION_KEY, version, None)
+        return version
+
+
+booking_index = BookingIndex()
+
+
+def day_slots(day, duration):
+    """Начала слотов в рабочем дне, в которые услуга успевает закончиться"""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(day, WORKDAY_START), tz)
+    day_end = timezone.make_aware(datetime.combine(day, WORKDAY_END), tz)
+    length = timedelta(minutes=duration)
+    while start + length <= day_end:
+        yield start
+        start += SLOT_STEP
+
+
+def find_free_slots(masters, duration, date_from, date_to, not_before=None):
+    """
+    Свободные пары (master_id, start) для услуги длительностью duration
+    в днях с date_from по date_to включительно.
+    """
+    booking_index.ensure_fresh()
+    return _search(masters, duration, date_from, date_to, not_before)
+
+
+async def afind_free_slots(masters, duration, date_from, date_to, not_before=None):
+    await booking_index.aensure_fresh()
+    return _search(masters, duration, date_from, date_to, not_before)
+
+
+def _search(masters, duration, date_from, date_to, not_before):
+    not_before = not_before or timezone.now()
+    length = duration * 60
+
+    # Сетка слотов одинакова для всех мастеров - считаем ее один раз
+    slots = []
+    day = date_from
+    while day <= date_to:
+        for start in day_slots(day, duration):
+            if start >= not_before:
+                begin = int(start.timestamp())
+                slots.append((begin, begin + length, start))
+        day += timedelta(days=1)
+    if not slots:
+        return []
+
+    range_start = slots[0][0]
+    range_end = slots[-1][1]
+    free = []
+    for master_id in masters:
+        busy = booking_index.busy(master_id, range_start, range_end)
+        if not busy:
+            free.extend((master_id, start) for _, _, start in slots)
+            continue
+        pos = 0
+        count = len(busy)
+        for begin, end, start in slots:
+            # Слоты идут по возрастанию - указатель по занятым интервалам только растет
+            while pos < count and busy[pos][1] <= begin:
+                pos += 1
+            if pos < count and busy[pos][0] < end:
+                continue
+            free.append((master_id, start))
+    return free
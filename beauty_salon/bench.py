@@ -0,0 +1,298 @@
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases,
+    teardown_test_environment,
+)
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from app.cache_profiles import locmem_cache
+
+from .models import Client, Service, Master, Appointment, Review
+from .ratings import rebuild_ratings
+from .rollups import rebuild_rollups
+from .search import rebuild_search_index
+
+
+@contextmanager
+def benchmark_database(database=None):
+    """
+    Временная тестовая БД и кэш в памяти, чтобы замеры не трогали рабочие данные.
+    database - другой профиль DATABASES['default'] того же движка на время замера.
+    """
+    # Соединения всех потоков создаются из этого словаря - подменяем его на месте
+    settings_dict = connections.settings['default']
+    saved = dict(settings_dict)
+    if database is not None:
+        connections.close_all()
+        settings_dict.update(database)
+    setup_test_environment()
+    cache_override = override_settings(CACHES={'default': locmem_cache()})
+    cache_override.enable()
+    old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        cache_override.disable()
+        teardown_test_environment()
+        if database is not None:
+            connections.close_all()
+            settings_dict.clear()
+            settings_dict.update(saved)
+
+
+def run_booking_stress(threads=200, slots=24):
+    """
+    threads потоков одновременно бронируют одного мастера на один из
+    slots пересекающихся получасовых стартов. Возвращает статусы ответов,
+    найденные в БД пересечения и пропускную способность.
+    """
+    user = User.objects.create_user(f'stress{time.time_ns()}', password='x')
+    service = Service.objects.create(name='Стрижка', price=1000, duration=60)
+    master = Master.objects.create(name='Мастер', specialization='Парикмахер')
+    Client.objects.create(user=user, name='Клиент', phone='1', email='')
+    day_start = (timezone.now() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+    starts = [day_start + timedelta(minutes=30 * (i % slots)) for i in range(threads)]
+
+    barrier = threading.Barrier(threads + 1)
+    statuses = []
+
+    def book(start):
+        api = APIClient()
+        api.force_authenticate(user)
+        try:
+            barrier.wait()
+            response = api.post('/api/appointments/', {
+                'service': service.id, 'master': master.id, 'date': start.isoformat(),
+            })
+            statuses.append(response.status_code)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=book, args=(start,)) for start in starts]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    booked = sorted(Appointment.objects.filter(master=master).values_list('date', flat=True))
+    length = timedelta(minutes=service.duration)
+    overlaps = sum(1 for previous, current in zip(booked, booked[1:]) if current - previous < length)
+    return {
+        'statuses': statuses,
+        'booked': len(booked),
+        'overlaps': overlaps,
+        'seconds': elapsed,
+        'requests_per_second': threads / elapsed if elapsed else None,
+    }
+
+
+def seed_dataset(clients=200, services=20, masters=40, appointments=2000, reviews=1000):
+    """Небольшой детерминированный набор данных для замеров"""
+    rng = random.Random(42)
+    users = User.objects.bulk_create([User(username=f'bench{i}') for i in range(clients)])
+    client_objs = Client.objects.bulk_create([
+        Client(user=user, name=f'Клиент {i}', phone='1', email=f'c{i}@example.com')
+        for i, user in enumerate(users)
+    ])
+    service_objs = Service.objects.bulk_create([
+        Service(name=f'Услуга {i}', price=1000 + 100 * i, duration=rng.choice([30, 60, 90]))
+        for i in range(services)
+    ])
+    master_objs = Master.objects.bulk_create([
+        Master(name=f'Мастер {i}', specialization=f'Специализация {i % 5}') for i in range(masters)
+    ])
+    Master.services.through.objects.bulk_create([
+        Master.services.through(master_id=master.id, service_id=service.id)
+        for master in master_objs
+        for service in rng.sample(service_objs, 3)
+    ])
+    start = timezone.now() - timedelta(days=180)
+    Appointment.objects.bulk_create([
+        Appointment(
+            client=rng.choice(client_objs), service=rng.choice(service_objs),
+            master=rng.choice(master_objs),
+            date=start + timedelta(days=rng.randint(0, 210), hours=rng.randint(9, 20)),
+        )
+        for _ in range(appointments)
+    ], batch_size=1000)
+    Review.objects.bulk_create([
+        Review(client=rng.choice(client_objs), service=rng.choice(service_objs),
+               rating=rng.randint(1, 5), comment='Отлично')
+        for _ in range(reviews)
+    ], batch_size=1000)
+    # bulk_create мимо сигналов - сводки и поисковый индекс считаем целиком
+    rebuild_ratings()
+    rebuild_rollups()
+    rebuild_search_index()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_summary(latencies, elapsed):
+    return {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+# Списки, которые фронтенд запрашивает при каждом открытии страницы
+API_LIST_ENDPOINTS = ('appointments', 'services', 'masters', 'reviews')
+# Действия ViewSet без pk, которые входят в замер
+API_EXTRA_ACTIONS = ('stats', 'export-excel')
+
+
+def api_endpoints():
+    """(название, путь) горячих GET-путей: списки и все stats/export-excel из роутера"""
+    from app.urls import router
+
+    endpoints = [(f'{prefix}-list', f'/api/{prefix}/') for prefix in API_LIST_ENDPOINTS]
+    for prefix, viewset, _ in router.registry:
+        for extra in viewset.get_extra_actions():
+            if not extra.detail and extra.url_path in API_EXTRA_ACTIONS:
+                endpoints.append((f'{prefix}-{extra.url_path}', f'/api/{prefix}/{extra.url_path}/'))
+    return endpoints
+
+
+def measure(send, requests, warmup=3):
+    """Задержки, запросы к БД на запрос и пик памяти Python (tracemalloc) для send()"""
+    for _ in range(warmup):
+        send()
+    latencies, queries = [], []
+    for _ in range(requests):
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = send()
+            latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.status_code
+        queries.append(len(ctx.captured_queries))
+    # Отдельный проход: под tracemalloc код работает в разы медленнее
+    tracemalloc.start()
+    try:
+        send()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'requests': requests,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'queries_per_request': max(queries),
+        'peak_memory_kib': peak / 1024,
+    }
+
+
+def run_api_benchmark(user, password, requests=30, warmup=3):
+    """
+    Замер горячих путей API через тестовый клиент. user - суперпользователь
+    с паролем password: stats и выгрузки считаются по всем данным.
+    """
+    from rest_framework.authtoken.models import Token
+
+    api = APIClient()
+    api.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get_or_create(user=user)[0].key}')
+    results = {
+        name: measure(lambda: api.get(path), requests, warmup)
+        for name, path in api_endpoints()
+    }
+    anonymous = APIClient()
+    results['auth-login'] = measure(
+        lambda: anonymous.post('/api/auth/login/', {'username': user.username, 'password': password}),
+        requests, warmup,
+    )
+    return results
+
+
+def add_appointments(count, batch_size=10_000):
+    """
+    Дописать count записей к seed_dataset пачками по batch_size: для замеров
+    выгрузки на миллионах строк, не держа их все в памяти.
+    """
+    clients = list(Client.objects.values_list('id', flat=True))
+    services = list(Service.objects.values_list('id', flat=True))
+    masters = list(Master.objects.values_list('id', flat=True))
+    existing = Appointment.objects.count()
+    start = timezone.now() - timedelta(days=365)
+    for first in range(existing, existing + count, batch_size):
+        Appointment.objects.bulk_create([
+            Appointment(
+                client_id=clients[i % len(clients)], service_id=services[i % len(services)],
+                master_id=masters[i % len(masters)], date=start + timedelta(minutes=30 * i),
+            )
+            for i in range(first, min(first + batch_size, existing + count))
+        ])
+
+
+def measure_export(api, path, memory=True):
+    """
+    Одна выгрузка path целиком, включая чтение тела ответа: время и размер
+    файла. Пик памяти Python - отдельным проходом под tracemalloc, чтобы
+    он не замедлял замер времени; memory=False его пропускает.
+    """
+    def export():
+        response = api.get(path)
+        assert response.status_code == 200, response.status_code
+        try:
+            return sum(len(chunk) for chunk in response.streaming_content)
+        finally:
+            response.close()
+
+    started = time.perf_counter()
+    size = export()
+    elapsed = time.perf_counter() - started
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            export()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {'seconds': elapsed, 'bytes': size, 'peak_memory_kib': peak / 1024 if peak is not None else None}
+
+
+def compare_results(current, baseline, tolerance=0.25, min_latency_ms=1.0):
+    """
+    Регрессии относительно базового замера: p95 или пик памяти выросли
+    больше чем на tolerance (и p95 - хотя бы на min_latency_ms, чтобы не
+    ловить шум субмиллисекундных ответов), число запросов к БД выросло вообще.
+    """
+    regressions = []
+    for name, base in baseline.items():
+        result = current.get(name)
+        if result is None:
+            continue
+        if (result['p95_ms'] > base['p95_ms'] * (1 + tolerance)
+                and result['p95_ms'] - base['p95_ms'] >= min_latency_ms):
+            regressions.append(f'{name}: p95 {base["p95_ms"]:.1f} -> {result["p95_ms"]:.1f} ms')
+        if result['queries_per_request'] > base['queries_per_request']:
+            regressions.append(
+                f'{name}: queries {base["queries_per_request"]} -> {result["queries_per_request"]}'
+            )
+        if result['peak_memory_kib'] > base['peak_memory_kib'] * (1 + tolerance):
+            regressions.append(
+                f'{name}: peak memory {base["peak_memory_kib"]:.0f} -> {result["peak_memory_kib"]:.0f} KiB'
+            )
+    return regressions
@@ -0,0 +1,127 @@
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Max
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import Appointment, Master, Service
+
+# На SQLite нет SELECT ... FOR UPDATE: записи на бронирование внутри процесса
+# проходят по одной, а между процессами их сериализует BEGIN IMMEDIATE
+# (transaction_mode в DATABASES)
+_sqlite_booking_lock = threading.Lock()
+
+
+class BookingConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Master is already booked for this time'
+    default_code = 'booking_conflict'
+
+
+class BatchBookingConflict(BookingConflict):
+    """Пересечения в пакете: item_errors - ошибки по индексам элементов"""
+
+    def __init__(self, item_errors):
+        super().__init__()
+        self.item_errors = item_errors
+
+
+@contextmanager
+def _masters_locked(master_ids):
+    if connection.vendor == 'sqlite':
+        with _sqlite_booking_lock, transaction.atomic():
+            yield
+    else:
+        with transaction.atomic():
+            # Блокировка строк мастеров: параллельные записи к ним ждут коммита.
+            # Порядок по pk исключает взаимные блокировки пакетных записей
+            list(Master.objects.select_for_update().filter(pk__in=master_ids)
+                 .order_by('pk').values_list('pk'))
+            yield
+
+
+def has_overlap(master_id, start, duration, exclude_id=None):
+    """Пересекается ли [start, start + duration) с уже существующей записью мастера"""
+    end = start + timedelta(minutes=duration)
+    longest = Service.objects.aggregate(longest=Max('duration'))['longest'] or duration
+    # Записи, начавшиеся раньше start - longest, закончились до start
+    candidates = Appointment.objects.filter(
+        master_id=master_id,
+        date__lt=end,
+        date__gt=start - timedelta(minutes=longest),
+    )
+    if exclude_id is not None:
+        candidates = candidates.exclude(pk=exclude_id)
+    return any(
+        date + timedelta(minutes=booked_duration) > start
+        for date, booked_duration in candidates.values_list('date', 'service__duration')
+    )
+
+
+@contextmanager
+def booking_guard(master, service, start, exclude_id=None):
+    """
+    Проверка занятости и сохранение записи под одной блокировкой мастера.
+    Код внутри with выполняется в той же транзакции, что и проверка.
+    """
+    with _masters_locked([master.pk]):
+        if has_overlap(master.pk, start, service.duration, exclude_id=exclude_id):
+            raise BookingConflict()
+        yield
+
+
+def find_batch_conflicts(items, exclude_ids=()):
+    """
+    items - список (master_id, start, duration). Возвращает индексы элементов,
+    которые пересекаются с существующими записями или с другими элементами пакета.
+    Существующие записи всех мастеров пакета читаются одним запросом.
+    """
+    if not items:
+        return set()
+    longest = max(
+        Service.objects.aggregate(longest=Max('duration'))['longest'] or 0,
+        max(duration for _, _, duration in items),
+    )
+    window_start = min(start for _, start, _ in items) - timedelta(minutes=longest)
+    window_end = max(start + timedelta(minutes=duration) for _, start, duration in items)
+    existing = Appointment.objects.filter(
+        master_id__in={master_id for master_id, _, _ in items},
+        date__lt=window_end,
+        date__gt=window_start,
+    ).exclude(pk__in=exclude_ids).values_list('master_id', 'date', 'service__duration')
+
+    # У сохраненных записей индекс None, у элементов пакета - их позиция в пакете
+    by_master = {}
+    for master_id, date, duration in existing:
+        by_master.setdefault(master_id, []).append((date, date + timedelta(minutes=duration), None))
+    for index, (master_id, start, duration) in enumerate(items):
+        by_master.setdefault(master_id, []).append((start, start + timedelta(minutes=duration), index))
+
+    conflicts = set()
+    for intervals in by_master.values():
+        intervals.sort(key=lambda interval: interval[0])
+        latest_end = None
+        latest_index = None
+        for start, end, index in intervals:
+            if latest_end is not None and start < latest_end:
+                # Пересечение: помечаем элемент пакета, сохраненные записи не трогаем
+                conflicts.add(index if index is not None else latest_index)
+            if latest_end is None or end > latest_end:
+                latest_end, latest_index = end, index
+    conflicts.discard(None)
+    return conflicts
+
+
+@contextmanager
+def bulk_booking_guard(items, exclude_ids=()):
+    """Как booking_guard, но для пакета; при пересечениях - 409 с индексами элементов"""
+    with _masters_locked(sorted({master_id for master_id, _, _ in items})):
+        conflicts = find_batch_conflicts(items, exclude_ids=exclude_ids)
+        if conflicts:
+            raise BatchBookingConflict({
+                index: {'date': [BookingConflict.default_detail]} for index in sorted(conflicts)
+            })
+        yield
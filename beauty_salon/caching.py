@@ -0,0 +1,72 @@
+"""
+Общие приемы работы с кэшем: версионируемые пространства ключей и
+чтение через кэш (read-through).
+
+Кэш общий для всех воркеров (см. app/cache_profiles.py), поэтому
+значение, посчитанное в одном процессе, видят остальные, а сброс
+пространства ключей действует сразу везде.
+"""
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+# Маркер закэшированного None: cache.get возвращает None и на промахе
+_NONE = '__none__'
+
+
+def _new_version():
+    # Уникальная, а не следующая по счету: версия не совпадет со старыми, даже
+    # если ключ версии вытеснен из кэша
+    return uuid.uuid4().hex
+
+
+class CacheNamespace:
+    """
+    Группа ключей с общей версией. Версия входит в каждый ключ,
+    поэтому invalidate() сбрасывает все ключи разом, не перебирая их:
+    старые записи просто перестают читаться и истекают сами.
+    """
+    def __init__(self, name, version_key=None):
+        self.name = name
+        self.version_key = version_key or f'{name}:version'
+
+    def _key(self, version, parts):
+        return ':'.join([self.name, *map(str, parts), f'v{version}'])
+
+    def key(self, *parts):
+        return self._key(cache.get_or_set(self.version_key, _new_version, None), parts)
+
+    async def akey(self, *parts):
+        return self._key(await cache.aget_or_set(self.version_key, _new_version, None), parts)
+
+    def invalidate(self):
+        # Не incr: в файловом кэше это get + set, и два одновременных сброса
+        # из разных воркеров слились бы в один. Новое уникальное значение
+        # отличается от всех прочитанных раньше, кто бы ни записал последним
+        cache.set(self.version_key, _new_version(), None)
+
+
+def _unwrap(value):
+    return None if isinstance(value, str) and value == _NONE else value
+
+
+def read_through(key, compute, timeout):
+    """Значение из кэша или compute(), сохраненное на timeout секунд"""
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, _NONE if value is None else value, timeout)
+    return _unwrap(value)
+
+
+async def aread_through(key, compute, timeout):
+    """
+    Асинхронный read_through: попадание не занимает поток,
+    а синхронный compute() на промахе уходит в пул потоков.
+    """
+    value = await cache.aget(key)
+    if value is None:
+        value = await sync_to_async(compute)()
+        await cache.aset(key, _NONE if value is None else value, timeout)
+    return _unwrap(value)
@@ -0,0 +1,90 @@
+"""
+Условные GET-запросы (ETag / Last-Modified) для редко меняющихся справочников.
+
+У каждой таблицы есть версия в кэше - время последней записи в наносекундах.
+Сигналы обновляют ее после коммита, а список строит из версий ETag и
+Last-Modified. Повторный запрос с If-None-Match получает 304 еще до
+запроса к БД и сериализации: версии читаются одним обращением к кэшу.
+"""
+import time
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+TABLE_VERSION_KEY = 'table_version:{}'
+
+
+def _version_keys(tables):
+    return [TABLE_VERSION_KEY.format(table) for table in tables]
+
+
+def _with_missing(tables, versions):
+    """
+    Версии по порядку tables. Вытесненный из кэша ключ начинается заново
+    с текущего времени: новый ETag не совпадет ни с одним выданным раньше.
+    """
+    keys = _version_keys(tables)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    return [versions.get(key) or missing[key] for key in keys], missing
+
+
+def table_versions(tables):
+    versions, missing = _with_missing(tables, cache.get_many(_version_keys(tables)))
+    if missing:
+        cache.set_many(missing, None)
+    return versions
+
+
+async def atable_versions(tables):
+    versions, missing = _with_missing(tables, await cache.aget_many(_version_keys(tables)))
+    if missing:
+        await cache.aset_many(missing, None)
+    return versions
+
+
+def bump_table_versions(*tables):
+    # Метка времени, а не incr: из нее же берется Last-Modified
+    now = time.time_ns()
+    cache.set_many({key: now for key in _version_keys(tables)}, None)
+
+
+def validators(versions):
+    """(etag, last_modified) для списка версий таблиц"""
+    etag = 'W/"{}"'.format('-'.join(f'{version:x}' for version in versions))
+    return etag, max(versions) // 1_000_000_000
+
+
+def conditional_response(request, versions):
+    """
+    304 Not Modified, если у клиента актуальная копия, иначе None.
+    ETag сравнивается первым: Last-Modified точен лишь до секунды.
+    """
+    etag, last_modified = validators(versions)
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def set_validators(response, versions):
+    etag, last_modified = validators(versions)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Браузер хранит ответ, но перед использованием каждый раз спрашивает сервер
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Authorization', 'Accept'))
+    return response
+
+
+class ConditionalListMixin:
+    """
+    list() с ETag/Last-Modified по версиям conditional_tables.
+    Права проверяются раньше (initial), поэтому 304 получают только те,
+    кто может видеть список.
+    """
+    conditional_tables = ()
+
+    def list(self, request, *args, **kwargs):
+        versions = table_versions(self.conditional_tables)
+        not_modified = conditional_response(request, versions)
+        if not_modified is not None:
+            return set_validators(not_modified, versions)
+        return set_validators(super().list(request, *args, **kwargs), versions)
@@ -0,0 +1,206 @@
+"""
+Фоновые выгрузки в Excel.
+
+POST /api/exports/ создает задание ExportJob и отдает его сразу; файл
+собирает пул процессов (concurrent.futures, без внешнего брокера) и
+кладет в MEDIA_ROOT/exports/. Клиент опрашивает /api/exports/<id>/ и
+забирает файл через /api/exports/<id>/download/.
+
+- Все строки выгрузки читаются из одного снимка БД (snapshot()).
+- Задание берет ровно один исполнитель: переход pending -> running -
+  условный UPDATE.
+- Одинаковый запрос (вид и чьи данные) в течение EXPORT_REUSE_SECONDS
+  получает уже созданное задание и его файл.
+- EXPORT_WORKERS = 0 - выгрузка собирается прямо в запросе (тесты,
+  отладка). Задания, оставшиеся после перезапуска, - manage.py
+  run_export_jobs.
+"""
+import logging
+import secrets
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import timedelta
+from multiprocessing import get_context
+
+import django
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection as default_connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .exports import write_xlsx
+from .models import ExportJob
+
+logger = logging.getLogger(__name__)
+
+# Выгрузки, в которых у обычного пользователя только его данные
+PER_USER_EXPORTS = {'appointments'}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def export_scope(kind, user):
+    if kind in PER_USER_EXPORTS and not user.is_superuser:
+        return str(user.pk)
+    return 'all'
+
+
+def visible_jobs(user):
+    """Задания, чьи файлы пользователь получил бы и сам"""
+    jobs = ExportJob.objects.all()
+    if user.is_superuser:
+        return jobs.filter(scope='all')
+    return jobs.filter(Q(scope=str(user.pk)) | Q(scope='all') & ~Q(kind__in=PER_USER_EXPORTS))
+
+
+def request_export(kind, user):
+    """
+    (задание, создано ли новое). Свежее задание того же вида и scope,
+    кроме упавших, переиспользуется - в очереди, в работе или готовое.
+    """
+    scope = export_scope(kind, user)
+    since = timezone.now() - timedelta(seconds=settings.EXPORT_REUSE_SECONDS)
+    job = ExportJob.objects.filter(
+        kind=kind, scope=scope, created_at__gte=since,
+    ).exclude(status=ExportJob.FAILED).order_by('-created_at').first()
+    if job is not None:
+        return job, False
+    job = ExportJob.objects.create(owner=user, kind=kind, scope=scope)
+    enqueue(job.pk)
+    job.refresh_from_db()
+    return job, True
+
+
+def export_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.EXPORT_WORKERS,
+                # fork скопировал бы открытые соединения с БД и потоки веб-сервера
+                mp_context=get_context('spawn'),
+                # В чистом интерпретаторе Django настраивается до распаковки первой задачи:
+                # функция задачи живет в этом модуле, а он импортирует модели
+                initializer=django.setup,
+            )
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error('Export worker failed', exc_info=future.exception())
+
+
+def submit(job_id):
+    pool = export_pool()
+    try:
+        future = pool.submit(_run_in_worker, job_id)
+    except BrokenProcessPool:
+        # Процесс пула упал (например, OOM) - пул больше не принимает задачи
+        _reset_pool(pool)
+        future = export_pool().submit(_run_in_worker, job_id)
+    future.add_done_callback(_log_failure)
+
+
+def enqueue(job_id):
+    if not settings.EXPORT_WORKERS:
+        run_export_job(job_id)
+        return
+    # Процесс пула читает задание своим соединением - только после коммита
+    transaction.on_commit(lambda: submit(job_id))
+
+
+@contextmanager
+def snapshot(connection=default_connection):
+    """
+    Все чтения внутри видят БД на один момент: записи, сделанные во время
+    выгрузки, в файл не попадают и не разрывают его.
+    - SQLite: отложенная транзакция только на чтение. atomic() здесь
+      начинает BEGIN IMMEDIATE и держал бы блокировку записи всю выгрузку.
+    - PostgreSQL: REPEATABLE READ READ ONLY.
+    Внутри уже открытой транзакции снимок - она сама.
+    """
+    if connection.in_atomic_block:
+        yield
+        return
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('BEGIN DEFERRED')
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('COMMIT')
+        return
+    with transaction.atomic(using=connection.alias):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+        yield
+
+
+def run_export_job(job_id, statuses=(ExportJob.PENDING,)):
+    """
+    Собрать файл задания, если его еще никто не взял. Выполняется в
+    процессе пула, в запросе (EXPORT_WORKERS = 0) или в run_export_jobs.
+    Возвращает True, если задание выполнялось здесь.
+    """
+    # Таблицы выгрузок описаны во ViewSet'ах - api.py импортирует этот модуль
+    from .api import export_table
+
+    claimed = ExportJob.objects.filter(pk=job_id, status__in=statuses).update(
+        status=ExportJob.RUNNING, started_at=timezone.now(),
+    )
+    if not claimed:
+        return False
+    job = ExportJob.objects.select_related('owner').get(pk=job_id)
+    try:
+        with tempfile.TemporaryFile() as tmp:
+            with snapshot():
+                _, title, headers, rows = export_table(job.kind, job.owner)
+                job.rows = write_xlsx(tmp, title, headers, rows)
+            tmp.seek(0)
+            # Случайная часть имени: при DEBUG MEDIA_ROOT раздается без авторизации
+            job.file.save(f'{job.kind}-{job.pk}-{secrets.token_hex(8)}.xlsx', File(tmp), save=False)
+        job.status = ExportJob.DONE
+    except Exception as e:
+        logger.exception('Export job %s failed', job_id)
+        job.status = ExportJob.FAILED
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'file', 'rows', 'error', 'finished_at'])
+    return True
+
+
+def _run_in_worker(job_id):
+    # Процесс пула живет долго: соединение, закрытое сервером или старше CONN_MAX_AGE, заменяется
+    close_old_connections()
+    try:
+        return run_export_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def purge_exports(older_than):
+    """Удалить задания, созданные раньше older_than, вместе с файлами"""
+    jobs = ExportJob.objects.filter(created_at__lt=older_than).exclude(status=ExportJob.RUNNING)
+    stale = list(jobs.values_list('pk', 'file'))
+    for _, name in stale:
+        if name:
+            default_storage.delete(name)
+    ExportJob.objects.filter(pk__in=[pk for pk, _ in stale]).delete()
+    return len(stale)
@@ -0,0 +1,81 @@
+import tempfile
+from itertools import chain, islice
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+from django.http import FileResponse
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Сколько строк забираем из БД за один запрос при выгрузке
+EXPORT_CHUNK_SIZE = 2000
+# По скольким первым строкам оцениваем ширину колонок
+WIDTH_SAMPLE_SIZE = 200
+MAX_COLUMN_WIDTH = 60
+
+
+def estimate_column_widths(headers, sample_rows):
+    """Ширина колонок по заголовкам и выборке первых строк"""
+    widths = [len(str(header)) for header in headers]
+    for row in sample_rows:
+        for col, value in enumerate(row):
+            if value is not None:
+                widths[col] = max(widths[col], len(str(value)))
+    return [min(width + 2, MAX_COLUMN_WIDTH) for width in widths]
+
+
+def write_xlsx(fileobj, title, headers, rows, widths=None):
+    """
+    Пишет строки в xlsx в режиме write-only: openpyxl сбрасывает строки
+    во временный файл по мере добавления, поэтому память не растет
+    вместе с количеством строк. Возвращает число строк без заголовка.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+
+    rows = iter(rows)
+    sample = list(islice(rows, WIDTH_SAMPLE_SIZE))
+    if widths is None:
+        widths = estimate_column_widths(headers, sample)
+    # В write-only режиме ширину нужно задать до первой строки
+    for col, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(col)].width = width
+
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True)
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    count = 0
+    for row in chain(sample, rows):
+        ws.append(row)
+        count += 1
+
+    wb.save(fileobj)
+    return count
+
+
+def xlsx_response(filename, title, headers, rows, widths=None):
+    """
+    Собирает xlsx во временном файле целиком и только потом отдает его:
+    память не растет с числом строк, но первый байт уходит после всей
+    генерации. Большие таблицы, которые не укладываются в таймаут прокси,
+    выгружаются фоновым заданием (POST /api/exports/, export_jobs.py).
+    """
+    tmp = tempfile.TemporaryFile()
+    try:
+        write_xlsx(tmp, title, headers, rows, widths=widths)
+    except Exception:
+        tmp.close()
+        raise
+    tmp.seek(0)
+    return FileResponse(
+        tmp,
+        as_attachment=True,
+        filename=filename,
+        content_type=XLSX_CONTENT_TYPE,
+    )
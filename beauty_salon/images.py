@@ -0,0 +1,96 @@
+"""
+Уменьшенные копии картинок Service.picture и Client.picture.
+
+Копии лежат в thumbs/ под именем из sha256 содержимого оригинала, поэтому
+одинаковые загрузки делят файлы, а URL копии строится по хэшу без
+обращения к хранилищу. Хэш хранится в поле picture_hash модели.
+"""
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Ширины WebP-копий для srcset: списки показывают картинки 50x50, крупнее - в просмотре
+SRCSET_WIDTHS = (64, 128, 320, 640)
+# JPEG-копия для браузеров без WebP и для picture_thumb
+THUMB_WIDTH = 128
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+THUMBS_DIR = 'thumbs'
+
+
+def derivative_name(picture_hash, width, fmt):
+    # Подкаталог по первым символам хэша - чтобы в одном каталоге не копились тысячи файлов
+    return f'{THUMBS_DIR}/{picture_hash[:2]}/{picture_hash}_{width}.{fmt}'
+
+
+def derivative_names(picture_hash):
+    names = [(width, 'webp', derivative_name(picture_hash, width, 'webp')) for width in SRCSET_WIDTHS]
+    names.append((THUMB_WIDTH, 'jpg', derivative_name(picture_hash, THUMB_WIDTH, 'jpg')))
+    return names
+
+
+def _resized(image, width, original_size):
+    if image.width <= width:
+        return image
+    # Высота - по пропорциям оригинала, чтобы округления не копились от копии к копии
+    original_width, original_height = original_size
+    height = max(1, round(original_height * width / original_width))
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def build_derivatives(name, storage=default_storage):
+    """
+    Создает копии для файла name из хранилища storage и возвращает хэш содержимого.
+    Копии пишутся в default_storage под своими именами.
+    Уже существующие копии не пересоздаются. Если файла нет или это
+    не картинка - возвращает None.
+    """
+    try:
+        with storage.open(name, 'rb') as source:
+            data = source.read()
+    except (FileNotFoundError, OSError):
+        return None
+    picture_hash = hashlib.sha256(data).hexdigest()
+    missing = [item for item in derivative_names(picture_hash) if not default_storage.exists(item[2])]
+    if not missing:
+        return picture_hash
+
+    try:
+        with Image.open(BytesIO(data)) as opened:
+            # Поворот по EXIF: иначе фото с телефона окажутся на боку
+            image = ImageOps.exif_transpose(opened).convert('RGB')
+    except (OSError, Image.DecompressionBombError):
+        return None
+    # Копии уменьшаются по очереди от большей к меньшей - каждая следующая считается быстрее
+    source = image
+    for width, fmt, target in sorted(missing, key=lambda item: -item[0]):
+        source = _resized(source, width, image.size)
+        buffer = BytesIO()
+        if fmt == 'webp':
+            source.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+        else:
+            source.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        default_storage.save(target, ContentFile(buffer.getvalue()))
+    return picture_hash
+
+
+def derivative_url(picture_hash, width, fmt, request=None):
+    url = default_storage.url(derivative_name(picture_hash, width, fmt))
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def thumb_url(picture_hash, request=None):
+    if not picture_hash:
+        return None
+    return derivative_url(picture_hash, THUMB_WIDTH, 'jpg', request)
+
+
+def srcset(picture_hash, request=None):
+    if not picture_hash:
+        return None
+    return ', '.join(
+        f'{derivative_url(picture_hash, width, "webp", request)} {width}w' for width in SRCSET_WIDTHS
+    )
@@ -0,0 +1,75 @@
+import json
+import platform
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from beauty_salon.bench import benchmark_database, compare_results, run_api_benchmark, seed_dataset
+
+# Фиксированный набор данных: базовые замеры сравнимы только на одинаковых данных
+DATASET = {'clients': 200, 'services': 20, 'masters': 40, 'appointments': 2000, 'reviews': 1000}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the REST API hot paths in-process (lists, every stats and export-excel action, '
+        'login): p50/p95/p99 latency, SQL queries per request and peak Python memory. '
+        'Results can be saved as a JSON baseline and compared with a previous run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=30, help='Measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--save', metavar='PATH', help='Write results to a JSON baseline file')
+        parser.add_argument('--compare', metavar='PATH', help='Compare with a JSON baseline and fail on regressions')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Allowed relative growth of p95 latency and peak memory (default 0.25)'
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            # Читаем заранее: опечатка в пути не должна стоить целого прогона
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        password = 'bench-password'
+        with benchmark_database():
+            seed_dataset(**DATASET)
+            user = User.objects.create_superuser('bench_admin', password=password)
+            results = run_api_benchmark(user, password, options['requests'], options['warmup'])
+
+        self.stdout.write(
+            f'{"endpoint":<28} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"peak KiB":>9}'
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<28} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+                f'{result["queries_per_request"]:>8} {result["peak_memory_kib"]:>9.0f}'
+            )
+
+        if options['save']:
+            report = {
+                'meta': {
+                    'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'database': settings.DATABASES['default']['ENGINE'],
+                    'dataset': DATASET,
+                    'requests': options['requests'],
+                },
+                'endpoints': results,
+            }
+            with open(options['save'], 'w') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            self.stdout.write(f'Baseline saved to {options["save"]}')
+
+        if baseline is not None:
+            regressions = compare_results(results, baseline['endpoints'], options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline'))
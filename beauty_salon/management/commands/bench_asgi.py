@@ -0,0 +1,88 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client as WSGIClient
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from beauty_salon.bench import benchmark_database, latency_summary, seed_dataset
+from beauty_salon.models import Service
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests the hot read endpoints in-process: synchronous DRF views through '
+        'the WSGI handler from a thread pool vs. the async views through the ASGI handler'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=32)
+
+    def endpoints(self):
+        service = Service.objects.filter(masters__isnull=False).first()
+        day = (timezone.now() + timedelta(days=1)).date()
+        slots = f'free-slots/?service={service.id}&date_from={day}&date_to={day + timedelta(days=6)}'
+        # (название, WSGI путь, ASGI путь)
+        return [
+            ('services', '/api/services/', '/api/async/services/'),
+            ('masters', '/api/masters/', '/api/async/masters/'),
+            ('free-slots', f'/api/appointments/{slots}', f'/api/async/appointments/{slots}'),
+            ('stats', '/api/appointments/stats/', '/api/async/appointments/stats/'),
+        ]
+
+    def run_wsgi(self, path, headers, total, concurrency):
+        def one(_):
+            client = WSGIClient(headers=headers)
+            started = time.perf_counter()
+            response = client.get(path)
+            latency = time.perf_counter() - started
+            connection.close()
+            assert response.status_code == 200, (path, response.status_code)
+            return latency
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(one, range(total)))
+        return latency_summary(latencies, time.perf_counter() - started)
+
+    async def run_asgi(self, path, headers, total, concurrency):
+        client = AsyncClient()
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with limit:
+                started = time.perf_counter()
+                # Заголовки по запросу: заданные в конструкторе AsyncClient не попадают в ASGI scope
+                response = await client.get(path, headers=headers)
+                assert response.status_code == 200, (path, response.status_code)
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(one() for _ in range(total)))
+        return latency_summary(latencies, time.perf_counter() - started)
+
+    def handle(self, *args, **options):
+        total, concurrency = options['requests'], options['concurrency']
+        with benchmark_database():
+            seed_dataset()
+            user = User.objects.create_superuser('bench_admin', password='x')
+            headers = {'Authorization': f'Token {Token.objects.create(user=user).key}'}
+            rows = []
+            for name, wsgi_path, asgi_path in self.endpoints():
+                wsgi = self.run_wsgi(wsgi_path, headers, total, concurrency)
+                asgi = asyncio.run(self.run_asgi(asgi_path, headers, total, concurrency))
+                rows.append((name, 'wsgi', wsgi))
+                rows.append((name, 'asgi', asgi))
+
+        self.stdout.write(f'{"endpoint":<12} {"mode":<5} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8}')
+        for name, mode, result in rows:
+            self.stdout.write(
+                f'{name:<12} {mode:<5} {result["requests_per_second"]:>8.0f} '
+                f'{result["p50_ms"]:>8.1f} {result["p99_ms"]:>8.1f}'
+            )
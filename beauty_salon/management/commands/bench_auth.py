@@ -0,0 +1,43 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from beauty_salon.bench import benchmark_database
+from beauty_salon.models import Client
+
+
+class Command(BaseCommand):
+    help = 'Counts SQL queries per token-authenticated request: first request vs. steady state'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            user = User.objects.create_user('bench_client', password='x')
+            Client.objects.create(user=user, name='Клиент', phone='1', email='')
+            api = APIClient()
+            api.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+
+            counts = []
+            for _ in range(options['requests']):
+                with CaptureQueriesContext(connection) as ctx:
+                    response = api.get('/api/users/profile/')
+                assert response.status_code == 200, response.status_code
+                auth = [
+                    q for q in ctx.captured_queries
+                    if 'authtoken_token' in q['sql'] or 'auth_user' in q['sql']
+                    or 'beauty_salon_client' in q['sql']
+                ]
+                counts.append((len(ctx.captured_queries), len(auth)))
+
+        first, rest = counts[0], counts[1:]
+        self.stdout.write(f'first request:   {first[0]} queries, {first[1]} for authentication')
+        if rest:
+            self.stdout.write(
+                f'steady state:    {max(total for total, _ in rest)} queries, '
+                f'{max(auth for _, auth in rest)} for authentication'
+            )
@@ -0,0 +1,27 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from beauty_salon.bench import benchmark_database, run_booking_stress
+
+
+class Command(BaseCommand):
+    help = 'Fires concurrent bookings at one master and reports throughput and overlaps'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=200)
+        parser.add_argument('--slots', type=int, default=24, help='Number of distinct overlapping start times')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            result = run_booking_stress(threads=options['threads'], slots=options['slots'])
+
+        statuses = Counter(result['statuses'])
+        self.stdout.write(f"Requests: {len(result['statuses'])} in {result['seconds']:.2f}s "
+                          f"({result['requests_per_second']:.0f} req/s)")
+        self.stdout.write(f"Statuses: {dict(sorted(statuses.items()))}")
+        self.stdout.write(f"Booked: {result['booked']}, overlaps: {result['overlaps']}")
+        if result['overlaps']:
+            self.stdout.write(self.style.ERROR('Double booking detected'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No overlapping bookings'))
@@ -0,0 +1,60 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from beauty_salon.bench import benchmark_database
+from beauty_salon.models import Client, Service, Master
+
+
+class Command(BaseCommand):
+    help = 'Compares per-item appointment creation with the /bulk/ endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=300)
+
+    def handle(self, *args, **options):
+        count = options['items']
+        with benchmark_database():
+            user = User.objects.create_user('bench', password='x')
+            Client.objects.create(user=user, name='Клиент', phone='1', email='')
+            service = Service.objects.create(name='Стрижка', price=1000, duration=30)
+            masters = [
+                Master.objects.create(name=f'Мастер {i}', specialization='Парикмахер')
+                for i in range(2)
+            ]
+            api = APIClient()
+            api.force_authenticate(user)
+            start = (timezone.now() + timedelta(days=1)).replace(minute=0, second=0, microsecond=0)
+
+            def items(master):
+                return [
+                    {'service': service.id, 'master': master.id,
+                     'date': (start + timedelta(minutes=30 * i)).isoformat()}
+                    for i in range(count)
+                ]
+
+            with CaptureQueriesContext(connection) as single_queries:
+                started = time.perf_counter()
+                for item in items(masters[0]):
+                    api.post('/api/appointments/', item, format='json')
+                single_time = time.perf_counter() - started
+
+            with CaptureQueriesContext(connection) as bulk_queries:
+                started = time.perf_counter()
+                response = api.post('/api/appointments/bulk/', items(masters[1]), format='json')
+                bulk_time = time.perf_counter() - started
+            if response.status_code != 201:
+                self.stderr.write(f'Bulk request failed: {response.status_code} {response.content[:500]}')
+                return
+
+        self.stdout.write(f'{"path":<10} {"items":>6} {"requests":>9} {"queries":>8} {"seconds":>8}')
+        self.stdout.write(f'{"per-item":<10} {count:>6} {count:>9} {len(single_queries):>8} {single_time:>8.2f}')
+        self.stdout.write(f'{"bulk":<10} {count:>6} {1:>9} {len(bulk_queries):>8} {bulk_time:>8.2f}')
+        if bulk_time:
+            self.stdout.write(self.style.SUCCESS(f'Bulk is {single_time / bulk_time:.1f}x faster'))
@@ -0,0 +1,53 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from beauty_salon.bench import benchmark_database, percentile, seed_dataset
+
+
+class Command(BaseCommand):
+    help = 'Compares full list responses with If-None-Match revalidation: bytes, latency, SQL queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--services', type=int, default=50)
+        parser.add_argument('--masters', type=int, default=100)
+
+    def measure(self, api, url, requests, headers):
+        latencies, sizes, queries = [], [], []
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = api.get(url, **headers)
+                latencies.append(time.perf_counter() - started)
+            assert response.status_code in (200, 304), response.status_code
+            sizes.append(len(response.content))
+            queries.append(len(ctx.captured_queries))
+        return response, latencies, sizes, queries
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_dataset(services=options['services'], masters=options['masters'])
+            user = User.objects.create_user('bench_etag', password='x')
+            api = APIClient()
+            api.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+
+            self.stdout.write(
+                f'{"endpoint":<28} {"mode":<12} {"status":>6} {"bytes":>8} '
+                f'{"p50 ms":>8} {"p95 ms":>8} {"queries":>8}'
+            )
+            for url in ('/api/services/?page_size=200', '/api/masters/?page_size=200'):
+                # Первый запрос прогревает кэш токена и версии таблиц
+                first = api.get(url)
+                for mode, headers in (('full', {}), ('conditional', {'HTTP_IF_NONE_MATCH': first['ETag']})):
+                    response, latencies, sizes, queries = self.measure(api, url, options['requests'], headers)
+                    self.stdout.write(
+                        f'{url:<28} {mode:<12} {response.status_code:>6} {max(sizes):>8} '
+                        f'{percentile(latencies, 0.5) * 1000:>8.2f} '
+                        f'{percentile(latencies, 0.95) * 1000:>8.2f} {max(queries):>8}'
+                    )
@@ -0,0 +1,113 @@
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from app.db_profiles import database_profile
+from beauty_salon.bench import benchmark_database, latency_summary, seed_dataset
+from beauty_salon.models import Appointment, Client, Master
+
+
+class Command(BaseCommand):
+    help = (
+        'Concurrent read/write throughput for database profiles. SQLite profiles '
+        'are compared in-process on a temporary file; for postgres run with DB_PROFILE=postgres'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', default=None,
+                            help='Default: sqlite-wal and sqlite, or the active profile if it is postgres')
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--ops', type=int, default=200, help='Operations per thread')
+        parser.add_argument('--write-ratio', type=float, default=0.2)
+
+    def run_load(self, threads, ops, write_ratio):
+        master_ids = list(Master.objects.values_list('id', flat=True))
+        client = Client.objects.first()
+        service_id = Appointment.objects.values_list('service_id', flat=True).first()
+        far_future = timezone.now() + timedelta(days=3650)
+        latencies = {'read': [], 'write': []}
+        errors = []
+        barrier = threading.Barrier(threads)
+
+        def worker(index):
+            rng = random.Random(index)
+            barrier.wait()
+            try:
+                for op in range(ops):
+                    kind = 'write' if rng.random() < write_ratio else 'read'
+                    master_id = rng.choice(master_ids)
+                    started = time.perf_counter()
+                    try:
+                        if kind == 'write':
+                            with transaction.atomic():
+                                Appointment.objects.create(
+                                    client=client, service_id=service_id, master_id=master_id,
+                                    date=far_future + timedelta(minutes=index * ops + op),
+                                )
+                        else:
+                            since = timezone.now() - timedelta(days=rng.randint(0, 180))
+                            list(Appointment.objects.filter(master_id=master_id, date__gte=since)
+                                 .order_by('date')[:50])
+                    except OperationalError as e:
+                        errors.append(str(e))
+                        continue
+                    latencies[kind].append(time.perf_counter() - started)
+                    # Конец "запроса": соединение закрывается, остается или уходит в пул по профилю
+                    close_old_connections()
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        total = latency_summary(latencies['read'] + latencies['write'], elapsed)
+        return {
+            **total,
+            'reads_per_second': len(latencies['read']) / elapsed,
+            'writes_per_second': len(latencies['write']) / elapsed,
+            'write_p99_ms': latency_summary(latencies['write'], elapsed)['p99_ms'],
+            'errors': len(errors),
+        }
+
+    def handle(self, *args, **options):
+        engine = settings.DATABASES['default']['ENGINE']
+        profiles = options['profiles']
+        if profiles is None:
+            profiles = ['sqlite-wal', 'sqlite'] if engine.endswith('sqlite3') else [settings.DB_PROFILE]
+
+        rows = []
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in profiles:
+                database = database_profile(name, settings.BASE_DIR)
+                if database['ENGINE'] != engine:
+                    raise CommandError(f'Profile {name} uses another engine: run with DB_PROFILE={name}')
+                if engine.endswith('sqlite3'):
+                    # In-memory тестовая БД не покажет разницы журналов - нужен файл
+                    database['TEST'] = {**settings.DATABASES['default']['TEST'],
+                                        'NAME': str(Path(tmp) / f'bench_{name}.sqlite3')}
+                with benchmark_database(database):
+                    seed_dataset()
+                    rows.append((name, self.run_load(options['threads'], options['ops'], options['write_ratio'])))
+
+        self.stdout.write(
+            f'{"profile":<16} {"ops/s":>8} {"reads/s":>8} {"writes/s":>9} '
+            f'{"p50 ms":>8} {"p99 ms":>8} {"write p99":>10} {"errors":>7}'
+        )
+        for name, result in rows:
+            self.stdout.write(
+                f'{name:<16} {result["requests_per_second"]:>8.0f} {result["reads_per_second"]:>8.0f} '
+                f'{result["writes_per_second"]:>9.0f} {result["p50_ms"]:>8.1f} {result["p99_ms"]:>8.1f} '
+                f'{result["write_p99_ms"] or 0:>10.1f} {result["errors"]:>7}'
+            )
@@ -0,0 +1,56 @@
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from beauty_salon.bench import add_appointments, benchmark_database, measure_export, seed_dataset
+from beauty_salon.models import Appointment
+
+EXPORT_PATH = '/api/appointments/export-excel/'
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures GET /api/appointments/export-excel/ on a temporary database grown to each '
+        'row count: ORM query, row building and the write-only xlsx writer. Time is measured '
+        'without tracemalloc; peak Python memory comes from a separate pass'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+            help='Appointment counts to export (e.g. --rows 1000 1000000)'
+        )
+        parser.add_argument('--skip-memory', action='store_true',
+                            help='Skip the tracemalloc pass (it is several times slower)')
+
+    def handle(self, *args, **options):
+        database = None
+        with tempfile.TemporaryDirectory() as tmp:
+            if settings.DATABASES['default']['ENGINE'].endswith('sqlite3'):
+                # Миллион строк выгрузка читает с диска, как в работе, а не из in-memory БД
+                database = {
+                    **settings.DATABASES['default'],
+                    'TEST': {**settings.DATABASES['default']['TEST'], 'NAME': str(Path(tmp) / 'bench_export.sqlite3')},
+                }
+            with benchmark_database(database):
+                seed_dataset(appointments=0, reviews=0)
+                api = APIClient()
+                # Суперпользователь выгружает все записи
+                api.force_authenticate(User.objects.create_superuser('bench_admin', password=None))
+
+                self.stdout.write(
+                    f'{"rows":>10} {"seconds":>10} {"rows/s":>10} {"peak MiB":>10} {"file MiB":>10}'
+                )
+                for count in sorted(options['rows']):
+                    add_appointments(max(0, count - Appointment.objects.count()))
+                    rows = Appointment.objects.count()
+                    result = measure_export(api, EXPORT_PATH, memory=not options['skip_memory'])
+                    peak = result['peak_memory_kib']
+                    self.stdout.write(
+                        f'{rows:>10} {result["seconds"]:>10.2f} {rows / result["seconds"]:>10.0f} '
+                        f'{"-" if peak is None else f"{peak / 1024:.2f}":>10} {result["bytes"] / 2**20:>10.2f}'
+                    )
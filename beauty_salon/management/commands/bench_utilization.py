@@ -0,0 +1,62 @@
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from beauty_salon.utilization import Period, compute_utilization, np
+
+
+def synthetic_columns(period, appointments, masters, seed=42):
+    # Столбцы того же вида, что возвращает load_appointments: записи в рабочие часы
+    rng = random.Random(seed)
+    first = period.first.timestamp()
+    master_ids, starts, durations = [], [], []
+    for _ in range(appointments):
+        day = rng.randrange(period.days)
+        minute = rng.randrange(9 * 60, 20 * 60, 15)
+        master_ids.append(rng.randrange(1, masters + 1))
+        starts.append(first + day * 86400 + minute * 60)
+        durations.append(rng.choice((30, 60, 90, 120)))
+    return master_ids, starts, durations
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the master utilization heatmap computation on synthetic appointments '
+        '(loading from the database is not included)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=1_000_000)
+        parser.add_argument('--masters', type=int, default=40)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument(
+            '--python', action='store_true', help='Also time the pure-Python fallback (slow on large inputs)'
+        )
+
+    def handle(self, *args, **options):
+        start = date(2025, 1, 1)
+        period = Period(start, start + timedelta(days=options['days'] - 1))
+        columns = synthetic_columns(period, options['appointments'], options['masters'])
+        master_ids = list(range(1, options['masters'] + 1))
+
+        variants = []
+        if np is not None:
+            variants.append(('numpy', True))
+        if options['python'] or np is None:
+            variants.append(('python', False))
+        if np is None:
+            self.stderr.write('NumPy is not installed: timing the pure-Python fallback only')
+
+        results = {}
+        self.stdout.write(f'{"variant":<8} {"appointments":>12} {"masters":>8} {"days":>5} {"seconds":>8}')
+        for name, use_numpy in variants:
+            started = time.perf_counter()
+            results[name] = compute_utilization(period, master_ids, *columns, use_numpy=use_numpy)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{name:<8} {options["appointments"]:>12} {options["masters"]:>8} {period.days:>5} {elapsed:>8.3f}'
+            )
+        if len(results) == 2 and results['numpy'] != results['python']:
+            raise CommandError('NumPy and pure-Python results differ')
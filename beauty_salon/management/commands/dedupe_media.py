@@ -0,0 +1,64 @@
+import os
+import shutil
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from beauty_salon.storage import CAS_DIR, content_addressed_storage, file_digest, file_fields
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves pictures stored under their upload names into the content-addressed '
+        'store and points every object at its blob; run gc_media afterwards to drop the originals'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        storage = content_addressed_storage
+        digests = {}  # старое имя -> имя блоба
+        originals_size = 0
+        blobs = {}
+        missing = []
+        updates = []
+        for model, field in file_fields():
+            rows = model.objects.exclude(**{field.name: ''}).exclude(**{f'{field.name}__isnull': True})\
+                .exclude(**{f'{field.name}__startswith': f'{CAS_DIR}/'})\
+                .values_list('pk', field.attname)
+            changed = []
+            for pk, name in rows:
+                if name not in digests:
+                    path = storage.path(name)
+                    if not os.path.exists(path):
+                        missing.append(name)
+                        continue
+                    blob = storage.blob_name(file_digest(path), name)
+                    digests[name] = blob
+                    size = os.path.getsize(path)
+                    originals_size += size
+                    blobs[blob] = size
+                    if not options['dry_run'] and not storage.exists(blob):
+                        os.makedirs(os.path.dirname(storage.path(blob)), exist_ok=True)
+                        try:
+                            # Жесткая ссылка без копирования; на другом разделе - копия
+                            os.link(path, storage.path(blob))
+                        except OSError:
+                            shutil.copyfile(path, storage.path(blob))
+                if name in digests:
+                    changed.append(model(pk=pk, **{field.attname: digests[name]}))
+            updates.append((model, field, changed))
+
+        if not options['dry_run']:
+            with transaction.atomic():
+                for model, field, changed in updates:
+                    model.objects.bulk_update(changed, [field.name], batch_size=500)
+
+        for name in missing:
+            self.stderr.write(f'Missing file: {name}')
+        unique_size = sum(blobs.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would move" if options["dry_run"] else "Moved"} {len(digests)} files into '
+            f'{len(blobs)} blobs: {originals_size / 2 ** 20:.1f} MiB -> {unique_size / 2 ** 20:.1f} MiB'
+        ))
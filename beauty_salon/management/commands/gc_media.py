@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from beauty_salon.images import THUMBS_DIR
+from beauty_salon.storage import CAS_DIR, content_addressed_storage, file_fields, unreferenced_files
+
+
+class Command(BaseCommand):
+    help = 'Deletes media blobs, thumbnails and legacy uploads that no object references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='Keep unreferenced files younger than this (uploads in flight)')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        directories = {CAS_DIR, THUMBS_DIR}
+        # Каталоги upload_to, где лежат загрузки до перехода на адресацию по содержимому
+        directories.update(str(field.upload_to).strip('/') for _, field in file_fields() if field.upload_to)
+
+        count = size = 0
+        for name, file_size in unreferenced_files(sorted(directories), options['grace_hours'] * 3600):
+            if options['verbosity'] > 1:
+                self.stdout.write(name)
+            if not options['dry_run']:
+                content_addressed_storage.delete(name)
+            count += 1
+            size += file_size
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would delete" if options["dry_run"] else "Deleted"} {count} files, {size / 2 ** 20:.1f} MiB'
+        ))
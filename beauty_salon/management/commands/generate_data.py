@@ -1,21 +1,160 @@
 from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from beauty_salon.models import Service, Master, Client, Appointment, Review
+from beauty_salon.models import (
+    Service, Master, Client, Appointment, Review, ServiceRating, DailyBookingRollup, HourlyBookingRollup,
+)
+from beauty_salon.availability import booking_index
+from beauty_salon.ratings import rebuild_ratings
+from beauty_salon.rollups import rebuild_rollups
+from beauty_salon.search import rebuild_search_index
+from beauty_salon.stats import invalidate_stats
 from django.utils import timezone
+import multiprocessing
 import random
+import time
 from datetime import timedelta
 import faker
-from django.db import transaction
+from django.db import connection, connections, transaction
+
+POSITIVE_COMMENTS = [
+    'Отличный сервис!', 'Всё понравилось', 'Рекомендую',
+    'Хороший мастер', 'Приду ещё', 'Великолепно!',
+    'Всё отлично', 'Супер!', 'Очень доволен(а)', 'Спасибо большое!',
+    'Профессиональная работа', 'Отличный результат'
+]
+NEGATIVE_COMMENTS = [
+    'Могло быть лучше', 'Не совсем то, что ожидал(а)',
+    'Есть над чем поработать', 'Среднее качество'
+]
+# Сколько вариантов имен/телефонов/email генерирует Faker: дальше они берутся из пула
+FAKE_POOL_SIZE = 2000
+# Рабочий день мастера 9:00-21:00 в 30-минутных слотах
+SLOTS_PER_DAY = 24
+APPOINTMENT_DAYS = 210
+
+
+def insert_rows(model, columns, rows):
+    """
+    Один INSERT ... executemany без создания экземпляров модели.
+    rows - кортежи значений, уже подготовленных для БД.
+    """
+    quote = connection.ops.quote_name
+    column_names = ', '.join(quote(model._meta.get_field(name).column) for name in columns)
+    placeholders = ', '.join(['%s'] * len(columns))
+    sql = f'INSERT INTO {quote(model._meta.db_table)} ({column_names}) VALUES ({placeholders})'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+    return len(rows)
+
+
+def tune_connection():
+    if connection.vendor == 'sqlite':
+        # Вставка в случайном порядке по индексам внешних ключей упирается
+        # в кэш страниц (по умолчанию 2 МБ) - на время генерации даем 256 МБ.
+        # fsync на каждый коммит не нужен: упавшую генерацию просто запускают заново
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size = -262144')
+            if not connection.in_atomic_block:
+                cursor.execute('PRAGMA synchronous = OFF')
+
+
+def clear_table(model):
+    # QuerySet.delete() загружает объекты ради сигналов - на миллионах строк это часы
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+
+
+def db_value(model, field_name, value):
+    return model._meta.get_field(field_name).get_db_prep_value(value, connection)
+
+
+# Общие данные для генерации записей и отзывов. В дочерних процессах
+# заполняются через initializer пула, в основном - напрямую
+_context = {}
+
+
+def _init_worker(context):
+    _context.update(context)
+    # После fork соединение родителя использовать нельзя - открываем свое
+    connections.close_all()
+    tune_connection()
+
+
+def _rng(kind, chunk):
+    # Фрагмент генерируется одинаково при любом числе процессов
+    return random.Random(f"{_context['seed']}:{kind}:{chunk}")
+
+
+def _appointment_chunk(args):
+    chunk, count = args
+    rng = _rng('appointments', chunk)
+    # Фрагменту достаются свои дни мастеров (ячейки): записи разных фрагментов не пересекаются
+    cells = _context['cells'][chunk::_context['chunk_count']]
+    if not cells:
+        return 0
+    rows = []
+    for position, (master_id, day) in enumerate(cells):
+        # Сколько записей должно набраться к концу этой ячейки: недобор переходит дальше
+        wanted = count * (position + 1) // len(cells) - len(rows)
+        # Сетка дня мастера - 30-минутные слоты; услуга занимает duration / 30 слотов подряд
+        booked, used = [], 0
+        for _ in range(wanted):
+            service_id, slots = rng.choice(_context['services_by_master'][master_id])
+            if used + slots > SLOTS_PER_DAY:
+                break
+            booked.append((service_id, slots))
+            used += slots
+        # Свободные слоты случайно делятся на промежутки между записями
+        gaps = sorted(rng.randint(0, SLOTS_PER_DAY - used) for _ in booked)
+        start = 0
+        for gap, (service_id, slots) in zip(gaps, booked):
+            date = _context['appointment_dates'][day * SLOTS_PER_DAY + gap + start]
+            rows.append((rng.choice(_context['client_ids']), service_id, master_id, date))
+            start += slots
+    return insert_rows(Appointment, ('client', 'service', 'master', 'date'), rows)
+
+
+def _review_chunk(args):
+    chunk, count = args
+    rng = _rng('reviews', chunk)
+    clients = rng.choices(_context['client_ids'], k=count)
+    services = rng.choices(_context['service_ids'], k=count)
+    dates = rng.choices(_context['review_dates'], k=count)
+    rows = []
+    for client_id, service_id, date in zip(clients, services, dates):
+        # 80% положительных отзывов, 20% негативных
+        if rng.random() < 0.8:
+            rating = rng.randint(4, 5)
+            comment = rng.choice(POSITIVE_COMMENTS)
+        else:
+            rating = rng.randint(2, 3)
+            comment = rng.choice(NEGATIVE_COMMENTS)
+        rows.append((client_id, service_id, rating, comment, date))
+    return insert_rows(Review, ('client', 'service', 'rating', 'comment', 'date'), rows)
+
 
 class Command(BaseCommand):
     help = 'Generates large amount of test data'
 
-    def __init__(self):
-        super().__init__()
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=500)
+        parser.add_argument('--appointments', type=int, default=2000)
+        parser.add_argument('--reviews', type=int, default=1500)
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Rows per INSERT batch (and per worker task)')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes generating appointment and review batches in parallel')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
         self.fake = faker.Faker('ru_RU')
         self.services = []
         self.masters = []
-        self.clients = []
+        self.client_ids = []
+        # service_id -> id мастеров, которые ее оказывают
+        self.masters_by_service = {}
 
     def create_services(self):
         service_templates = [
@@ -39,25 +178,24 @@ class Command(BaseCommand):
         additions = ['с уходом', 'с массажем', 'комплексный', 'аппаратный', 'классический']
 
         self.stdout.write('Создание услуг...')
+        services = []
         for template in service_templates:
             for _ in range(4):  # 4 варианта каждой услуги
                 name_parts = [
                     template['name'],
-                    random.choice(types),
-                    random.choice(additions)
+                    self.rng.choice(types),
+                    self.rng.choice(additions)
                 ]
-                if random.random() > 0.5:  # 50% шанс добавить зону
-                    name_parts.insert(1, random.choice(zones))
+                if self.rng.random() > 0.5:  # 50% шанс добавить зону
+                    name_parts.insert(1, self.rng.choice(zones))
 
-                name = ' '.join(name_parts)
                 min_price, max_price = template['price_range']
-                
-                service = Service.objects.create(
-                    name=name,
-                    price=random.randint(min_price, max_price),
-                    duration=random.choice([30, 60, 90, 120, 150, 180])
-                )
-                self.services.append(service)
+                services.append(Service(
+                    name=' '.join(name_parts),
+                    price=self.rng.randint(min_price, max_price),
+                    duration=self.rng.choice([30, 60, 90, 120, 150, 180])
+                ))
+        self.services = Service.objects.bulk_create(services)
 
     def create_masters(self):
         specializations = {
@@ -72,163 +210,160 @@ class Command(BaseCommand):
         }
 
         self.stdout.write('Создание мастеров...')
+        masters = []
+        chosen_services = []
         for spec, related_services in specializations.items():
+            # Подбираем услуги по специализации
+            suitable_services = [
+                s for s in self.services
+                if any(rs in s.name for rs in related_services)
+            ]
             # 10-15 мастеров каждой специализации
-            for _ in range(random.randint(10, 15)):
-                master = Master.objects.create(
-                    name=self.fake.name(),
-                    specialization=spec
-                )
-                
-                # Подбираем услуги по специализации
-                suitable_services = [
-                    s for s in self.services 
-                    if any(rs in s.name for rs in related_services)
-                ]
-                
+            for _ in range(self.rng.randint(10, 15)):
+                masters.append(Master(name=self.fake.name(), specialization=spec))
                 # Выбираем 3-7 услуг для мастера
-                if suitable_services:
-                    master.services.set(random.sample(
-                        suitable_services,
-                        min(random.randint(3, 7), len(suitable_services))
-                    ))
-                
-                self.masters.append(master)
-
-    def create_clients(self):
-        self.stdout.write('Создание клиентов...')
-        batch_size = 50  # Создаем по 50 клиентов за раз
-        total_clients = 500
-        
-        for batch_start in range(0, total_clients, batch_size):
-            batch_end = min(batch_start + batch_size, total_clients)
-            self.stdout.write(f'Создание клиентов {batch_start+1}-{batch_end} из {total_clients}...')
-            
-            # Создаем пользователей пакетом
-            users = []
-            for i in range(batch_start, batch_end):
-                user = User(
-                    username=f'client{i}',
-                    email=self.fake.email(),
-                    is_active=True
-                )
-                user.set_password('password123')
-                users.append(user)
-            created_users = User.objects.bulk_create(users)
-            
-            # Создаем клиентов пакетом
-            clients = []
-            for user in created_users:
-                client = Client(
-                    user=user,
-                    name=self.fake.name(),
-                    phone=self.fake.phone_number(),
-                    email=user.email
-                )
-                clients.append(client)
-            
-            created_clients = Client.objects.bulk_create(clients)
-            self.clients.extend(created_clients)
-            
-            # Очищаем память
-            users = []
-            clients = []
-
-    def create_appointments(self):
-        self.stdout.write('Создание записей...')
-        start_date = timezone.now() - timedelta(days=180)
-        
-        appointments = []
-        for _ in range(2000):
-            client = random.choice(self.clients)
-            service = random.choice(self.services)
-            master = random.choice([m for m in self.masters if service in m.services.all()])
-            
-            date = start_date + timedelta(
-                days=random.randint(0, 210),
-                hours=random.randint(9, 20),
-                minutes=random.choice([0, 30])
-            )
-            
-            appointments.append(Appointment(
-                client=client,
-                service=service,
-                master=master,
-                date=date
-            ))
-            
-            if len(appointments) >= 100:
-                Appointment.objects.bulk_create(appointments)
-                appointments = []
-        
-        if appointments:
-            Appointment.objects.bulk_create(appointments)
-
-    def create_reviews(self):
-        self.stdout.write('Создание отзывов...')
-        positive_comments = [
-            'Отличный сервис!', 'Всё понравилось', 'Рекомендую', 
-            'Хороший мастер', 'Приду ещё', 'Великолепно!',
-            'Всё отлично', 'Супер!', 'Очень доволен(а)', 'Спасибо большое!',
-            'Профессиональная работа', 'Отличный результат'
-        ]
-        negative_comments = [
-            'Могло быть лучше', 'Не совсем то, что ожидал(а)',
-            'Есть над чем поработать', 'Среднее качество'
+                chosen_services.append(self.rng.sample(
+                    suitable_services,
+                    min(self.rng.randint(3, 7), len(suitable_services))
+                ))
+        self.masters = Master.objects.bulk_create(masters)
+
+        # Связи мастер-услуга одним INSERT в промежуточную таблицу
+        through = Master.services.through
+        links = []
+        for master, services in zip(self.masters, chosen_services):
+            for service in services:
+                links.append(through(master_id=master.id, service_id=service.id))
+                self.masters_by_service.setdefault(service.id, []).append(master.id)
+        through.objects.bulk_create(links)
+
+    def create_clients(self, total_clients):
+        self.stdout.write(f'Создание клиентов: {total_clients}...')
+        # PBKDF2 считается один раз: у всех клиентов одинаковый пароль
+        password = make_password('password123')
+        date_joined = db_value(User, 'date_joined', timezone.now())
+        names = [self.fake.name() for _ in range(min(FAKE_POOL_SIZE, total_clients))]
+        phones = [self.fake.phone_number() for _ in range(len(names))]
+        emails = [self.fake.email() for _ in range(len(names))]
+
+        insert_rows(User, (
+            'username', 'email', 'password', 'first_name', 'last_name',
+            'is_active', 'is_staff', 'is_superuser', 'date_joined',
+        ), [
+            (f'client{i}', emails[i % len(emails)], password, '', '', True, False, False, date_joined)
+            for i in range(total_clients)
+        ])
+        # Все пользователи, кроме суперпользователей, удалены в начале - остались только новые
+        user_ids = list(User.objects.filter(is_superuser=False).order_by('id').values_list('id', flat=True))
+        insert_rows(Client, ('user', 'name', 'phone', 'email', 'picture_hash'), [
+            (user_id, self.rng.choice(names), self.rng.choice(phones), emails[i % len(emails)], '')
+            for i, user_id in enumerate(user_ids)
+        ])
+        self.client_ids = list(Client.objects.order_by('id').values_list('id', flat=True))
+
+    def date_choices(self, model, start, days, with_time):
+        """Возможные даты уже в формате БД: их немного, а подготовка каждой стоит заметно"""
+        values = []
+        for day in range(days + 1):
+            if not with_time:
+                values.append(start + timedelta(days=day))
+                continue
+            for hour in range(9, 21):
+                for minutes in (0, 30):
+                    values.append(start + timedelta(days=day, hours=hour, minutes=minutes))
+        return [db_value(model, 'date', value) for value in values]
+
+    def run_chunks(self, title, task, total, batch_size, workers, context):
+        """Разбивает total строк на фрагменты и вставляет их в текущем или в нескольких процессах"""
+        self.stdout.write(f'Создание {title}: {total}...')
+        chunks = [
+            (index, min(batch_size, total - offset))
+            for index, offset in enumerate(range(0, total, batch_size))
         ]
+        started = time.perf_counter()
+        if workers > 1 and len(chunks) > 1:
+            # Дочерние процессы открывают свои соединения - родительское закрываем до fork
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(
+                workers, initializer=_init_worker, initargs=(context,)
+            ) as pool:
+                inserted = sum(pool.imap_unordered(task, chunks))
+            tune_connection()
+        else:
+            _context.update(context)
+            inserted = sum(task(chunk) for chunk in chunks)
+        elapsed = time.perf_counter() - started
+        if inserted < total:
+            self.stdout.write(self.style.WARNING(f'  Поместилось только {inserted} из {total}'))
+        self.stdout.write(f'  {inserted} строк за {elapsed:.1f} с ({inserted / elapsed if elapsed else 0:.0f} строк/с)')
+
+    def handle(self, *args, **options):
+        seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(seed)
+        self.fake.seed_instance(seed)
+        tune_connection()
 
-        reviews = []
-        for _ in range(1500):
-            client = random.choice(self.clients)
-            service = random.choice(self.services)
-            
-            # 80% положительных отзывов, 20% негативных
-            if random.random() < 0.8:
-                rating = random.randint(4, 5)
-                comment = random.choice(positive_comments)
-            else:
-                rating = random.randint(2, 3)
-                comment = random.choice(negative_comments)
-            
-            reviews.append(Review(
-                client=client,
-                service=service,
-                rating=rating,
-                comment=comment,
-                date=timezone.now() - timedelta(days=random.randint(0, 180))
-            ))
-            
-            if len(reviews) >= 100:
-                Review.objects.bulk_create(reviews)
-                reviews = []
-        
-        if reviews:
-            Review.objects.bulk_create(reviews)
-
-    @transaction.atomic
-    def handle(self, *args, **kwargs):
         # Очистка существующих данных
         self.stdout.write('Очистка базы данных...')
-        Review.objects.all().delete()
-        Appointment.objects.all().delete()
-        Client.objects.all().delete()
-        Master.objects.all().delete()
-        Service.objects.all().delete()
-        User.objects.filter(is_superuser=False).delete()
+        with transaction.atomic():
+            # Сводки ссылаются на услуги и мастеров - иначе проверка внешних ключей упадет на коммите
+            for model in (
+                DailyBookingRollup, HourlyBookingRollup, Review, Appointment, ServiceRating, Client,
+                Master.services.through, Master, Service,
+            ):
+                clear_table(model)
+            User.objects.filter(is_superuser=False).delete()
 
         # Создание новых данных
-        self.create_services()
-        self.create_masters()
-        self.create_clients()
-        self.create_appointments()
-        self.create_reviews()
+        with transaction.atomic():
+            self.create_services()
+            self.create_masters()
+            self.create_clients(options['clients'])
+
+        # master_id -> (услуга, число слотов): записи мастера раскладываются по его сетке дня
+        durations = {service.id: service.duration for service in self.services}
+        services_by_master = {}
+        for service_id, master_ids in self.masters_by_service.items():
+            for master_id in master_ids:
+                services_by_master.setdefault(master_id, []).append(
+                    (service_id, -(-durations[service_id] // 30))
+                )
+        cells = [
+            (master_id, day) for master_id in services_by_master for day in range(APPOINTMENT_DAYS + 1)
+        ]
+        self.rng.shuffle(cells)
+
+        now = timezone.now().replace(minute=0, second=0, microsecond=0)
+        context = {
+            'seed': seed,
+            'client_ids': self.client_ids,
+            'service_ids': [service.id for service in self.services],
+            'services_by_master': services_by_master,
+            # Ячейки (мастер, день) в случайном порядке: фрагменты берут их через одну
+            'cells': cells,
+            'chunk_count': -(-options['appointments'] // options['batch_size']),
+            'appointment_dates': self.date_choices(
+                Appointment, now.replace(hour=0) - timedelta(days=180), APPOINTMENT_DAYS, with_time=True
+            ),
+            'review_dates': self.date_choices(Review, now - timedelta(days=180), 180, with_time=False),
+        }
+        batch_size, workers = options['batch_size'], options['workers']
+        self.run_chunks('записей', _appointment_chunk, options['appointments'], batch_size, workers, context)
+        self.run_chunks('отзывов', _review_chunk, options['reviews'], batch_size, workers, context)
+
+        # Данные записаны мимо сигналов - производные структуры пересчитываем целиком
+        rebuild_ratings()
+        rebuild_rollups()
+        rebuild_search_index()
+        invalidate_stats()
+        booking_index.invalidate()
 
         # Статистика
         self.stdout.write(self.style.SUCCESS(f'''
-        Успешно создано:
+        Успешно создано (seed {seed}):
         - {Service.objects.count()} услуг
         - {Master.objects.count()} мастеров
         - {Client.objects.count()} клиентов
         - {Appointment.objects.count()} записей
         - {Review.objects.count()} отзывов
-        '''))
\ No newline at end of file
+        '''))
@@ -2,6 +2,8 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from django.db import models
 from beauty_salon.models import Client, Service, Review
+from beauty_salon.ratings import rebuild_ratings
+from beauty_salon.search import rebuild_search_index
 from django.utils import timezone
 from datetime import timedelta
 import random
@@ -121,6 +123,9 @@ class Command(BaseCommand):
         
         if reviews:
             Review.objects.bulk_create(reviews)
+        # bulk_create не отправляет сигналы - сводку оценок и поисковый индекс пересчитываем целиком
+        rebuild_ratings()
+        rebuild_search_index()
 
         total_reviews = Review.objects.count()
         self.stdout.write(self.style.SUCCESS(f'Successfully created {total_reviews} reviews'))
@@ -0,0 +1,57 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from beauty_salon.images import build_derivatives
+from beauty_salon.models import Client, Service
+
+
+class Command(BaseCommand):
+    help = 'Builds thumbnails and WebP srcset copies for existing Service and Client pictures'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--force', action='store_true',
+                            help='Process pictures that already have a hash as well')
+
+    def handle(self, *args, **options):
+        pending = []
+        for model in (Service, Client):
+            queryset = model.objects.exclude(picture='').exclude(picture__isnull=True)
+            if not options['force']:
+                queryset = queryset.filter(picture_hash='')
+            pending.extend((model, pk, name) for pk, name in queryset.values_list('pk', 'picture'))
+        names = sorted({name for _, _, name in pending})
+        if not names:
+            self.stdout.write('Nothing to do')
+            return
+
+        started = time.perf_counter()
+        workers = max(1, min(options['workers'], len(names)))
+        if workers > 1:
+            # Воркеры работают только с файлами; соединения родителя не должны уйти в fork
+            connections.close_all()
+            with ProcessPoolExecutor(workers, mp_context=get_context('fork')) as pool:
+                hashes = dict(zip(names, pool.map(build_derivatives, names, chunksize=8)))
+        else:
+            hashes = {name: build_derivatives(name) for name in names}
+
+        updates = {}
+        for model, pk, name in pending:
+            if hashes[name]:
+                updates.setdefault(model, []).append(model(pk=pk, picture_hash=hashes[name]))
+        with transaction.atomic():
+            for model, objs in updates.items():
+                model.objects.bulk_update(objs, ['picture_hash'], batch_size=500)
+
+        failed = [name for name in names if not hashes[name]]
+        for name in failed:
+            self.stderr.write(f'Skipped {name}: missing or not an image')
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {len(names) - len(failed)} pictures for {sum(map(len, updates.values()))} objects '
+            f'in {time.perf_counter() - started:.1f} s using {workers} workers'
+        ))
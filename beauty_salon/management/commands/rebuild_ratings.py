@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from beauty_salon.ratings import rebuild_ratings
+from beauty_salon.stats import invalidate_stats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-service rating summaries from the reviews table'
+
+    def handle(self, *args, **options):
+        services = rebuild_ratings()
+        invalidate_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating summaries for {services} services'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from beauty_salon.rollups import rebuild_rollups
+from beauty_salon.stats import invalidate_stats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily and hourly booking rollups from the appointments table'
+
+    def handle(self, *args, **options):
+        rows = rebuild_rollups()
+        invalidate_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt booking rollups ({rows} daily rows)'))
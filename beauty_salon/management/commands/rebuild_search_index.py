@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from beauty_salon.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index over services, masters and reviews'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            documents = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {documents} documents'))
@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from beauty_salon.export_jobs import purge_exports, run_export_job
+from beauty_salon.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs queued Excel export jobs in this process (e.g. jobs left over after a restart) '
+        'and optionally deletes old jobs with their files'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--include-running', action='store_true',
+            help='Also rerun jobs marked as running: only when no web process is alive to finish them',
+        )
+        parser.add_argument(
+            '--purge', action='store_true',
+            help='Delete jobs and files older than --keep-hours instead of running jobs',
+        )
+        parser.add_argument('--keep-hours', type=float, default=settings.EXPORT_KEEP_HOURS)
+
+    def handle(self, *args, **options):
+        if options['purge']:
+            count = purge_exports(timezone.now() - timedelta(hours=options['keep_hours']))
+            self.stdout.write(self.style.SUCCESS(f'Deleted {count} export jobs'))
+            return
+
+        statuses = (ExportJob.PENDING, ExportJob.RUNNING) if options['include_running'] else (ExportJob.PENDING,)
+        job_ids = list(ExportJob.objects.filter(status__in=statuses).order_by('id').values_list('id', flat=True))
+        done = sum(run_export_job(job_id, statuses=statuses) for job_id in job_ids)
+        failed = ExportJob.objects.filter(pk__in=job_ids, status=ExportJob.FAILED).count()
+        self.stdout.write(self.style.SUCCESS(f'Ran {done} export jobs, {failed} failed'))
@@ -0,0 +1,275 @@
+"""
+Метрики запросов: время ответа, число и время SQL-запросов, время
+сериализации и размер ответа по маршруту и действию ViewSet.
+
+RequestMetricsMiddleware собирает замер для доли запросов
+METRICS_SAMPLE_RATE, /metrics отдает накопленное в текстовом формате
+Prometheus. При METRICS_SAMPLE_RATE = 0 middleware убирает себя из
+цепочки и ничего не стоит. Счетчики живут в памяти процесса: Prometheus
+опрашивает каждый воркер отдельно и суммирует сам.
+"""
+import json
+import logging
+import random
+import threading
+from contextvars import ContextVar
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+LABELS = ('route', 'method', 'action')
+
+_current_sample = ContextVar('metrics_sample', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self.series = {}
+
+    def observe(self, values, amount=1):
+        self.series[values] = self.series.get(values, 0) + amount
+
+    def render(self):
+        for values, total in sorted(self.series.items()):
+            yield f'{self.name}{{{_format_labels(self.labels, values)}}} {total}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self.buckets = buckets
+        # значения меток -> [счетчики по корзинам..., сумма, количество]
+        self.series = {}
+
+    def observe(self, values, value):
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        for values, series in sorted(self.series.items()):
+            labels = _format_labels(self.labels, values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f'{self.name}_bucket{{{labels},le="+Inf"}} {series[-1]}'
+            yield f'{self.name}_sum{{{labels}}} {series[-2]:.6f}'
+            yield f'{self.name}_count{{{labels}}} {series[-1]}'
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter(
+            'salon_http_requests_total', 'Requests by route, action and status', LABELS + ('status',)
+        )
+        self.latency = Histogram(
+            'salon_http_request_duration_seconds', 'Request latency', LABELS, LATENCY_BUCKETS
+        )
+        self.db_queries = Histogram(
+            'salon_db_queries_per_request', 'SQL queries per request', LABELS, QUERY_COUNT_BUCKETS
+        )
+        self.db_time = Histogram(
+            'salon_db_duration_seconds', 'Time spent in SQL per request', LABELS, LATENCY_BUCKETS
+        )
+        self.serializer_time = Histogram(
+            'salon_serializer_duration_seconds', 'Time spent in DRF serializers per request',
+            LABELS, LATENCY_BUCKETS
+        )
+        self.response_size = Histogram(
+            'salon_http_response_size_bytes', 'Response body size', LABELS, SIZE_BUCKETS
+        )
+        self.metrics = (
+            self.requests, self.latency, self.db_queries, self.db_time,
+            self.serializer_time, self.response_size,
+        )
+
+    def record(self, sample):
+        labels = (sample.route, sample.method, sample.action)
+        with self._lock:
+            self.requests.observe(labels + (str(sample.status),))
+            self.latency.observe(labels, sample.duration)
+            if sample.db_measured:
+                self.db_queries.observe(labels, sample.db_queries)
+                self.db_time.observe(labels, sample.db_time)
+            self.serializer_time.observe(labels, sample.serializer_time)
+            if sample.size is not None:
+                self.response_size.observe(labels, sample.size)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for metric in self.metrics:
+                lines.append(f'# HELP {metric.name} {metric.help_text}')
+                lines.append(f'# TYPE {metric.name} {metric.kind}')
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            for metric in self.metrics:
+                metric.series.clear()
+
+
+registry = Registry()
+
+
+class RequestSample:
+    """Замер одного запроса"""
+    route = 'unmatched'
+    action = ''
+    status = 0
+    duration = 0.0
+    size = None
+    # Под ASGI синхронный код идет в другом потоке со своим соединением -
+    # execute_wrapper его не видит, и SQL в таком замере не учитывается
+    db_measured = False
+
+    def __init__(self, method):
+        self.method = method
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper: время и число SQL-запросов
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - started
+            self.db_queries += 1
+
+    def finish(self, request, response, duration):
+        self.duration = duration
+        self.status = response.status_code
+        match = request.resolver_match
+        if match is not None:
+            self.route = match.route
+            # DRF as_view() хранит соответствие метод -> действие ViewSet
+            actions = getattr(match.func, 'actions', None) or {}
+            self.action = actions.get(request.method.lower(), '')
+        if not response.streaming:
+            self.size = len(response.content)
+
+    def as_dict(self):
+        return {
+            'route': self.route, 'method': self.method, 'action': self.action,
+            'status': self.status, 'duration_ms': round(self.duration * 1000, 2),
+            'db_queries': self.db_queries if self.db_measured else None,
+            'db_ms': round(self.db_time * 1000, 2) if self.db_measured else None,
+            'serializer_ms': round(self.serializer_time * 1000, 2), 'bytes': self.size,
+        }
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.sample_rate = getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        self.log = getattr(settings, 'METRICS_LOG', False)
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+        sample = RequestSample(request.method)
+        sample.db_measured = True
+        token = _current_sample.set(sample)
+        started = perf_counter()
+        try:
+            with connection.execute_wrapper(sample):
+                response = self.get_response(request)
+        finally:
+            _current_sample.reset(token)
+        self._record(request, response, sample, perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+        sample = RequestSample(request.method)
+        token = _current_sample.set(sample)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_sample.reset(token)
+        self._record(request, response, sample, perf_counter() - started)
+        return response
+
+    def _record(self, request, response, sample, duration):
+        sample.finish(request, response, duration)
+        registry.record(sample)
+        if self.log:
+            logger.info(json.dumps(sample.as_dict()))
+
+
+class SerializerTimingMixin:
+    """Время .data верхнего сериализатора попадает в замер текущего запроса"""
+    @property
+    def data(self):
+        sample = _current_sample.get()
+        if sample is None or self.parent is not None:
+            return super().data
+        started = perf_counter()
+        try:
+            return super().data
+        finally:
+            sample.serializer_time += perf_counter() - started
+
+
+class TimedListSerializer(SerializerTimingMixin, serializers.ListSerializer):
+    pass
+
+
+def metrics_view(request):
+    # При заданном METRICS_TOKEN Prometheus должен прислать его в Authorization: Bearer
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    # Без токена метрики открыты только при DEBUG или явном METRICS_PUBLIC
+    if not token and not (settings.DEBUG or getattr(settings, 'METRICS_PUBLIC', False)):
+        raise Http404
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_ratings(apps, schema_editor):
+    Review = apps.get_model('beauty_salon', 'Review')
+    ServiceRating = apps.get_model('beauty_salon', 'ServiceRating')
+    rows = Review.objects.values('service_id').annotate(
+        count=Count('id'),
+        total=Sum('rating', default=0),
+        **{f'stars_{stars}': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)},
+    )
+    ServiceRating.objects.bulk_create([ServiceRating(**row) for row in rows], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beauty_salon', '0003_appointment_review_date_id_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceRating',
+            fields=[
+                ('service', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='beauty_salon.service')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Количество отзывов')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Сумма оценок')),
+                ('stars_1', models.PositiveIntegerField(default=0)),
+                ('stars_2', models.PositiveIntegerField(default=0)),
+                ('stars_3', models.PositiveIntegerField(default=0)),
+                ('stars_4', models.PositiveIntegerField(default=0)),
+                ('stars_5', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Рейтинг услуги',
+                'verbose_name_plural': 'Рейтинги услуг',
+            },
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
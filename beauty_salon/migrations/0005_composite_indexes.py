@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beauty_salon', '0004_service_rating'),
+    ]
+
+    # Сначала составные индексы, потом удаление индексов по одному внешнему ключу:
+    # запросы по client/master не остаются без индекса между шагами
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['client', 'date'], name='appointment_client_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['master', 'date'], name='appointment_master_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['client', 'date'], name='review_client_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['service', 'rating'], name='review_service_rating_idx'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='client',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='beauty_salon.client'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='master',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='beauty_salon.master'),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='client',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='beauty_salon.client'),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='service',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='beauty_salon.service'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:53
+
+import beauty_salon.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beauty_salon', '0006_picture_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='client',
+            name='picture',
+            field=models.ImageField(blank=True, null=True, storage=beauty_salon.storage.media_storage, upload_to='clients/'),
+        ),
+        migrations.AlterField(
+            model_name='service',
+            name='picture',
+            field=models.ImageField(null=True, storage=beauty_salon.storage.media_storage, upload_to='services', verbose_name='Изображение'),
+        ),
+    ]
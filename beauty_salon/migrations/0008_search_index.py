@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from beauty_salon.search import create_search_index, drop_search_index, rebuild_search_index
+
+
+def create_index(apps, schema_editor):
+    create_search_index(schema_editor.connection)
+    rebuild_search_index(apps, schema_editor.connection)
+
+
+def drop_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beauty_salon', '0007_content_addressed_storage'),
+    ]
+
+    operations = [
+        # Таблица индекса зависит от СУБД (FTS5 или tsvector) - создается вне моделей
+        migrations.RunPython(create_index, drop_index),
+    ]
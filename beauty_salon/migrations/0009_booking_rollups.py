@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+
+def fill_rollups(apps, schema_editor):
+    Appointment = apps.get_model('beauty_salon', 'Appointment')
+    tz = timezone.get_default_timezone()
+    for model_name, field, trunc in (
+        ('DailyBookingRollup', 'day', TruncDate('date', tzinfo=tz)),
+        ('HourlyBookingRollup', 'hour', TruncHour('date', tzinfo=tz)),
+    ):
+        model = apps.get_model('beauty_salon', model_name)
+        rows = Appointment.objects.order_by().annotate(**{field: trunc}).values(
+            field, 'service_id', 'master_id'
+        ).annotate(
+            bookings=Count('id'),
+            booked_minutes=Sum('service__duration'),
+            revenue=Sum('service__price'),
+        )
+        model.objects.bulk_create([model(**row) for row in rows.iterator(chunk_size=1000)], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beauty_salon', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBookingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bookings', models.PositiveIntegerField(default=0, verbose_name='Записей')),
+                ('booked_minutes', models.PositiveIntegerField(default=0, verbose_name='Занято минут')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('day', models.DateField(verbose_name='День')),
+                ('master', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='beauty_salon.master')),
+                ('service', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='beauty_salon.service')),
+            ],
+            options={
+                'verbose_name': 'Сводка записей за день',
+                'verbose_name_plural': 'Сводки записей за день',
+                'indexes': [models.Index(fields=['service', 'day'], name='daily_rollup_service_idx'), models.Index(fields=['master', 'day'], name='daily_rollup_master_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'service', 'master'), name='daily_rollup_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyBookingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bookings', models.PositiveIntegerField(default=0, verbose_name='Записей')),
+                ('booked_minutes', models.PositiveIntegerField(default=0, verbose_name='Занято минут')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('hour', models.DateTimeField(verbose_name='Час')),
+                ('master', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='beauty_salon.master')),
+                ('service', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='beauty_salon.service')),
+            ],
+            options={
+                'verbose_name': 'Сводка записей за час',
+                'verbose_name_plural': 'Сводки записей за час',
+                'indexes': [models.Index(fields=['service', 'hour'], name='hourly_rollup_service_idx'), models.Index(fields=['master', 'hour'], name='hourly_rollup_master_idx')],
+                'constraints': [models.UniqueConstraint(fields=('hour', 'service', 'master'), name='hourly_rollup_unique')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+from beauty_salon.search import rebuild_search_index
+
+
+def rebuild_index(apps, schema_editor):
+    rebuild_search_index(apps, schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('beauty_salon', '0010_export_jobs'),
+    ]
+
+    operations = [
+        # В индекс добавлены имена клиентов (поиск записей и отзывов в админке)
+        migrations.RunPython(rebuild_index, migrations.RunPython.noop),
+    ]
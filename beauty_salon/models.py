@@ -1,11 +1,15 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+from .storage import media_storage
+
 class Service(models.Model):
     name = models.TextField("Название услуги")
     price = models.DecimalField("Цена", max_digits=10, decimal_places=2)
     duration = models.IntegerField("Длительность (мин)")
-    picture = models.ImageField("Изображение", null=True, upload_to="services")
+    picture = models.ImageField("Изображение", null=True, upload_to="services", storage=media_storage)
+    # sha256 картинки: по нему строятся URL уменьшенных копий (images.py)
+    picture_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
 
     class Meta:
         verbose_name = "Услуга"
@@ -20,7 +24,8 @@ class Client(models.Model):
     phone = models.CharField(max_length=20)
     email = models.EmailField()
     service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, blank=True)
-    picture = models.ImageField(upload_to='clients/', null=True, blank=True)
+    picture = models.ImageField(upload_to='clients/', null=True, blank=True, storage=media_storage)
+    picture_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
 
     def __str__(self):
         return self.name
@@ -38,21 +43,29 @@ class Master(models.Model):
         return self.name
 
 class Appointment(models.Model):
-    client = models.ForeignKey(Client, on_delete=models.CASCADE)
+    # Отдельные индексы client и master не нужны: они - префиксы составных индексов ниже
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, db_index=False)
     service = models.ForeignKey(Service, on_delete=models.CASCADE)
-    master = models.ForeignKey(Master, on_delete=models.CASCADE)
+    master = models.ForeignKey(Master, on_delete=models.CASCADE, db_index=False)
     date = models.DateTimeField("Дата и время")
 
     class Meta:
         verbose_name = "Запись"
         verbose_name_plural = "Записи"
+        indexes = [
+            models.Index(fields=['date', 'id'], name='appointment_date_id_idx'),
+            # Записи клиента по дате (список и статистика пользователя)
+            models.Index(fields=['client', 'date'], name='appointment_client_date_idx'),
+            # Занятость мастера в интервале (проверка пересечений, индекс слотов)
+            models.Index(fields=['master', 'date'], name='appointment_master_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.client} - {self.service} - {self.date}"
 
 class Review(models.Model):
-    client = models.ForeignKey(Client, on_delete=models.CASCADE)
-    service = models.ForeignKey(Service, on_delete=models.CASCADE)
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, db_index=False)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, db_index=False)
     rating = models.IntegerField("Оценка", choices=[(i, str(i)) for i in range(1, 6)])
     comment = models.TextField("Комментарий")
     date = models.DateTimeField(auto_now_add=True)
@@ -60,6 +73,141 @@ class Review(models.Model):
     class Meta:
         verbose_name = "Отзыв"
         verbose_name_plural = "Отзывы"
+        indexes = [
+            models.Index(fields=['date', 'id'], name='review_date_id_idx'),
+            # Отзывы клиента по дате
+            models.Index(fields=['client', 'date'], name='review_client_date_idx'),
+            # Группировка оценок по услуге читается из индекса, без таблицы
+            models.Index(fields=['service', 'rating'], name='review_service_rating_idx'),
+        ]
 
     def __str__(self):
         return f"{self.client} - {self.service} - {self.rating}"
+
+class ServiceRating(models.Model):
+    """
+    Сводка оценок услуги. Обновляется сигналами при каждой записи Review,
+    чтобы рейтинг в списке услуг не требовал агрегации по отзывам.
+    """
+    service = models.OneToOneField(
+        Service, on_delete=models.CASCADE, primary_key=True, related_name="rating_summary"
+    )
+    count = models.PositiveIntegerField("Количество отзывов", default=0)
+    total = models.PositiveIntegerField("Сумма оценок", default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Рейтинг услуги"
+        verbose_name_plural = "Рейтинги услуг"
+
+    def __str__(self):
+        return f"{self.service_id}: {self.average} ({self.count})"
+
+    @property
+    def average(self):
+        return round(self.total / self.count, 2) if self.count else None
+
+    @property
+    def histogram(self):
+        return {stars: getattr(self, f'stars_{stars}') for stars in range(1, 6)}
+
+class BookingRollup(models.Model):
+    """
+    Записи, занятые минуты и выручка по услуге и мастеру за интервал.
+    Обновляется сигналами при каждой записи Appointment (rollups.py):
+    графики за годы читают сотни строк сводки вместо таблицы записей.
+    """
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, db_index=False, related_name='+')
+    master = models.ForeignKey(Master, on_delete=models.CASCADE, db_index=False, related_name='+')
+    bookings = models.PositiveIntegerField("Записей", default=0)
+    booked_minutes = models.PositiveIntegerField("Занято минут", default=0)
+    revenue = models.DecimalField("Выручка", max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+class DailyBookingRollup(BookingRollup):
+    day = models.DateField("День")
+
+    class Meta:
+        verbose_name = "Сводка записей за день"
+        verbose_name_plural = "Сводки записей за день"
+        constraints = [
+            # Он же индекс для выборки по интервалу дней
+            models.UniqueConstraint(fields=['day', 'service', 'master'], name='daily_rollup_unique'),
+        ]
+        indexes = [
+            # Ряд по услуге или мастеру, пересчет сводки услуги при смене цены
+            models.Index(fields=['service', 'day'], name='daily_rollup_service_idx'),
+            models.Index(fields=['master', 'day'], name='daily_rollup_master_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.service_id}/{self.master_id}: {self.bookings}"
+
+class HourlyBookingRollup(BookingRollup):
+    hour = models.DateTimeField("Час")
+
+    class Meta:
+        verbose_name = "Сводка записей за час"
+        verbose_name_plural = "Сводки записей за час"
+        constraints = [
+            models.UniqueConstraint(fields=['hour', 'service', 'master'], name='hourly_rollup_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['service', 'hour'], name='hourly_rollup_service_idx'),
+            models.Index(fields=['master', 'hour'], name='hourly_rollup_master_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.hour} {self.service_id}/{self.master_id}: {self.bookings}"
+
+class ExportJob(models.Model):
+    """
+    Выгрузка в Excel, собираемая в фоне (export_jobs.py). scope - чьи
+    данные в файле: 'all' или id пользователя; по виду и scope одинаковые
+    запросы получают одно задание и один файл.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    ]
+    KIND_CHOICES = [
+        ('appointments', 'Записи'),
+        ('masters', 'Мастера'),
+        ('services', 'Услуги'),
+    ]
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    kind = models.CharField("Выгрузка", max_length=16, choices=KIND_CHOICES)
+    scope = models.CharField(max_length=32)
+    status = models.CharField("Статус", max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    # Обычное хранилище, не адресация по содержимому: файлы удаляются вместе с заданием
+    file = models.FileField("Файл", upload_to='exports/', blank=True)
+    rows = models.PositiveIntegerField("Строк", null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField("Создано", auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Выгрузка"
+        verbose_name_plural = "Выгрузки"
+        indexes = [
+            # Поиск свежего задания с тем же видом и scope
+            models.Index(fields=['kind', 'scope', 'created_at'], name='export_job_reuse_idx'),
+            models.Index(fields=['status'], name='export_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} ({self.scope}): {self.status}"
@@ -0,0 +1,18 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Cursor-пагинация по id: следующая страница выбирается условием
+    по индексу, а не OFFSET, поэтому время ответа не зависит от того,
+    насколько далеко клиент ушел по списку.
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class DateCursorPagination(IdCursorPagination):
+    # Свежие записи первыми; id разрешает совпадения по дате
+    ordering = ('-date', '-id')
@@ -1,6 +1,23 @@
 from rest_framework.permissions import BasePermission
 from django.core.cache import cache
 
+# OTP действителен 30 минут
+OTP_TIMEOUT = 30 * 60
+
+
+def otp_cache_key(user_id):
+    return f'otp_good_{user_id}'
+
+
+def mark_otp_verified(user_id):
+    # Кэш общий для воркеров: следующий запрос может попасть в другой процесс
+    cache.set(otp_cache_key(user_id), True, OTP_TIMEOUT)
+
+
+def is_otp_verified(user_id):
+    return cache.get(otp_cache_key(user_id), False)
+
+
 class OTPRequired(BasePermission):
     def has_permission(self, request, view):
         # Разрешаем GET запросы без OTP
@@ -9,7 +26,6 @@ class OTPRequired(BasePermission):
             
         # Для PUT/DELETE требуем OTP
         if request.method in ['PUT', 'DELETE']:
-            otp_key = cache.get(f'otp_good_{request.user.id}', False)
-            return bool(request.user and otp_key)
+            return bool(request.user and is_otp_verified(request.user.id))
             
-        return True
\ No newline at end of file
+        return True
@@ -0,0 +1,236 @@
+"""
+Поиск N+1 и медленных запросов для разработки и CI.
+
+QueryWatcher подключается к курсору через connection.execute_wrapper и
+сводит SQL запроса к форме (fingerprint): параметры и списки IN
+заменяются заглушками. Одна и та же форма, выполненная за запрос
+QUERYWATCH_REPEAT_THRESHOLD раз и больше, - почти всегда обращение к
+связи в цикле. Для каждой формы запоминается место в коде проекта, откуда
+она пришла; для запросов дольше QUERYWATCH_SLOW_MS - полный стек.
+
+QueryWatchMiddleware включается настройкой QUERYWATCH и пишет находки в
+лог beauty_salon.querywatch. Тестовый раннер (app/test_runner.py)
+включает его для всех тестов и делает находки в QUERYWATCH_RAISE_FOR
+ошибкой: тест, который вызывает N+1 в api.py, падает. Форма относится к
+файлу, если он есть где угодно в стеке: ленивое обращение к связи в
+serializers.py, вызванное из api.py, - тоже находка api.py.
+
+Наблюдатель запроса лежит в ContextVar, а курсоры всех соединений
+передают ему запросы постоянной оберткой: под ASGI синхронный код view
+идет в пуле потоков со своими соединениями, и contextvars переносятся
+туда вместе с вызовом.
+"""
+import logging
+import re
+import sys
+import traceback
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+REPEAT_THRESHOLD = 5
+SLOW_MS = 100
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+_SPACES = re.compile(r'\s+')
+_PROJECT_ROOT = str(Path(__file__).resolve().parent.parent)
+# Обертки курсора (querywatch, metrics) стоят в стеке между кодом и БД - это не место вызова
+_WRAPPER_FILES = {str(Path(__file__).resolve()), str(Path(__file__).resolve().with_name('metrics.py'))}
+
+_current_watcher = ContextVar('querywatch', default=None)
+
+
+def fingerprint(sql):
+    """Форма запроса: литералы и списки параметров любой длины сводятся к одной записи"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def project_frames(stack):
+    """Кадры кода проекта, без Django, DRF и оберток курсора"""
+    return [
+        frame for frame in stack
+        if frame.filename.startswith(_PROJECT_ROOT)
+        and '-packages' not in frame.filename and frame.filename not in _WRAPPER_FILES
+    ]
+
+
+def _relative(filename):
+    return Path(filename).relative_to(_PROJECT_ROOT).as_posix()
+
+
+def _location(frames):
+    if not frames:
+        return '<unknown>'
+    frame = frames[-1]
+    return f'{_relative(frame.filename)}:{frame.lineno} in {frame.name}'
+
+
+@dataclass
+class QueryShape:
+    sql: str
+    location: str
+    # Все файлы проекта в стеке первого выполнения, не только самый внутренний
+    files: frozenset = frozenset()
+    count: int = 0
+    duration: float = 0.0
+
+
+@dataclass
+class SlowQuery:
+    sql: str
+    duration: float
+    stack: list = field(default_factory=list)
+
+
+class QueryWatcher:
+    """
+    Вызываемый объект для connection.execute_wrapper. Стек снимается
+    только при первой встрече формы и для медленных запросов, поэтому
+    повторы стоят лишь нормализации SQL. slow_ms=None - без поиска медленных.
+    """
+    def __init__(self, repeat_threshold=REPEAT_THRESHOLD, slow_ms=SLOW_MS):
+        self.repeat_threshold = repeat_threshold
+        self.slow_seconds = None if slow_ms is None else slow_ms / 1000
+        self.shapes = {}
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - started
+            key = fingerprint(sql)
+            shape = self.shapes.get(key)
+            if shape is None:
+                frames = project_frames(traceback.extract_stack())
+                shape = self.shapes[key] = QueryShape(
+                    key, _location(frames), frozenset(_relative(frame.filename) for frame in frames),
+                )
+            shape.count += 1
+            shape.duration += duration
+            if self.slow_seconds is not None and duration >= self.slow_seconds:
+                stack = traceback.format_list(project_frames(traceback.extract_stack()))
+                self.slow.append(SlowQuery(sql, duration, stack))
+
+    @property
+    def repeated(self):
+        return sorted(
+            (shape for shape in self.shapes.values() if shape.count >= self.repeat_threshold),
+            key=lambda shape: -shape.count,
+        )
+
+    def report(self):
+        lines = [
+            f'{shape.count}x ({shape.duration * 1000:.1f} ms) from {shape.location}: {shape.sql}'
+            for shape in self.repeated
+        ]
+        lines.extend(
+            f'slow query {query.duration * 1000:.1f} ms: {query.sql}\n' + ''.join(query.stack)
+            for query in self.slow
+        )
+        return '\n'.join(lines)
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def _watch_current(execute, sql, params, many, context):
+    """Постоянная обертка курсора: запрос уходит наблюдателю текущего HTTP-запроса, если он есть"""
+    watcher = _current_watcher.get()
+    if watcher is None:
+        return execute(sql, params, many, context)
+    return watcher(execute, sql, params, many, context)
+
+
+def _install(connection, **kwargs):
+    if _watch_current not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_watch_current)
+
+
+def _view_file(request):
+    """Файл проекта с view запроса: ему приписываются запросы, в стеке которых нет кода проекта"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    # У DRF as_view() класс ViewSet лежит в .cls
+    view = getattr(match.func, 'cls', match.func)
+    filename = getattr(sys.modules.get(view.__module__), '__file__', None)
+    if filename is None or not str(Path(filename).resolve()).startswith(_PROJECT_ROOT):
+        return None
+    return _relative(Path(filename).resolve())
+
+
+class QueryWatchMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERYWATCH', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.repeat_threshold = getattr(settings, 'QUERYWATCH_REPEAT_THRESHOLD', REPEAT_THRESHOLD)
+        self.slow_ms = getattr(settings, 'QUERYWATCH_SLOW_MS', SLOW_MS)
+        # Находки в этих файлах - ошибка запроса, остальные только в лог
+        self.raise_for = tuple(getattr(settings, 'QUERYWATCH_RAISE_FOR', ()))
+        # Новые соединения (в том числе в потоках sync_to_async) получают обертку при открытии
+        connection_created.connect(_install, dispatch_uid='querywatch')
+        for connection in connections.all(initialized_only=True):
+            _install(connection)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        for connection in connections.all(initialized_only=True):
+            _install(connection)
+        watcher = QueryWatcher(self.repeat_threshold, self.slow_ms)
+        token = _current_watcher.set(watcher)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_watcher.reset(token)
+        return self._check(request, watcher, response)
+
+    async def __acall__(self, request):
+        watcher = QueryWatcher(self.repeat_threshold, self.slow_ms)
+        token = _current_watcher.set(watcher)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_watcher.reset(token)
+        return self._check(request, watcher, response)
+
+    def _check(self, request, watcher, response):
+        if watcher.repeated or watcher.slow:
+            logger.warning('%s %s\n%s', request.method, request.path, watcher.report())
+        # Все запросы идут и на счет view: queryset, который DRF перебирает при
+        # пагинации или рендеринге, не оставляет в стеке кода проекта
+        view_files = frozenset(filter(None, [_view_file(request)]))
+        failing = [
+            shape for shape in watcher.repeated
+            if any(name.startswith(self.raise_for) for name in shape.files | view_files)
+        ]
+        if self.raise_for and failing:
+            raise NPlusOneError(
+                f'N+1 queries in {request.method} {request.path}:\n'
+                + '\n'.join(f'{shape.count}x from {shape.location}: {shape.sql}' for shape in failing)
+            )
+        return response
@@ -0,0 +1,67 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from .conditional import bump_table_versions
+from .models import Review, ServiceRating
+
+STARS = range(1, 6)
+
+
+def rating_aggregates():
+    """Аргументы aggregate/annotate для сводки оценок по queryset отзывов"""
+    return {
+        'count': Count('id'),
+        'total': Sum('rating', default=0),
+        **{f'stars_{stars}': Count('id', filter=Q(rating=stars)) for stars in STARS},
+    }
+
+
+def rebuild_ratings():
+    """Пересчитать все сводки с нуля одним агрегирующим запросом"""
+    rows = Review.objects.values('service_id').annotate(**rating_aggregates())
+    with transaction.atomic():
+        ServiceRating.objects.all().delete()
+        ServiceRating.objects.bulk_create([ServiceRating(**row) for row in rows], batch_size=500)
+        # bulk_create не шлет сигналов, а рейтинг есть в списке услуг
+        transaction.on_commit(lambda: bump_table_versions('service'))
+    return len(rows)
+
+
+def rating_key(review):
+    """(service_id, rating) отзыва или None, если эти поля не загружены"""
+    values = review.__dict__
+    if values.get('service_id') is None or values.get('rating') is None:
+        return None
+    return values['service_id'], int(values['rating'])
+
+
+def apply_rating_changes(removed=(), added=()):
+    """
+    removed и added - пары (service_id, rating), None пропускаются. Изменения по каждой услуге
+    сводятся в один UPDATE с F-выражениями, поэтому параллельные записи
+    отзывов не теряют друг друга.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for sign, keys in ((-1, removed), (1, added)):
+        for key in keys:
+            if key is not None:
+                service_id, rating = key
+                deltas[service_id][rating] += sign
+
+    for service_id, by_stars in deltas.items():
+        changes = {
+            f'stars_{stars}': F(f'stars_{stars}') + delta
+            for stars, delta in by_stars.items() if delta
+        }
+        if not changes:
+            continue
+        changes['count'] = F('count') + sum(by_stars.values())
+        changes['total'] = F('total') + sum(stars * delta for stars, delta in by_stars.items())
+        updated = ServiceRating.objects.filter(service_id=service_id).update(**changes)
+        # Строка сводки появляется с первым отзывом. При удалении ее не создаем:
+        # услугу могли удалить каскадом вместе с отзывами
+        if not updated and any(delta > 0 for delta in by_stars.values()):
+            ServiceRating.objects.get_or_create(service_id=service_id)
+            ServiceRating.objects.filter(service_id=service_id).update(**changes)
@@ -0,0 +1,213 @@
+"""
+Сводки записей по дням и часам: число записей, занятые минуты и выручка
+по услуге и мастеру. Выручка записи - цена ее услуги, минуты - длительность.
+
+Сигналы (signals.py) переносят каждую запись Appointment в сводки
+прибавлением к счетчикам; смена цены или длительности услуги
+пересчитывает сводки этой услуги. После записи мимо ORM -
+rebuild_rollups() (manage.py rebuild_rollups).
+"""
+import math
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncHour, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import Appointment, DailyBookingRollup, HourlyBookingRollup, Service
+
+# Модель сводки и ее поле интервала
+ROLLUPS = ((DailyBookingRollup, 'day'), (HourlyBookingRollup, 'hour'))
+METRICS = ('bookings', 'booked_minutes', 'revenue')
+# Гранулярность -> (модель, поле интервала, укрупнение дневной сводки)
+GRANULARITIES = {
+    'hour': (HourlyBookingRollup, 'hour', None),
+    'day': (DailyBookingRollup, 'day', None),
+    'week': (DailyBookingRollup, 'day', TruncWeek),
+    'month': (DailyBookingRollup, 'day', TruncMonth),
+}
+MAX_POINTS = 2000
+REBUILD_BATCH_SIZE = 1000
+
+
+def booking_key(appointment):
+    """(service_id, master_id, date) записи или None, если эти поля не загружены"""
+    values = appointment.__dict__
+    key = (values.get('service_id'), values.get('master_id'), values.get('date'))
+    return None if None in key else key
+
+
+def bucket_of(value, field):
+    """Начало дня или часа в зоне по умолчанию - так же группирует rebuild_rollups"""
+    local = timezone.localtime(value, timezone.get_default_timezone())
+    if field == 'day':
+        return local.date()
+    return local.replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert_sql(model, field, sign):
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = (field, 'service_id', 'master_id')
+    if sign > 0:
+        # Строка интервала появляется с первой записью в нем
+        return (
+            f'INSERT INTO {table} ({", ".join(columns)}, bookings, booked_minutes, revenue) '
+            'VALUES (%s, %s, %s, %s, %s, %s) '
+            f'ON CONFLICT ({", ".join(columns)}) DO UPDATE SET '
+            f'bookings = {table}.bookings + excluded.bookings, '
+            f'booked_minutes = {table}.booked_minutes + excluded.booked_minutes, '
+            f'revenue = {table}.revenue + excluded.revenue'
+        )
+    return (
+        f'UPDATE {table} SET bookings = bookings - %s, booked_minutes = booked_minutes - %s, '
+        f'revenue = revenue - %s WHERE {field} = %s AND service_id = %s AND master_id = %s'
+    )
+
+
+def apply_booking_changes(removed=(), added=()):
+    """
+    removed и added - ключи booking_key, None пропускаются. Все изменения
+    пакета - по одному executemany на сводку и знак, счетчики меняются
+    выражением над текущим значением, поэтому параллельные записи не
+    теряют друг друга. Опустевшие интервалы удаляются.
+    """
+    keys = [(sign, key) for sign, batch in ((-1, removed), (1, added)) for key in batch if key is not None]
+    if not keys:
+        return
+    pricing = {
+        pk: (price, duration) for pk, price, duration in Service.objects.filter(
+            pk__in={key[0] for _, key in keys}
+        ).values_list('pk', 'price', 'duration')
+    }
+
+    with connection.cursor() as cursor:
+        for model, field in ROLLUPS:
+            deltas = defaultdict(int)
+            for sign, (service_id, master_id, value) in keys:
+                # Услугу удаляют каскадом вместе с записями и ее сводками
+                if service_id in pricing:
+                    deltas[bucket_of(value, field), service_id, master_id] += sign
+            prep = model._meta.get_field(field).get_db_prep_value
+            revenue = model._meta.get_field('revenue').get_db_prep_save
+            added_rows, removed_rows = [], []
+            for (bucket, service_id, master_id), count in deltas.items():
+                price, duration = pricing[service_id]
+                bucket = prep(bucket, connection)
+                totals = (abs(count), abs(count) * duration, revenue(abs(count) * price, connection))
+                if count > 0:
+                    added_rows.append((bucket, service_id, master_id) + totals)
+                elif count < 0:
+                    removed_rows.append(totals + (bucket, service_id, master_id))
+            if added_rows:
+                cursor.executemany(_upsert_sql(model, field, 1), added_rows)
+            if removed_rows:
+                cursor.executemany(_upsert_sql(model, field, -1), removed_rows)
+                cursor.executemany(
+                    f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)} '
+                    f'WHERE {field} = %s AND service_id = %s AND master_id = %s AND bookings = 0',
+                    [row[3:] for row in removed_rows],
+                )
+
+
+def rebuild_rollups(service_ids=None):
+    """
+    Пересчитать сводки с нуля группировкой по записям - все или только
+    услуг service_ids. Возвращает число строк дневной сводки.
+    """
+    tz = timezone.get_default_timezone()
+    appointments = Appointment.objects.order_by()
+    if service_ids is not None:
+        appointments = appointments.filter(service_id__in=service_ids)
+    truncs = {'day': TruncDate('date', tzinfo=tz), 'hour': TruncHour('date', tzinfo=tz)}
+    created = {}
+    with transaction.atomic():
+        for model, field in ROLLUPS:
+            stale = model.objects.all()
+            if service_ids is not None:
+                stale = stale.filter(service_id__in=service_ids)
+            stale.delete()
+            rows = appointments.annotate(**{field: truncs[field]}).values(
+                field, 'service_id', 'master_id'
+            ).annotate(
+                bookings=Count('id'),
+                booked_minutes=Sum('service__duration'),
+                revenue=Sum('service__price'),
+            )
+            objs = model.objects.bulk_create(
+                [model(**row) for row in rows.iterator(chunk_size=REBUILD_BATCH_SIZE)],
+                batch_size=REBUILD_BATCH_SIZE,
+            )
+            created[field] = len(objs)
+    return created['day']
+
+
+def bucket_starts(granularity, start, end):
+    """Начала интервалов гранулярности, пересекающих дни start..end включительно"""
+    if granularity == 'hour':
+        tz = timezone.get_default_timezone()
+        # Шаг в UTC: в дни перевода часов в сутках 23 или 25 часов
+        first = timezone.make_aware(datetime.combine(start, time.min), tz).astimezone(dt_timezone.utc)
+        last = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz)
+        hours = int((last - first).total_seconds() // 3600)
+        return [first + timedelta(hours=i) for i in range(hours)]
+    if granularity == 'day':
+        return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    if granularity == 'week':
+        first = start - timedelta(days=start.weekday())
+        return [first + timedelta(weeks=i) for i in range((end - first).days // 7 + 1)]
+    months = (end.year - start.year) * 12 + end.month - start.month + 1
+    return [date(start.year + (start.month - 1 + i) // 12, (start.month - 1 + i) % 12 + 1, 1) for i in range(months)]
+
+
+def bucket_count(granularity, start, end):
+    """
+    len(bucket_starts(...)) без построения списка: проверка диапазона
+    запроса не должна стоить столько же, сколько сам ответ.
+    """
+    if granularity == 'hour':
+        tz = timezone.get_default_timezone()
+        first = timezone.make_aware(datetime.combine(start, time.min), tz)
+        # Полночь после end не представима для date.max - берем конец дня
+        last = datetime.combine(end, time.max) if end == date.max else datetime.combine(end + timedelta(days=1), time.min)
+        # Разница настенного времени минус сдвиг зоны: переход на летнее время дает сутки в 23 или 25 часов.
+        # Без перевода в UTC - у date.min он вышел бы за пределы datetime
+        elapsed = last - first.replace(tzinfo=None) - (timezone.make_aware(last, tz).utcoffset() - first.utcoffset())
+        return math.ceil(elapsed.total_seconds() / 3600)
+    if granularity == 'day':
+        return (end - start).days + 1
+    if granularity == 'week':
+        return (end - start + timedelta(days=start.weekday())).days // 7 + 1
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+
+def timeseries(metric, granularity, start, end, service_id=None, master_id=None):
+    """
+    Ряд [(начало интервала, значение)] за дни start..end включительно из
+    сводок. Интервалы без записей - нули, чтобы график не терял точки.
+    """
+    model, field, trunc = GRANULARITIES[granularity]
+    rows = model.objects.all()
+    if field == 'hour':
+        buckets = bucket_starts('hour', start, end)
+        rows = rows.filter(hour__gte=buckets[0], hour__lt=buckets[-1] + timedelta(hours=1))
+    else:
+        rows = rows.filter(day__gte=start, day__lte=end)
+    if service_id is not None:
+        rows = rows.filter(service_id=service_id)
+    if master_id is not None:
+        rows = rows.filter(master_id=master_id)
+    bucket = trunc(field) if trunc else F(field)
+    values = dict(
+        rows.annotate(bucket=bucket).values('bucket').annotate(value=Sum(metric)).values_list('bucket', 'value')
+    )
+    points = [(point, values.get(point) or 0) for point in bucket_starts(granularity, start, end)]
+    if granularity == 'hour':
+        tz = timezone.get_default_timezone()
+        points = [(timezone.localtime(point, tz), value) for point, value in points]
+    return points
+
+
+def total_revenue():
+    return DailyBookingRollup.objects.aggregate(total=Sum('revenue', default=0))['total']
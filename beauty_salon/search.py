@@ -0,0 +1,231 @@
+"""
+Полнотекстовый поиск по услугам, мастерам и отзывам. Имена клиентов тоже
+в индексе, но только для поиска в админке - /api/search/ их не отдает.
+
+Индекс - отдельная таблица beauty_salon_search:
+- SQLite: виртуальная таблица FTS5, слова хранятся уже прошедшими через
+  русский стеммер (stemmer.py), ранжирование - bm25;
+- PostgreSQL: обычная таблица с колонкой tsvector (конфигурация
+  'russian') и GIN-индексом, ранжирование - ts_rank.
+
+Строка индекса = объект; rowid кодирует вид и id объекта, поэтому
+обновление и удаление - поиск по первичному ключу. Индекс обновляется
+сигналами (signals.py), после записи мимо ORM - rebuild_search_index().
+"""
+from django.apps import apps as global_apps
+from django.db import connection as default_connection
+
+from .stemmer import stems, words
+
+SEARCH_TABLE = 'beauty_salon_search'
+# Вид объекта -> (модель, код в rowid, поля, из которых строится документ)
+KINDS = {
+    'service': ('Service', 1, ('name',)),
+    'master': ('Master', 2, ('name', 'specialization')),
+    'review': ('Review', 3, ('comment',)),
+    'client': ('Client', 0, ('name',)),
+}
+# Виды, которые ищет /api/search/
+PUBLIC_KINDS = ('service', 'master', 'review')
+KIND_CODES = 4
+TITLE_LENGTH = 120
+# Совпадение в названии важнее совпадения в описании или тексте отзыва
+NAME_WEIGHT = 10.0
+TEXT_WEIGHT = 1.0
+REBUILD_BATCH_SIZE = 2000
+
+
+def search_rowid(kind, object_id):
+    return object_id * KIND_CODES + KINDS[kind][1]
+
+
+def document(kind, obj):
+    """(заголовок, текст названия, прочий текст) объекта"""
+    if kind == 'review':
+        return obj.comment[:TITLE_LENGTH], '', obj.comment
+    if kind == 'master':
+        return obj.name, obj.name, obj.specialization
+    # Услуга и клиент - только имя
+    return obj.name, obj.name, ''
+
+
+class SQLiteSearchBackend:
+    key = 'rowid'
+    create_sql = (
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+        "kind UNINDEXED, object_id UNINDEXED, title UNINDEXED, name_terms, text_terms, "
+        "tokenize = 'unicode61 remove_diacritics 2')",
+    )
+    drop_sql = (f'DROP TABLE IF EXISTS {SEARCH_TABLE}',)
+
+    @staticmethod
+    def row(kind, obj):
+        title, name, text = document(kind, obj)
+        return (search_rowid(kind, obj.pk), kind, obj.pk, title, ' '.join(stems(name)), ' '.join(stems(text)))
+
+    def upsert(self, cursor, rows):
+        # У FTS5 нет ON CONFLICT - старую версию строки удаляем по rowid
+        cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, kind, object_id, title, name_terms, text_terms) '
+            'VALUES (%s, %s, %s, %s, %s, %s)', rows
+        )
+
+    @staticmethod
+    def match(query):
+        """Выражение MATCH: все слова запроса, последнее - как префикс (поиск по мере набора)"""
+        terms = stems(query)
+        if not terms:
+            return None
+        return ' '.join(f'"{term}"' for term in terms) + '*'
+
+    def matches(self, query):
+        """(from, where, params, score) для поиска; score - чем больше, тем лучше"""
+        return (
+            SEARCH_TABLE, f'{SEARCH_TABLE} MATCH %s', [self.match(query)],
+            f'-bm25({SEARCH_TABLE}, 0, 0, 0, {NAME_WEIGHT}, {TEXT_WEIGHT})',
+        )
+
+
+class PostgresSearchBackend:
+    key = 'id'
+    create_sql = (
+        f'CREATE TABLE {SEARCH_TABLE} ('
+        'id bigint PRIMARY KEY, kind varchar(16) NOT NULL, object_id bigint NOT NULL, '
+        'title text NOT NULL, document tsvector NOT NULL)',
+        f'CREATE INDEX {SEARCH_TABLE}_document_idx ON {SEARCH_TABLE} USING GIN (document)',
+    )
+    drop_sql = (f'DROP TABLE IF EXISTS {SEARCH_TABLE}',)
+
+    @staticmethod
+    def row(kind, obj):
+        title, name, text = document(kind, obj)
+        return (search_rowid(kind, obj.pk), kind, obj.pk, title, name, text)
+
+    def upsert(self, cursor, rows):
+        # Стемминг делает сам PostgreSQL; название весит больше текста (A против B)
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_TABLE} (id, kind, object_id, title, document) VALUES '
+            "(%s, %s, %s, %s, setweight(to_tsvector('russian', %s), 'A') || "
+            "setweight(to_tsvector('russian', %s), 'B')) "
+            'ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title, document = EXCLUDED.document',
+            rows,
+        )
+
+    @staticmethod
+    def match(query):
+        # Слова запроса пропускаем через тот же разбор, что и в SQLite: в to_tsquery
+        # не попадут операторы, а последнее слово ищется как префикс
+        terms = words(query)
+        if not terms:
+            return None
+        return ' & '.join(terms) + ':*'
+
+    def matches(self, query):
+        return (
+            f"{SEARCH_TABLE}, to_tsquery('russian', %s) query", 'document @@ query', [self.match(query)],
+            # Веса в порядке {D, C, B, A}: текст (B) относительно названия (A)
+            "ts_rank('{0.1, 0.1, %.2f, 1.0}'::float4[], document, query)" % (TEXT_WEIGHT / NAME_WEIGHT),
+        )
+
+
+def backend_for(connection=default_connection):
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return SQLiteSearchBackend()
+
+
+def create_search_index(connection=default_connection):
+    with connection.cursor() as cursor:
+        for sql in backend_for(connection).create_sql:
+            cursor.execute(sql)
+
+
+def drop_search_index(connection=default_connection):
+    with connection.cursor() as cursor:
+        for sql in backend_for(connection).drop_sql:
+            cursor.execute(sql)
+
+
+def index_objects(kind, objects, connection=default_connection):
+    backend = backend_for(connection)
+    rows = [backend.row(kind, obj) for obj in objects]
+    if rows:
+        with connection.cursor() as cursor:
+            backend.upsert(cursor, rows)
+
+
+def unindex_objects(kind, object_ids, connection=default_connection):
+    key = backend_for(connection).key
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {SEARCH_TABLE} WHERE {key} = %s',
+            [(search_rowid(kind, object_id),) for object_id in object_ids],
+        )
+
+
+def rebuild_search_index(apps=global_apps, connection=default_connection):
+    """
+    Переиндексировать все объекты. apps - реестр моделей: в миграции
+    передается исторический.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+    total = 0
+    for kind, (model_name, _, fields) in KINDS.items():
+        model = apps.get_model('beauty_salon', model_name)
+        batch = []
+        for obj in model.objects.only('pk', *fields).order_by().iterator(chunk_size=REBUILD_BATCH_SIZE):
+            batch.append(obj)
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                index_objects(kind, batch, connection)
+                total += len(batch)
+                batch = []
+        index_objects(kind, batch, connection)
+        total += len(batch)
+    return total
+
+
+def search(query, kinds=None, user=None, limit=20, offset=0, connection=default_connection):
+    """
+    Найденные объекты по убыванию релевантности: словари kind, id, title, score.
+    Отзывы обычному пользователю видны только свои (как в /api/reviews/).
+    kinds - виды из PUBLIC_KINDS, по умолчанию все они.
+    """
+    backend = backend_for(connection)
+    if backend.match(query) is None:
+        return []
+    tables, where, params, score = backend.matches(query)
+    kinds = kinds or PUBLIC_KINDS
+    conditions = [where, f'kind IN ({", ".join(["%s"] * len(kinds))})']
+    params += list(kinds)
+    if user is not None and not user.is_superuser:
+        Review = global_apps.get_model('beauty_salon', 'Review')
+        Client = global_apps.get_model('beauty_salon', 'Client')
+        conditions.append(
+            f"(kind <> 'review' OR object_id IN (SELECT r.id FROM {Review._meta.db_table} r "
+            f'INNER JOIN {Client._meta.db_table} c ON r.client_id = c.id WHERE c.user_id = %s))'
+        )
+        params.append(user.pk)
+    sql = (
+        f'SELECT kind, object_id, title, {score} AS score FROM {tables} '
+        f'WHERE {" AND ".join(conditions)} ORDER BY score DESC, object_id LIMIT %s OFFSET %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit, offset])
+        return [
+            {'kind': kind, 'id': object_id, 'title': title, 'score': score}
+            for kind, object_id, title, score in cursor.fetchall()
+        ]
+
+
+def search_ids_sql(kind, query, connection=default_connection):
+    """
+    (sql, params) подзапроса с id объектов вида kind, подходящих под запрос,
+    для Model.objects.filter(pk__in=RawSQL(sql, params)) - например, в админке.
+    """
+    backend = backend_for(connection)
+    if backend.match(query) is None:
+        return 'SELECT NULL WHERE 1 = 0', []
+    tables, where, params, _ = backend.matches(query)
+    return f'SELECT object_id FROM {tables} WHERE {where} AND kind = %s', params + [kind]
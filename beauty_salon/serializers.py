@@ -1,24 +1,168 @@
 from rest_framework import serializers
-from .models import Client, Service, Master, Appointment, Review
+from rest_framework.reverse import reverse
+from .models import Client, Service, Master, Appointment, Review, ServiceRating, ExportJob
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.utils import timezone
+from .authentication import client_for
+from .availability import MAX_SLOT_SEARCH_RANGE
+from .images import srcset, thumb_url
+from .search import PUBLIC_KINDS
+from .utilization import MAX_UTILIZATION_DAYS
+from .metrics import SerializerTimingMixin, TimedListSerializer
+from .rollups import GRANULARITIES, MAX_POINTS, METRICS, bucket_count
+from .signals import bulk_saved
+
+class SparseFieldsMixin:
+    """
+    ?fields=id,name - отдать только перечисленные поля.
+    Работает только на чтение, запись всегда видит полный набор полей.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        requested = request.query_params.get('fields')
+        if not requested:
+            return
+        allowed = {name.strip() for name in requested.split(',') if name.strip()}
+        for name in set(self.fields) - allowed:
+            self.fields.pop(name)
+
+class BulkListSerializer(TimedListSerializer):
+    """
+    Пакет объектов пишется одним bulk_create/bulk_update.
+    Для обновления instance - список объектов в том же порядке, что и данные.
+    """
+    batch_size = 500
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self._preload_related(data)
+        return super().to_internal_value(data)
+
+    def _preload_related(self, data):
+        """
+        PrimaryKeyRelatedField делает запрос на каждый элемент. Загружаем
+        связанные объекты пакета одним in_bulk на поле и проверяем id по нему.
+        """
+        for name, field in self.child.fields.items():
+            if not isinstance(field, serializers.PrimaryKeyRelatedField) or field.read_only:
+                continue
+            pk_field = field.get_queryset().model._meta.pk
+            pks = set()
+            for item in data:
+                if isinstance(item, dict) and item.get(name) is not None:
+                    try:
+                        pks.add(pk_field.to_python(item[name]))
+                    except (TypeError, ValueError, DjangoValidationError):
+                        # Ошибку типа покажет lookup для этого элемента
+                        pass
+            objects = field.get_queryset().in_bulk(pks)
+
+            def lookup(value, field=field, pk_field=pk_field, objects=objects):
+                if isinstance(value, bool):
+                    field.fail('incorrect_type', data_type=type(value).__name__)
+                try:
+                    pk = pk_field.to_python(value)
+                except (TypeError, ValueError, DjangoValidationError):
+                    field.fail('incorrect_type', data_type=type(value).__name__)
+                if pk not in objects:
+                    field.fail('does_not_exist', pk_value=value)
+                return objects[pk]
+            field.to_internal_value = lookup
+
+    def run_child_validation(self, data):
+        if self.instance is not None:
+            self.child.instance = self._instances_by_id.get(data.get('id'))
+            self.child.initial_data = data
+        return super().run_child_validation(data)
+
+    @property
+    def _instances_by_id(self):
+        if not hasattr(self, '_instances_cache'):
+            self._instances_cache = {obj.pk: obj for obj in self.instance}
+        return self._instances_cache
 
-class BaseModelSerializer(serializers.ModelSerializer):
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        objs = model.objects.bulk_create(
+            [model(**attrs) for attrs in validated_data], batch_size=self.batch_size
+        )
+        bulk_saved.send(sender=model, instances=objs, created=True)
+        return objs
+
+    def update(self, instances, validated_data):
+        model = self.child.Meta.model
+        fields = set()
+        for instance, attrs in zip(instances, validated_data):
+            for name, value in attrs.items():
+                setattr(instance, name, value)
+                fields.add(name)
+        if fields:
+            model.objects.bulk_update(instances, sorted(fields), batch_size=self.batch_size)
+        bulk_saved.send(sender=model, instances=instances, created=False)
+        return instances
+
+class BaseModelSerializer(SerializerTimingMixin, SparseFieldsMixin, serializers.ModelSerializer):
     def create(self, validated_data):
         if 'user' in validated_data:
             validated_data.pop('user')
         return super().create(validated_data)
 
-class ServiceSerializer(BaseModelSerializer):
+class PictureDerivativesMixin(serializers.Serializer):
+    """
+    picture_thumb - JPEG-миниатюра, picture_srcset - WebP-копии разной ширины
+    для <img srcset>. URL строятся по picture_hash, без обращения к хранилищу.
+    """
+    picture_thumb = serializers.SerializerMethodField()
+    picture_srcset = serializers.SerializerMethodField()
+
+    def get_picture_thumb(self, obj):
+        return thumb_url(obj.picture_hash, self.context.get('request'))
+
+    def get_picture_srcset(self, obj):
+        return srcset(obj.picture_hash, self.context.get('request'))
+
+class ServiceSerializer(PictureDerivativesMixin, BaseModelSerializer):
+    # Рейтинг берется из сводки ServiceRating: queryset должен делать
+    # select_related('rating_summary'), иначе будет запрос на каждую услугу
+    rating_avg = serializers.SerializerMethodField()
+    rating_count = serializers.SerializerMethodField()
+    rating_histogram = serializers.SerializerMethodField()
+
     class Meta:
         model = Service
-        fields = ['id', 'name', 'price', 'duration', 'picture']
+        fields = ['id', 'name', 'price', 'duration', 'picture', 'picture_thumb', 'picture_srcset',
+                  'rating_avg', 'rating_count', 'rating_histogram']
         read_only_fields = ['id']
+        list_serializer_class = TimedListSerializer
+
+    @staticmethod
+    def _rating(obj):
+        try:
+            return obj.rating_summary
+        except ServiceRating.DoesNotExist:
+            return None
+
+    def get_rating_avg(self, obj):
+        rating = self._rating(obj)
+        return rating.average if rating else None
+
+    def get_rating_count(self, obj):
+        rating = self._rating(obj)
+        return rating.count if rating else 0
+
+    def get_rating_histogram(self, obj):
+        rating = self._rating(obj)
+        return rating.histogram if rating else {stars: 0 for stars in range(1, 6)}
 
-class ClientSerializer(serializers.ModelSerializer):
+class ClientSerializer(PictureDerivativesMixin, SerializerTimingMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Client
-        fields = ['id', 'name', 'phone', 'email', 'service', 'picture', 'user']
+        fields = ['id', 'name', 'phone', 'email', 'service', 'picture', 'picture_thumb', 'picture_srcset', 'user']
         read_only_fields = ['id', 'user']
+        list_serializer_class = TimedListSerializer
 
     def create(self, validated_data):
         request = self.context.get('request')
@@ -26,11 +170,12 @@ class ClientSerializer(serializers.ModelSerializer):
             validated_data['user'] = request.user
             return super().create(validated_data)
 
-class MasterSerializer(serializers.ModelSerializer):
+class MasterSerializer(SerializerTimingMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Master
         fields = ['id', 'name', 'specialization', 'services']
         read_only_fields = ['id']
+        list_serializer_class = TimedListSerializer
 
     def create(self, validated_data):
         services = validated_data.pop('services', [])
@@ -38,17 +183,19 @@ class MasterSerializer(serializers.ModelSerializer):
         master.services.set(services)
         return master
 
-class AppointmentSerializer(serializers.ModelSerializer):
+class AppointmentSerializer(SerializerTimingMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Appointment
         fields = ['id', 'client', 'service', 'master', 'date']
         read_only_fields = ['id', 'client']
+        list_serializer_class = BulkListSerializer
 
     def create(self, validated_data):
         request = self.context.get('request')
         if request and request.user:
             try:
-                client = Client.objects.filter(user=request.user).first()
+                # Клиента обычно уже передал ViewSet через save(client=...)
+                client = validated_data.get('client') or client_for(request.user)
                 if not client:
                     raise serializers.ValidationError("Client profile not found for current user")
                 validated_data['client'] = client
@@ -56,17 +203,19 @@ class AppointmentSerializer(serializers.ModelSerializer):
             except Exception as e:
                 raise serializers.ValidationError(str(e))
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(SerializerTimingMixin, SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ['id', 'client', 'service', 'rating', 'comment', 'date']
         read_only_fields = ['id', 'client', 'date']
+        list_serializer_class = BulkListSerializer
 
     def create(self, validated_data):
         request = self.context.get('request')
         if request and request.user:
             try:
-                client = Client.objects.filter(user=request.user).first()
+                # Клиента обычно уже передал ViewSet через save(client=...)
+                client = validated_data.get('client') or client_for(request.user)
                 if not client:
                     raise serializers.ValidationError("Client profile not found for current user")
                 validated_data['client'] = client
@@ -74,3 +223,94 @@ class ReviewSerializer(serializers.ModelSerializer):
                 return super().create(validated_data)
             except Exception as e:
                 raise serializers.ValidationError(str(e))
+
+
+class SlotRangeSerializer(serializers.Serializer):
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+
+    def validate(self, data):
+        if data['date_to'] < data['date_from']:
+            raise serializers.ValidationError("date_to must not be earlier than date_from")
+        if data['date_to'] - data['date_from'] > MAX_SLOT_SEARCH_RANGE:
+            raise serializers.ValidationError(
+                f"Search range is limited to {MAX_SLOT_SEARCH_RANGE.days} days"
+            )
+        return data
+
+class FreeSlotsQuerySerializer(SlotRangeSerializer):
+    service = serializers.PrimaryKeyRelatedField(queryset=Service.objects.all())
+    master = serializers.PrimaryKeyRelatedField(queryset=Master.objects.all(), required=False)
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    # ?kind=service&kind=review - ограничить виды объектов
+    kind = serializers.ListField(child=serializers.ChoiceField(choices=PUBLIC_KINDS), required=False)
+    page = serializers.IntegerField(min_value=1, default=1)
+    page_size = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+    def to_internal_value(self, data):
+        if hasattr(data, 'getlist'):
+            data = {**data.dict(), 'kind': data.getlist('kind')}
+        return super().to_internal_value(data)
+
+class SearchResultSerializer(serializers.Serializer):
+    kind = serializers.CharField()
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+    score = serializers.FloatField()
+
+class PeriodQuerySerializer(serializers.Serializer):
+    """?from=&to= - дни включительно"""
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+
+    def get_fields(self):
+        # В запросе ?from=&to=, а from - ключевое слово Python
+        fields = super().get_fields()
+        fields['from'] = fields.pop('date_from')
+        fields['to'] = fields.pop('date_to')
+        return fields
+
+    def validate(self, data):
+        if data['to'] < data['from']:
+            raise serializers.ValidationError("to must not be earlier than from")
+        return data
+
+class TimeseriesQuerySerializer(PeriodQuerySerializer):
+    metric = serializers.ChoiceField(choices=METRICS)
+    granularity = serializers.ChoiceField(choices=list(GRANULARITIES), default='day')
+    service = serializers.IntegerField(required=False)
+    master = serializers.IntegerField(required=False)
+
+    def validate(self, data):
+        data = super().validate(data)
+        points = bucket_count(data['granularity'], data['from'], data['to'])
+        if points > MAX_POINTS:
+            raise serializers.ValidationError(
+                f"Range is limited to {MAX_POINTS} points, got {points}: use a coarser granularity"
+            )
+        return data
+
+class UtilizationQuerySerializer(PeriodQuerySerializer):
+    master = serializers.PrimaryKeyRelatedField(queryset=Master.objects.all(), required=False)
+
+    def validate(self, data):
+        data = super().validate(data)
+        if (data['to'] - data['from']).days >= MAX_UTILIZATION_DAYS:
+            raise serializers.ValidationError(f"Range is limited to {MAX_UTILIZATION_DAYS} days")
+        return data
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    """Задание выгрузки; download - ссылка на файл, когда он готов"""
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportJob
+        fields = ['id', 'kind', 'status', 'rows', 'error', 'created_at', 'started_at', 'finished_at', 'download']
+        read_only_fields = ['status', 'rows', 'error', 'created_at', 'started_at', 'finished_at']
+
+    def get_download(self, job):
+        if job.status != ExportJob.DONE:
+            return None
+        return reverse('exports-download', args=[job.pk], request=self.context.get('request'))
@@ -0,0 +1,239 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
+from django.dispatch import Signal, receiver
+from rest_framework.authtoken.models import Token
+
+from .models import Client, Service, Master, Appointment, Review
+from .authentication import forget_token, forget_user_tokens
+from .conditional import bump_table_versions
+from .availability import booking_index
+from .images import build_derivatives
+from .ratings import apply_rating_changes, rating_key
+from .rollups import apply_booking_changes, booking_key, rebuild_rollups
+from .search import KINDS, index_objects, unindex_objects
+from .stats import invalidate_stats
+
+# bulk_create/bulk_update не отправляют post_save. Пакетная запись шлет
+# этот сигнал один раз на весь пакет: sender - модель, instances - объекты
+bulk_saved = Signal()
+
+
+# Версии справочников для ETag и снимков статистики меняем после коммита: иначе
+# параллельный запрос успел бы прочитать старые данные и выдать их под новой версией
+def bump_after_commit(*tables):
+    transaction.on_commit(lambda: bump_table_versions(*tables))
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=Master)
+@receiver(post_delete, sender=Master)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+@receiver(m2m_changed, sender=Master.services.through)
+@receiver(bulk_saved)
+def reset_stats(sender, **kwargs):
+    model = Master if sender is Master.services.through else sender
+    model_name = model._meta.model_name
+    transaction.on_commit(lambda: invalidate_stats(model_name))
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(bulk_saved, sender=Service)
+@receiver(bulk_saved, sender=Review)
+def bump_service_version(sender, **kwargs):
+    # Отзывы меняют рейтинг в списке услуг
+    bump_after_commit('service')
+
+
+@receiver(post_delete, sender=Service)
+def bump_deleted_service_version(sender, **kwargs):
+    # Вместе с услугой каскадно удаляются ее связи с мастерами
+    bump_after_commit('service', 'master')
+
+
+@receiver(post_save, sender=Master)
+@receiver(post_delete, sender=Master)
+@receiver(m2m_changed, sender=Master.services.through)
+@receiver(bulk_saved, sender=Master)
+def bump_master_version(sender, **kwargs):
+    bump_after_commit('master')
+
+
+# Индекс слотов обновляем только после коммита, чтобы откат транзакции не оставил в нем лишнего
+@receiver(post_save, sender=Appointment)
+def index_appointment(sender, instance, **kwargs):
+    args = (instance.id, instance.master_id, instance.date, instance.service.duration)
+    transaction.on_commit(lambda: booking_index.add(*args))
+
+
+@receiver(bulk_saved, sender=Appointment)
+def index_appointments(sender, instances, **kwargs):
+    rows = [(a.id, a.master_id, a.date, a.service.duration) for a in instances]
+
+    def apply():
+        for args in rows:
+            booking_index.add(*args)
+    transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=Appointment)
+def unindex_appointment(sender, instance, **kwargs):
+    appointment_id = instance.id
+    transaction.on_commit(lambda: booking_index.remove(appointment_id))
+
+
+@receiver(post_save, sender=Service)
+def reindex_service(sender, instance, created, **kwargs):
+    # Новая услуга не занимает ничье время, а смена длительности меняет все ее интервалы
+    if not created:
+        transaction.on_commit(booking_index.invalidate)
+
+
+# Сводка оценок: запоминаем (service_id, rating) из БД, чтобы при изменении
+# отзыва вычесть старую оценку и прибавить новую
+@receiver(post_init, sender=Review)
+def remember_rating(sender, instance, **kwargs):
+    instance._saved_rating = rating_key(instance)
+
+
+@receiver(post_save, sender=Review)
+def update_rating(sender, instance, created, **kwargs):
+    removed = [] if created else [instance._saved_rating]
+    instance._saved_rating = rating_key(instance)
+    apply_rating_changes(removed=removed, added=[instance._saved_rating])
+
+
+@receiver(post_delete, sender=Review)
+def remove_rating(sender, instance, **kwargs):
+    apply_rating_changes(removed=[instance._saved_rating])
+
+
+@receiver(bulk_saved, sender=Review)
+def update_ratings(sender, instances, created, **kwargs):
+    removed = [] if created else [review._saved_rating for review in instances]
+    for review in instances:
+        review._saved_rating = rating_key(review)
+    apply_rating_changes(removed=removed, added=[review._saved_rating for review in instances])
+
+
+# Сводки записей: как и с оценками, помним (service_id, master_id, date) из БД,
+# чтобы перенос записи вычел ее из старого интервала и прибавил к новому
+@receiver(post_init, sender=Appointment)
+def remember_booking(sender, instance, **kwargs):
+    instance._saved_booking = booking_key(instance)
+
+
+@receiver(post_save, sender=Appointment)
+def update_rollups(sender, instance, created, **kwargs):
+    removed = [] if created else [instance._saved_booking]
+    instance._saved_booking = booking_key(instance)
+    apply_booking_changes(removed=removed, added=[instance._saved_booking])
+
+
+@receiver(post_delete, sender=Appointment)
+def remove_from_rollups(sender, instance, **kwargs):
+    apply_booking_changes(removed=[instance._saved_booking])
+
+
+@receiver(bulk_saved, sender=Appointment)
+def update_rollups_in_bulk(sender, instances, created, **kwargs):
+    removed = [] if created else [appointment._saved_booking for appointment in instances]
+    for appointment in instances:
+        appointment._saved_booking = booking_key(appointment)
+    apply_booking_changes(removed=removed, added=[a._saved_booking for a in instances])
+
+
+@receiver(post_init, sender=Service)
+def remember_pricing(sender, instance, **kwargs):
+    instance._saved_pricing = (instance.__dict__.get('price'), instance.__dict__.get('duration'))
+
+
+@receiver(post_save, sender=Service)
+def reprice_rollups(sender, instance, created, **kwargs):
+    # Выручка и минуты в сводках посчитаны по цене и длительности услуги
+    pricing = (instance.__dict__.get('price'), instance.__dict__.get('duration'))
+    if not created and pricing != instance._saved_pricing:
+        rebuild_rollups(service_ids=[instance.pk])
+    instance._saved_pricing = pricing
+
+
+# Закэшированные токены: пользователь и id его клиента должны быть актуальны
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    forget_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def forget_saved_user(sender, instance, **kwargs):
+    forget_user_tokens(instance.pk)
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def forget_client_user(sender, instance, **kwargs):
+    if instance.user_id:
+        forget_user_tokens(instance.user_id)
+
+
+# Уменьшенные копии картинок создаются при загрузке, когда файл уже сохранен
+@receiver(post_init, sender=Service)
+@receiver(post_init, sender=Client)
+def remember_picture(sender, instance, **kwargs):
+    value = instance.__dict__.get('picture')
+    instance._saved_picture = getattr(value, 'name', value) or ''
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_save, sender=Client)
+def build_picture_derivatives(sender, instance, **kwargs):
+    if 'picture' not in instance.__dict__:
+        return
+    name = instance.picture.name or ''
+    if name == instance._saved_picture and (instance.picture_hash or not name):
+        return
+    instance._saved_picture = name
+    picture_hash = (build_derivatives(name, instance.picture.storage) if name else None) or ''
+    if picture_hash != instance.picture_hash:
+        instance.picture_hash = picture_hash
+        sender.objects.filter(pk=instance.pk).update(picture_hash=picture_hash)
+
+
+# Полнотекстовый индекс пишется в той же транзакции, что и сам объект
+SEARCH_KINDS = {Service: 'service', Master: 'master', Review: 'review', Client: 'client'}
+
+
+def _search_fields_changed(sender, update_fields):
+    return update_fields is None or bool(set(update_fields) & set(KINDS[SEARCH_KINDS[sender]][2]))
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_save, sender=Master)
+@receiver(post_save, sender=Review)
+@receiver(post_save, sender=Client)
+def index_for_search(sender, instance, update_fields=None, **kwargs):
+    if _search_fields_changed(sender, update_fields):
+        index_objects(SEARCH_KINDS[sender], [instance])
+
+
+@receiver(bulk_saved, sender=Service)
+@receiver(bulk_saved, sender=Master)
+@receiver(bulk_saved, sender=Review)
+@receiver(bulk_saved, sender=Client)
+def index_many_for_search(sender, instances, **kwargs):
+    index_objects(SEARCH_KINDS[sender], instances)
+
+
+@receiver(post_delete, sender=Service)
+@receiver(post_delete, sender=Master)
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=Client)
+def unindex_for_search(sender, instance, **kwargs):
+    unindex_objects(SEARCH_KINDS[sender], [instance.pk])
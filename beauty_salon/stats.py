@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from .caching import CacheNamespace, aread_through, read_through
+
+# Снимок статистики живет не дольше 5 минут, даже если сигнал потерялся
+STATS_TIMEOUT = 5 * 60
+
+# Раздел статистики -> модели (model_name), запись в которые меняет его снимки.
+# У каждого раздела своя версия: запись клиента не сбрасывает, например, загрузку мастеров
+STATS_DEPENDENCIES = {
+    'clients': ('client', 'service', 'appointment'),
+    # Выручка - из сводок записей
+    'services': ('service', 'appointment'),
+    # Каскадное удаление услуги убирает связи с мастерами без m2m_changed
+    'masters': ('master', 'service', 'appointment'),
+    'appointments': ('appointment', 'service', 'client'),
+    'reviews': ('review', 'service', 'client'),
+    'utilization': ('appointment', 'service', 'master'),
+}
+
+stats_namespaces = {scope: CacheNamespace(f'stats:{scope}') for scope in STATS_DEPENDENCIES}
+
+
+def day_range(day):
+    """
+    Полуоткрытый интервал [начало дня, начало следующего) в текущей зоне.
+    В отличие от date__date/__year/__month сравнение с ним идет по самой
+    колонке, поэтому может использовать индекс по дате.
+    """
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()), tz)
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()), tz)
+    return start, end
+
+
+def month_range(day):
+    first = day.replace(day=1)
+    next_month = (first + timedelta(days=32)).replace(day=1)
+    return day_range(first)[0], day_range(next_month)[0]
+
+
+def stats_owner(user, per_user=True):
+    """Чьи данные видит пользователь: суперпользователь и общие справочники - 'all'"""
+    if not per_user or user.is_superuser:
+        return 'all'
+    return user.id
+
+
+def get_cached_stats(scope, owner, compute, *params):
+    """
+    Возвращает статистику из кэша или считает ее через compute().
+    params - параметры запроса, от которых зависит результат. Версия
+    раздела входит в ключ, поэтому invalidate_stats() сбрасывает все
+    снимки раздела разом, не перебирая ключи.
+    """
+    return read_through(stats_namespaces[scope].key(owner, *params), compute, STATS_TIMEOUT)
+
+
+async def aget_cached_stats(scope, owner, compute, *params):
+    """
+    Асинхронный вариант get_cached_stats: попадание в кэш не занимает поток,
+    а compute() (синхронный ORM) на промахе уходит в пул потоков.
+    """
+    key = await stats_namespaces[scope].akey(owner, *params)
+    return await aread_through(key, compute, STATS_TIMEOUT)
+
+
+def invalidate_stats(*models):
+    """Сбросить разделы, зависящие от моделей models (model_name); без аргументов - все"""
+    for scope, dependencies in STATS_DEPENDENCIES.items():
+        if not models or set(models) & set(dependencies):
+            stats_namespaces[scope].invalidate()
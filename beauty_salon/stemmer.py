@@ -0,0 +1,130 @@
+"""
+Стеммер русского языка (алгоритм Snowball) для полнотекстового поиска в
+SQLite: FTS5 умеет только регистр и диакритику, окончания не отбрасывает.
+Слова в индексе и в запросе проходят через stem(), поэтому «стрижка»,
+«стрижки» и «стрижкой» совпадают. PostgreSQL делает то же сам
+(конфигурация 'russian').
+"""
+import re
+from functools import lru_cache
+
+VOWELS = set('аеиоуыэюя')
+
+PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+ADJECTIVE = ((), (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+))
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+REFLEXIVE = ((), ('ся', 'сь'))
+VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен',
+     'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+)
+NOUN = ((), (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий',
+    'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю',
+    'ия', 'ья', 'я',
+))
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+WORD_RE = re.compile(r'[0-9a-zа-я]+')
+
+
+def _endings(groups):
+    # Окончания первой группы удаляются, только если перед ними «а» или «я»
+    first, second = groups
+    return sorted(
+        [(ending, True) for ending in first] + [(ending, False) for ending in second],
+        key=lambda item: -len(item[0]),
+    )
+
+
+_PERFECTIVE_GERUND = _endings(PERFECTIVE_GERUND)
+_ADJECTIVE = _endings(ADJECTIVE)
+_PARTICIPLE = _endings(PARTICIPLE)
+_REFLEXIVE = _endings(REFLEXIVE)
+_VERB = _endings(VERB)
+_NOUN = _endings(NOUN)
+
+
+def _remove(rv, endings):
+    """rv без самого длинного подходящего окончания или None"""
+    for ending, after_a_ya in endings:
+        if rv.endswith(ending):
+            rest = rv[:-len(ending)]
+            if after_a_ya and not rest.endswith(('а', 'я')):
+                return None
+            return rest
+    return None
+
+
+def _regions(word):
+    """Начала областей RV и R2 (индексы в слове)"""
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in VOWELS), len(word))
+    r1 = next(
+        (i + 1 for i in range(1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS), len(word)
+    )
+    r2 = next(
+        (i + 1 for i in range(r1 + 1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS), len(word)
+    )
+    return rv, r2
+
+
+@lru_cache(maxsize=100_000)
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1: деепричастие, иначе возвратность и затем прилагательное, глагол или существительное
+    rest = _remove(rv, _PERFECTIVE_GERUND)
+    if rest is not None:
+        rv = rest
+    else:
+        rest = _remove(rv, _REFLEXIVE)
+        if rest is not None:
+            rv = rest
+        rest = _remove(rv, _ADJECTIVE)
+        if rest is not None:
+            # Причастие перед окончанием прилагательного тоже отбрасывается
+            participle = _remove(rest, _PARTICIPLE)
+            rv = participle if participle is not None else rest
+        else:
+            for endings in (_VERB, _NOUN):
+                rest = _remove(rv, endings)
+                if rest is not None:
+                    rv = rest
+                    break
+
+    # Шаг 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательный суффикс, только целиком в R2
+    for ending in DERIVATIONAL:
+        if rv.endswith(ending) and len(prefix) + len(rv) - len(ending) >= r2_start:
+            rv = rv[:-len(ending)]
+            break
+
+    # Шаг 4
+    for ending in SUPERLATIVE:
+        if rv.endswith(ending):
+            rv = rv[:-len(ending)]
+            break
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    elif rv.endswith('ь'):
+        rv = rv[:-1]
+    return prefix + rv
+
+
+def words(text):
+    """Слова текста в нижнем регистре, «ё» приводится к «е»"""
+    return WORD_RE.findall(text.lower().replace('ё', 'е'))
+
+
+def stems(text):
+    return [stem(word) if not word.isascii() else word for word in words(text)]
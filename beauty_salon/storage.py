@@ -0,0 +1,121 @@
+"""
+Хранилище картинок с адресацией по содержимому.
+
+Файл сохраняется под именем cas/<2 символа>/<sha256><расширение>: хэш
+считается на лету, пока загрузка пишется во временный файл, и одинаковые
+загрузки ложатся в один и тот же блоб. Такой URL никогда не меняет
+содержимое, поэтому браузер и CDN могут кэшировать его бессрочно.
+
+Один блоб могут использовать несколько объектов, поэтому удалять файлы
+при удалении объекта нельзя - неиспользуемые блобы собирает gc_media.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db.models import FileField
+
+from .images import derivative_names
+
+CAS_DIR = 'cas'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def blob_name(self, digest, name):
+        ext = os.path.splitext(name)[1].lower()
+        return f'{CAS_DIR}/{digest[:2]}/{digest}{ext}'
+
+    def get_available_name(self, name, max_length=None):
+        # Окончательное имя определяет содержимое (_save) - суффиксы не нужны
+        return name
+
+    def _save(self, name, content):
+        temp_dir = self.path(f'{CAS_DIR}/tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir, suffix='.upload')
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as temp_file:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            final_name = self.blob_name(digest.hexdigest(), name)
+            final_path = self.path(final_name)
+            if os.path.exists(final_path):
+                # Такой блоб уже есть - загрузка просто ссылается на него. Время
+                # изменения обновляем, чтобы gc_media не счел его старым мусором
+                os.remove(temp_path)
+                os.utime(final_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.chmod(temp_path, self.file_permissions_mode or 0o644)
+                os.replace(temp_path, final_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return final_name
+
+
+content_addressed_storage = ContentAddressedStorage()
+
+
+def media_storage():
+    # Вызываемый объект в storage= не попадает в миграции как набор настроек
+    return content_addressed_storage
+
+
+def file_digest(path, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fields():
+    """(модель, поле) всех FileField, которые хранятся в content_addressed_storage"""
+    return [
+        (model, field)
+        for model in apps.get_models()
+        for field in model._meta.get_fields()
+        if isinstance(field, FileField) and field.storage is content_addressed_storage
+    ]
+
+
+def referenced_files():
+    """Имена файлов и уменьшенных копий, на которые ссылаются объекты в БД"""
+    names = set()
+    for model, field in file_fields():
+        names.update(
+            name for name in model.objects.exclude(**{field.name: ''})
+            .values_list(field.attname, flat=True) if name
+        )
+        if any(f.name == 'picture_hash' for f in model._meta.fields):
+            for picture_hash in model.objects.exclude(picture_hash='').values_list('picture_hash', flat=True):
+                names.update(name for _, _, name in derivative_names(picture_hash))
+    return names
+
+
+def unreferenced_files(directories, grace_seconds, storage=content_addressed_storage):
+    """
+    Файлы в directories, на которые никто не ссылается и которые старше
+    grace_seconds: более свежий блоб может принадлежать загрузке, чей
+    объект еще не сохранен.
+    """
+    referenced = referenced_files()
+    deadline = time.time() - grace_seconds
+    for directory in directories:
+        root = storage.path(directory)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                name = os.path.relpath(path, storage.location).replace(os.sep, '/')
+                if name not in referenced and os.path.getmtime(path) < deadline:
+                    yield name, os.path.getsize(path)
+
@@ -1,3 +1,1565 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+import json
+from multiprocessing import get_context
+import os
+import random
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+import re
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin import site as admin_site
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from app.cache_profiles import cache_profile, file_cache
+from app.db_profiles import database_profile, postgres_database
+
+from openpyxl import load_workbook
+from PIL import Image
+
+from .bench import (
+    add_appointments, compare_results, measure_export, run_api_benchmark, run_booking_stress, seed_dataset,
+)
+from .authentication import token_cache_key
+from .caching import CacheNamespace, read_through
+from .export_jobs import run_export_job
+from .metrics import registry
+from .querywatch import NPlusOneError, QueryWatchMiddleware, QueryWatcher, fingerprint
+from .admin import ReviewAdmin
+from .api import MasterViewSet, ServiceViewSet
+from .models import (
+    Client, Service, Master, Appointment, Review, ServiceRating, DailyBookingRollup, HourlyBookingRollup,
+    ExportJob,
+)
+from .pagination import IdCursorPagination
+from .ratings import rebuild_ratings
+from .rollups import GRANULARITIES, bucket_count, bucket_starts, rebuild_rollups
+from .search import search
+from .utilization import Period, compute_utilization, np
+from .stemmer import stem
+
+
+def create_salon_data(count, start=0):
+    """Создает count клиентов, услуг, мастеров, записей и отзывов"""
+    now = timezone.now()
+    for i in range(start, start + count):
+        user = User.objects.create(username=f'client{i}')
+        service = Service.objects.create(name=f'Услуга {i}', price=1000 + i, duration=60)
+        master = Master.objects.create(name=f'Мастер {i}', specialization='Парикмахер')
+        master.services.add(service)
+        client = Client.objects.create(user=user, name=f'Клиент {i}', phone='123', email='')
+        Appointment.objects.create(
+            client=client, service=service, master=master, date=now + timedelta(hours=i)
+        )
+        Review.objects.create(client=client, service=service, rating=i % 5 + 1, comment='Отлично')
+
+
+class ClientBookingTestCase(TestCase):
+    """Клиент с профилем и APIClient, услуга на час и мастер, который ее оказывает"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('client', password='x')
+        self.client_profile = Client.objects.create(user=self.user, name='Клиент', phone='1', email='')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service = Service.objects.create(name='Стрижка', price=1000, duration=60)
+            self.master = Master.objects.create(name='Мастер', specialization='Парикмахер')
+            self.master.services.add(self.service)
+
+
+class QueryCountTests(TestCase):
+    """Количество запросов на list/export/stats не должно расти вместе с данными"""
+
+    urls = [
+        '/api/appointments/',
+        '/api/appointments/stats/',
+        '/api/appointments/export-excel/',
+        '/api/masters/',
+        '/api/masters/stats/',
+        '/api/masters/export-excel/',
+        '/api/services/',
+        '/api/services/stats/',
+        '/api/services/export-excel/',
+        '/api/reviews/',
+        '/api/reviews/stats/',
+        '/api/clients/',
+        '/api/clients/stats/',
+    ]
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('danil', password='x')
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api.get(url)
+            # Тело потоковых ответов читается уже после выхода из view
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200, url)
+        return len(ctx.captured_queries)
+
+    def test_queries_do_not_grow_with_data(self):
+        create_salon_data(3)
+        small = {url: self.count_queries(url) for url in self.urls}
+        # Снимки статистики сбрасываются после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            create_salon_data(20, start=3)
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), small[url])
+
+    def test_appointment_export_is_single_query(self):
+        create_salon_data(10)
+        with self.assertNumQueries(1):
+            response = self.api.get('/api/appointments/export-excel/')
+            b''.join(response.streaming_content)
+
+    def test_export_has_every_row_past_chunk_and_width_sample(self):
+        create_salon_data(7)
+        # Несколько пачек iterator() и строки после выборки для ширины колонок
+        with mock.patch('beauty_salon.api.EXPORT_CHUNK_SIZE', 3), \
+                mock.patch('beauty_salon.exports.WIDTH_SAMPLE_SIZE', 2):
+            response = self.api.get('/api/appointments/export-excel/')
+            sheet = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True).active
+        header, *rows = sheet.iter_rows(values_only=True)
+        self.assertEqual(header, ('Клиент', 'Услуга', 'Мастер', 'Дата', 'Время'))
+        expected = [
+            (a.client.name, a.service.name, a.master.name, a.date.strftime('%d.%m.%Y'), a.date.strftime('%H:%M'))
+            for a in Appointment.objects.select_related('client', 'service', 'master')
+        ]
+        self.assertEqual(sorted(rows), sorted(expected))
+
+
+class StatsCacheTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('danil', password='x')
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+        create_salon_data(5)
+
+    def test_repeated_stats_are_cache_hits(self):
+        first = self.api.get('/api/reviews/stats/').json()
+        with self.assertNumQueries(0):
+            second = self.api.get('/api/reviews/stats/').json()
+        self.assertEqual(first, second)
+        self.assertEqual(first['total_reviews'], 5)
+
+    def test_writes_invalidate_stats(self):
+        self.assertEqual(self.api.get('/api/appointments/stats/').json()['total_appointments'], 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.first().delete()
+            # До коммита версия не меняется: параллельный запрос не закэширует старые данные под новой
+            self.assertEqual(self.api.get('/api/appointments/stats/').json()['total_appointments'], 5)
+        self.assertEqual(self.api.get('/api/appointments/stats/').json()['total_appointments'], 4)
+
+    def test_writes_reset_only_dependent_scopes(self):
+        self.api.get('/api/services/stats/')
+        self.api.get('/api/clients/stats/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Client.objects.first().save()
+        with self.assertNumQueries(0):
+            self.api.get('/api/services/stats/')
+        with CaptureQueriesContext(connection) as ctx:
+            self.api.get('/api/clients/stats/')
+        self.assertGreater(len(ctx.captured_queries), 0)
+
+    def test_stats_values(self):
+        masters = self.api.get('/api/masters/stats/').json()
+        self.assertEqual(masters['total_masters'], 5)
+        self.assertEqual(masters['avg_services_per_master'], 1.0)
+        reviews = self.api.get('/api/reviews/stats/').json()
+        self.assertEqual(reviews['five_star_reviews'], 1)
+        self.assertEqual(reviews['one_star_reviews'], 1)
+        self.assertEqual(reviews['avg_rating'], 3.0)
+        appointments = self.api.get('/api/appointments/stats/').json()
+        self.assertEqual(appointments['total_appointments'], 5)
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('danil', password='x')
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+        create_salon_data(5)
+
+    def collect(self, url):
+        ids = []
+        while url:
+            page = self.api.get(url).json()
+            ids.extend(item['id'] for item in page['results'])
+            url = page['next']
+        return ids
+
+    def test_cursor_walks_every_appointment_once(self):
+        ids = self.collect('/api/appointments/?page_size=2')
+        self.assertEqual(sorted(ids), sorted(Appointment.objects.values_list('id', flat=True)))
+        # Новые записи первыми
+        dates = list(Appointment.objects.filter(id__in=ids[:2]).order_by('-date').values_list('id', flat=True))
+        self.assertEqual(ids[:2], dates)
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(IdCursorPagination, 'max_page_size', 3):
+            page = self.api.get('/api/services/?page_size=100000').json()
+        self.assertEqual(len(page['results']), 3)
+        self.assertIsNotNone(page['next'])
+
+    def test_sparse_fields(self):
+        page = self.api.get('/api/services/?fields=id,name').json()
+        self.assertEqual(set(page['results'][0]), {'id', 'name'})
+
+
+class FreeSlotsTests(ClientBookingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.day = (timezone.now() + timedelta(days=3)).date()
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.create(
+                client=self.client_profile, service=self.service, master=self.master,
+                date=self.at(10, 0),
+            )
+
+    def at(self, hour, minute):
+        return timezone.make_aware(datetime.combine(self.day, time(hour, minute)))
+
+    def free_starts(self):
+        response = self.api.get('/api/appointments/free-slots/', {
+            'service': self.service.id, 'date_from': self.day, 'date_to': self.day,
+        })
+        self.assertEqual(response.status_code, 200)
+        return {parse_datetime(slot['start']) for slot in response.json()}
+
+    def test_booked_interval_is_excluded(self):
+        starts = self.free_starts()
+        self.assertIn(self.at(9, 0), starts)
+        self.assertNotIn(self.at(9, 30), starts)
+        self.assertNotIn(self.at(10, 30), starts)
+        self.assertIn(self.at(11, 0), starts)
+        # Последний слот заканчивается к концу рабочего дня
+        self.assertIn(self.at(20, 0), starts)
+        self.assertNotIn(self.at(20, 30), starts)
+
+    def test_index_follows_writes_without_rebuild(self):
+        self.free_starts()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api.post('/api/appointments/', {
+                'service': self.service.id, 'master': self.master.id, 'date': self.at(15, 0).isoformat(),
+            })
+        self.assertEqual(response.status_code, 201)
+        # Свежий индекс: только запросы услуги и мастеров
+        with self.assertNumQueries(2):
+            starts = self.free_starts()
+        self.assertNotIn(self.at(15, 0), starts)
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.get(date=self.at(15, 0)).delete()
+        self.assertIn(self.at(15, 0), self.free_starts())
+
+    def test_range_is_validated(self):
+        response = self.api.get('/api/appointments/free-slots/', {
+            'service': self.service.id, 'date_from': self.day, 'date_to': self.day - timedelta(days=1),
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class DoubleBookingTests(ClientBookingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = (timezone.now() + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+
+    def book(self, start):
+        return self.api.post('/api/appointments/', {
+            'service': self.service.id, 'master': self.master.id, 'date': start.isoformat(),
+        })
+
+    def test_overlap_is_rejected_with_409(self):
+        self.assertEqual(self.book(self.start).status_code, 201)
+        self.assertEqual(self.book(self.start + timedelta(minutes=30)).status_code, 409)
+        self.assertEqual(self.book(self.start - timedelta(minutes=30)).status_code, 409)
+        # Соседние интервалы не пересекаются
+        self.assertEqual(self.book(self.start + timedelta(minutes=60)).status_code, 201)
+        self.assertEqual(self.book(self.start - timedelta(minutes=60)).status_code, 201)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    def test_concurrent_bookings_never_overlap(self):
+        result = run_booking_stress(threads=200, slots=24)
+        self.assertEqual(len(result['statuses']), 200)
+        self.assertEqual(set(result['statuses']) - {201, 409}, set())
+        self.assertEqual(result['booked'], result['statuses'].count(201))
+        self.assertGreater(result['booked'], 0)
+        self.assertEqual(result['overlaps'], 0)
+
+
+class BulkWriteTests(ClientBookingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = (timezone.now() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+
+    def items(self, count, offset=0):
+        return [
+            {'service': self.service.id, 'master': self.master.id,
+             'date': (self.start + timedelta(hours=offset + i)).isoformat()}
+            for i in range(count)
+        ]
+
+    def test_bulk_create_query_count_does_not_grow(self):
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.api.post('/api/appointments/bulk/', self.items(2), format='json').status_code, 201)
+        with CaptureQueriesContext(connection) as large:
+            response = self.api.post('/api/appointments/bulk/', self.items(10, offset=2), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()), 10)
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+        self.assertEqual(Appointment.objects.filter(client=self.client_profile).count(), 12)
+
+    def test_invalid_items_are_reported_and_nothing_is_written(self):
+        items = self.items(3)
+        items[1]['master'] = 999999
+        response = self.api.post('/api/appointments/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1])
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_overlaps_inside_batch_return_409(self):
+        items = self.items(2) + self.items(1)
+        response = self.api.post('/api/appointments/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [2])
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_bulk_update_and_delete(self):
+        created = self.api.post('/api/appointments/bulk/', self.items(3), format='json').json()
+        updated = [dict(item, date=(self.start + timedelta(days=1, hours=i)).isoformat())
+                   for i, item in enumerate(created)]
+        with mock.patch('beauty_salon.permissions.cache.get', return_value=True):
+            response = self.api.put('/api/appointments/bulk/', updated, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            Appointment.objects.filter(date__gte=self.start + timedelta(days=1)).count(), 3
+        )
+        response = self.api.delete('/api/appointments/bulk/', [item['id'] for item in created[:2]], format='json')
+        self.assertEqual(response.json(), {'deleted': 2})
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_bulk_reviews(self):
+        reviews = [{'service': self.service.id, 'rating': rating, 'comment': 'Отлично'} for rating in (4, 5)]
+        response = self.api.post('/api/reviews/bulk/', reviews, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Review.objects.filter(client=self.client_profile).count(), 2)
+
+
+class AsyncViewsTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('danil', password='x')
+        self.token = Token.objects.create(user=self.admin)
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+        create_salon_data(3)
+
+    async def aget(self, url, **params):
+        return await self.async_client.get(url, params, headers={'Authorization': f'Token {self.token.key}'})
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get('/api/async/services/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_lists_match_sync_endpoints(self):
+        for name in ('services', 'masters'):
+            response = await self.aget(f'/api/async/{name}/', page_size=2)
+            self.assertEqual(response.status_code, 200)
+            first_page = response.json()
+            self.assertEqual(len(first_page['results']), 2)
+            rest = (await self.async_client.get(
+                first_page['next'], headers={'Authorization': f'Token {self.token.key}'}
+            )).json()
+            expected = (await sync_to_async(self.api.get)(f'/api/{name}/')).json()['results']
+            self.assertEqual(first_page['results'] + rest['results'], expected)
+
+            # Курсоры те же, что у /api/: ссылку можно передать в другой эндпоинт
+            sync_page = (await sync_to_async(self.api.get)(f'/api/{name}/', {'page_size': 2})).json()
+            cursor = parse_qs(urlsplit(sync_page['next']).query)['cursor'][0]
+            self.assertEqual(parse_qs(urlsplit(first_page['next']).query)['cursor'][0], cursor)
+            self.assertEqual((await self.aget(f'/api/async/{name}/', page_size=2, cursor=cursor)).json(), rest)
+            back = (await self.async_client.get(
+                rest['previous'], headers={'Authorization': f'Token {self.token.key}'}
+            )).json()
+            self.assertEqual(back['results'], first_page['results'])
+            self.assertIsNone(first_page['previous'])
+            self.assertEqual((await self.aget(f'/api/async/{name}/', cursor='garbage')).status_code, 404)
+
+    async def test_token_miss_fills_the_shared_principal_cache(self):
+        key = token_cache_key(self.token.key)
+        await cache.adelete(key)
+        self.assertEqual((await self.aget('/api/async/services/')).status_code, 200)
+        principal = await cache.aget(key)
+        self.assertEqual(principal['username'], 'danil')
+        # Тот же пользователь, что кладет синхронная аутентификация
+        await cache.adelete(key)
+        sync_api = APIClient()
+        sync_api.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual((await sync_to_async(sync_api.get)('/api/services/')).status_code, 200)
+        self.assertEqual(await cache.aget(key), principal)
+
+    async def test_stats_match_sync_endpoints(self):
+        for scope in ('clients', 'services', 'masters', 'appointments', 'reviews'):
+            response = await self.aget(f'/api/async/{scope}/stats/')
+            self.assertEqual(response.status_code, 200)
+            expected = (await sync_to_async(self.api.get)(f'/api/{scope}/stats/')).json()
+            self.assertEqual(response.json(), expected)
+
+    async def test_free_slots(self):
+        service = await Service.objects.afirst()
+        day = (timezone.now() + timedelta(days=3)).date()
+        response = await self.aget(
+            '/api/async/appointments/free-slots/', service=service.id, date_from=day, date_to=day
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json())
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('client', password='x')
+        self.token = Token.objects.create(user=self.user)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in ctx.captured_queries
+                if 'authtoken_token' in q['sql'] or 'auth_user' in q['sql']]
+
+    def test_steady_state_has_no_auth_queries(self):
+        self.assertTrue(self.auth_queries('/api/users/profile/'))
+        self.assertEqual(self.auth_queries('/api/users/profile/'), [])
+        profile = self.api.get('/api/users/profile/').json()
+        self.assertEqual(profile['username'], 'client')
+
+    def test_client_profile_is_resolved_from_cache(self):
+        service = Service.objects.create(name='Стрижка', price=1000, duration=60)
+        client = Client.objects.create(user=self.user, name='Клиент', phone='1', email='')
+        self.api.get('/api/users/profile/')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api.post('/api/reviews/', {'service': service.id, 'rating': 5, 'comment': 'Ок'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Review.objects.get().client, client)
+        self.assertFalse([q for q in ctx.captured_queries if 'beauty_salon_client' in q['sql']])
+
+    def test_logout_invalidates_cached_token(self):
+        self.api.get('/api/users/profile/')
+        self.assertEqual(self.api.post('/api/auth/logout/').status_code, 200)
+        self.assertEqual(self.api.get('/api/users/profile/').status_code, 401)
+
+    def test_user_changes_invalidate_cached_token(self):
+        self.api.get('/api/users/profile/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.api.get('/api/users/profile/').status_code, 401)
+
+
+class ServiceRatingTests(ClientBookingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.manicure = Service.objects.create(name='Маникюр', price=1500, duration=60)
+
+    def summary(self, service):
+        rating = ServiceRating.objects.filter(service=service).first() or ServiceRating()
+        return rating.count, rating.total, rating.histogram
+
+    def review(self, service, rating):
+        return Review.objects.create(client=self.client_profile, service=service, rating=rating, comment='')
+
+    def assertMatchesRebuild(self):
+        incremental = {s: self.summary(s) for s in (self.service, self.manicure)}
+        rebuild_ratings()
+        self.assertEqual(incremental, {s: self.summary(s) for s in (self.service, self.manicure)})
+
+    def test_create_update_delete_keep_summary_in_sync(self):
+        first = self.review(self.service, 5)
+        second = self.review(self.service, 3)
+        self.assertEqual(self.summary(self.service), (2, 8, {1: 0, 2: 0, 3: 1, 4: 0, 5: 1}))
+
+        second = Review.objects.get(pk=second.pk)
+        second.rating = 1
+        second.save()
+        first = Review.objects.get(pk=first.pk)
+        first.service = self.manicure
+        first.save()
+        self.assertEqual(self.summary(self.service), (1, 1, {1: 1, 2: 0, 3: 0, 4: 0, 5: 0}))
+        self.assertEqual(self.summary(self.manicure)[:2], (1, 5))
+        self.assertMatchesRebuild()
+
+        Review.objects.filter(pk=second.pk).delete()
+        self.assertEqual(self.summary(self.service)[:2], (0, 0))
+        self.assertMatchesRebuild()
+
+    def test_bulk_writes_update_summary(self):
+        reviews = [{'service': self.service.id, 'rating': rating, 'comment': 'Ок'} for rating in (4, 5, 5)]
+        response = self.api.post('/api/reviews/bulk/', reviews, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        created = response.json()
+        self.assertEqual(self.summary(self.service)[:2], (3, 14))
+
+        updated = [dict(item, rating=2) for item in created[:2]]
+        with mock.patch('beauty_salon.permissions.cache.get', return_value=True):
+            self.assertEqual(self.api.put('/api/reviews/bulk/', updated, format='json').status_code, 200)
+        self.assertEqual(self.summary(self.service)[:2], (3, 9))
+        self.assertMatchesRebuild()
+
+    def test_deleting_service_drops_summary(self):
+        self.review(self.service, 4)
+        self.service.delete()
+        self.assertFalse(ServiceRating.objects.exists())
+
+    def test_service_list_exposes_rating_without_extra_queries(self):
+        for rating in (5, 4, 5):
+            self.review(self.service, rating)
+        with CaptureQueriesContext(connection) as ctx:
+            services = {s['id']: s for s in self.api.get('/api/services/').json()['results']}
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(services[self.service.id]['rating_avg'], 4.67)
+        self.assertEqual(services[self.service.id]['rating_count'], 3)
+        self.assertEqual(services[self.service.id]['rating_histogram']['5'], 2)
+        self.assertIsNone(services[self.manicure.id]['rating_avg'])
+        self.assertEqual(services[self.manicure.id]['rating_count'], 0)
+
+    def test_review_stats_for_superuser_come_from_summary(self):
+        for rating in (5, 1, 5):
+            self.review(self.service, rating)
+        self.review(self.manicure, 3)
+        admin = User.objects.create_superuser('admin', password='x')
+        self.api.force_authenticate(admin)
+        stats = self.api.get('/api/reviews/stats/').json()
+        self.assertEqual(stats, {
+            'total_reviews': 4, 'avg_rating': 3.5, 'five_star_reviews': 2,
+            'one_star_reviews': 1, 'most_reviewed_service': 'Стрижка',
+        })
+
+
+class GenerateDataTests(TestCase):
+    def test_generates_requested_volumes_consistently(self):
+        with mock.patch.object(PBKDF2PasswordHasher, 'encode', autospec=True,
+                               side_effect=PBKDF2PasswordHasher.encode) as encode:
+            call_command('generate_data', clients=30, appointments=250, reviews=120,
+                         batch_size=100, seed=7, stdout=StringIO())
+        # Пароль хэшируется один раз на всех клиентов
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(Client.objects.count(), 30)
+        self.assertEqual(Appointment.objects.count(), 250)
+        self.assertEqual(Review.objects.count(), 120)
+        # Мастер каждой записи оказывает ее услугу
+        through = Master.services.through.objects
+        self.assertFalse(Appointment.objects.exclude(Exists(through.filter(
+            master_id=OuterRef('master_id'), service_id=OuterRef('service_id'),
+        ))).exists())
+        self.assertEqual(sum(ServiceRating.objects.values_list('count', flat=True)), 120)
+
+    def test_appointments_of_a_master_never_overlap(self):
+        # В среднем по записи на день мастера: случайные пары (мастер, время) здесь уже пересекаются
+        call_command('generate_data', clients=5, appointments=20000, reviews=0,
+                     batch_size=3000, seed=7, stdout=StringIO())
+        self.assertEqual(Appointment.objects.count(), 20000)
+        booked = sorted(Appointment.objects.values_list('master_id', 'date', 'service__duration'))
+        for (master_id, start, duration), (next_master_id, next_start, _) in zip(booked, booked[1:]):
+            if master_id == next_master_id:
+                self.assertLessEqual(start + timedelta(minutes=duration), next_start)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN есть только в SQLite')
+class QueryPlanTests(TestCase):
+    """
+    Горячие запросы API не должны читать appointment/review целиком.
+    Каждый SELECT запроса прогоняется через EXPLAIN QUERY PLAN.
+    """
+
+    hot_tables = ('beauty_salon_appointment', 'beauty_salon_review')
+
+    def setUp(self):
+        create_salon_data(5)
+        self.user = User.objects.get(username='client2')
+        self.admin = User.objects.create_superuser('admin', password='x')
+        self.api = APIClient()
+
+    def plans(self, user, method, url, data=None):
+        self.api.force_authenticate(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.api, method)(url, data)
+        self.assertLess(response.status_code, 300, response.content)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in ctx.captured_queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plans.append((query['sql'], [row[3] for row in cursor.fetchall()]))
+        return plans
+
+    def assertNoFullScans(self, plans):
+        for sql, steps in plans:
+            for step in steps:
+                # "SCAN <таблица>" без "USING ... INDEX" - чтение всей таблицы
+                match = re.fullmatch(r'SCAN (\S+)', step)
+                self.assertFalse(match and match.group(1) in self.hot_tables, f'{step}\n{sql}')
+
+    def assertUsesIndex(self, plans, index):
+        self.assertTrue(
+            any(index in step for _, steps in plans for step in steps),
+            f'{index} не используется:\n' + '\n'.join(step for _, steps in plans for step in steps),
+        )
+
+    def test_client_paths_use_client_date_indexes(self):
+        for url, index in [
+            ('/api/appointments/', 'appointment_client_date_idx'),
+            ('/api/appointments/stats/', 'appointment_client_date_idx'),
+            ('/api/reviews/', 'review_client_date_idx'),
+            ('/api/reviews/stats/', 'review_client_date_idx'),
+        ]:
+            with self.subTest(url=url):
+                plans = self.plans(self.user, 'get', url)
+                self.assertNoFullScans(plans)
+                self.assertUsesIndex(plans, index)
+
+    def test_admin_lists_and_stats_have_no_full_scans(self):
+        for url in ['/api/appointments/', '/api/appointments/stats/', '/api/reviews/',
+                    '/api/reviews/stats/', '/api/services/', '/api/masters/stats/']:
+            with self.subTest(url=url):
+                self.assertNoFullScans(self.plans(self.admin, 'get', url))
+
+    def test_overlap_check_uses_master_date_index(self):
+        appointment = Appointment.objects.filter(client__user=self.user).first()
+        start = (timezone.now() + timedelta(days=3)).replace(hour=10, minute=0, second=0, microsecond=0)
+        plans = self.plans(self.user, 'post', '/api/appointments/', {
+            'service': appointment.service_id, 'master': appointment.master_id, 'date': start.isoformat(),
+        })
+        self.assertNoFullScans(plans)
+        self.assertUsesIndex(plans, 'appointment_master_date_idx')
+
+    def test_rating_rebuild_reads_service_rating_index(self):
+        with CaptureQueriesContext(connection) as ctx:
+            rebuild_ratings()
+        select = next(q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT'))
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + select)
+            steps = [row[3] for row in cursor.fetchall()]
+        self.assertTrue(any('COVERING INDEX review_service_rating_idx' in step for step in steps), steps)
+
+    def test_today_and_month_counts_are_half_open_ranges(self):
+        Appointment.objects.all().delete()
+        client = Client.objects.get(user=self.user)
+        service = Service.objects.first()
+        master = Master.objects.first()
+        today = timezone.localdate()
+        midnight = timezone.make_aware(datetime.combine(today, time.min))
+        dates = [midnight, midnight + timedelta(days=1), midnight - timedelta(seconds=1)]
+        for moment in dates:
+            Appointment.objects.create(client=client, service=service, master=master, date=moment)
+        self.api.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as ctx:
+            stats = self.api.get('/api/appointments/stats/').json()
+        self.assertEqual(stats['appointments_today'], 1)
+        # Сравнение по колонке, без приведения даты к дню/месяцу на каждой строке
+        self.assertNotIn('django_datetime_extract', ctx.captured_queries[0]['sql'])
+        self.assertNotIn('django_datetime_cast_date', ctx.captured_queries[0]['sql'])
+        same_month = [moment for moment in dates if timezone.localdate(moment).replace(day=1) == today.replace(day=1)]
+        self.assertEqual(stats['appointments_this_month'], len(same_month))
+
+
+class DatabaseProfileTests(TestCase):
+    def test_sqlite_profile_sets_pragmas_on_connect(self):
+        database = database_profile('sqlite-wal', settings.BASE_DIR, {'SQLITE_PATH': '/srv/salon.sqlite3'})
+        self.assertEqual(database['NAME'], '/srv/salon.sqlite3')
+        self.assertIn('PRAGMA journal_mode = WAL', database['OPTIONS']['init_command'])
+        self.assertIn('PRAGMA synchronous = NORMAL', database['OPTIONS']['init_command'])
+        self.assertEqual(database['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertGreater(database['CONN_MAX_AGE'], 0)
+        # Профиль по умолчанию не переводит демо-базу из git в WAL
+        default = database_profile('sqlite', settings.BASE_DIR, {})
+        self.assertEqual(default['NAME'], settings.BASE_DIR / 'db.sqlite3')
+        self.assertEqual(default['OPTIONS']['init_command'], 'PRAGMA journal_mode = DELETE')
+
+    def test_postgres_pool_and_persistent_connections_are_exclusive(self):
+        pooled = postgres_database({'DB_POOL_MAX_SIZE': '8'})
+        self.assertEqual(pooled['OPTIONS']['pool']['max_size'], 8)
+        self.assertNotIn('CONN_MAX_AGE', pooled)
+        persistent = postgres_database({'DB_POOL': '0'})
+        self.assertNotIn('pool', persistent['OPTIONS'])
+        self.assertEqual(persistent['CONN_MAX_AGE'], 600)
+        self.assertTrue(persistent['CONN_HEALTH_CHECKS'])
+
+    def test_unknown_profile_is_rejected(self):
+        with self.assertRaises(ValueError):
+            database_profile('mysql', settings.BASE_DIR)
+
+
+class PictureDerivativesTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('client', password='x'))
+
+    def upload(self, name='photo.png', size=(1200, 800)):
+        buffer = BytesIO()
+        Image.new('RGB', size, (200, 100, 50)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_upload_builds_thumbnails_and_exposes_srcset(self):
+        response = self.api.post('/api/services/', {
+            'name': 'Стрижка', 'price': 1000, 'duration': 60, 'picture': self.upload(),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        service = Service.objects.get()
+        self.assertEqual(len(service.picture_hash), 64)
+
+        data = self.api.get('/api/services/').json()['results'][0]
+        self.assertTrue(data['picture_thumb'].endswith(f'{service.picture_hash}_128.jpg'))
+        self.assertEqual(data['picture_srcset'].count('.webp'), 4)
+        self.assertIn('640w', data['picture_srcset'])
+        with default_storage.open(f'thumbs/{service.picture_hash[:2]}/{service.picture_hash}_320.webp') as f:
+            self.assertEqual(Image.open(f).size, (320, 213))
+
+    def test_same_content_shares_derivatives(self):
+        first = Service.objects.create(name='A', price=1, duration=30, picture=self.upload('a.png'))
+        second = Service.objects.create(name='B', price=1, duration=30, picture=self.upload('b.png'))
+        self.assertEqual(first.picture_hash, second.picture_hash)
+        _, files = default_storage.listdir(f'thumbs/{first.picture_hash[:2]}')
+        self.assertEqual(len(files), 5)
+
+    def test_backfill_command_fills_missing_hashes(self):
+        user = User.objects.get(username='client')
+        client = Client.objects.create(user=user, name='Клиент', phone='1', email='', picture=self.upload())
+        Client.objects.filter(pk=client.pk).update(picture_hash='')
+        shutil.rmtree(default_storage.path('thumbs'))
+        call_command('generate_thumbnails', workers=1, stdout=StringIO())
+        client.refresh_from_db()
+        self.assertEqual(len(client.picture_hash), 64)
+        self.assertTrue(default_storage.exists(f'thumbs/{client.picture_hash[:2]}/{client.picture_hash}_64.webp'))
+        data = self.api.get('/api/clients/').json()['results'][0]
+        self.assertIsNotNone(data['picture_thumb'])
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def image(self, color=(10, 20, 30)):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 30), color).save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def blobs(self):
+        return sorted(
+            os.path.relpath(os.path.join(path, name), default_storage.location)
+            for path, _, names in os.walk(default_storage.path('cas')) for name in names
+        )
+
+    def test_identical_uploads_share_one_blob(self):
+        data = self.image()
+        first = Service.objects.create(name='A', price=1, duration=30,
+                                       picture=SimpleUploadedFile('1.jpg', data))
+        second = Client.objects.create(name='B', phone='1', email='',
+                                       picture=SimpleUploadedFile('1.JPG', data))
+        self.assertEqual(first.picture.name, second.picture.name)
+        self.assertEqual(first.picture.name, f'cas/{first.picture_hash[:2]}/{first.picture_hash}.jpg')
+        self.assertEqual(len(self.blobs()), 1)
+        self.assertFalse(os.listdir(default_storage.path('cas/tmp')))
+
+    def test_gc_removes_only_unreferenced_files(self):
+        kept = Service.objects.create(name='A', price=1, duration=30,
+                                      picture=SimpleUploadedFile('a.jpg', self.image()))
+        dropped = Service.objects.create(name='B', price=1, duration=30,
+                                         picture=SimpleUploadedFile('b.jpg', self.image((200, 0, 0))))
+        dropped_name = dropped.picture.name
+        dropped.delete()
+        call_command('gc_media', grace_hours=1, stdout=StringIO())
+        self.assertTrue(default_storage.exists(dropped_name))  # моложе grace - может быть в процессе загрузки
+
+        call_command('gc_media', grace_hours=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists(dropped_name))
+        self.assertEqual(self.blobs(), [kept.picture.name])
+        self.assertTrue(default_storage.exists(f'thumbs/{kept.picture_hash[:2]}/{kept.picture_hash}_128.jpg'))
+
+    def test_dedupe_moves_legacy_uploads_into_blobs(self):
+        data = self.image()
+        for name in ('clients/1.jpg', 'clients/1_60YUmfI.jpg'):
+            default_storage.save(name, ContentFile(data))
+        first = Client.objects.create(name='A', phone='1', email='')
+        second = Client.objects.create(name='B', phone='1', email='')
+        Client.objects.filter(pk=first.pk).update(picture='clients/1.jpg')
+        Client.objects.filter(pk=second.pk).update(picture='clients/1_60YUmfI.jpg')
+
+        call_command('dedupe_media', stdout=StringIO())
+        names = set(Client.objects.values_list('picture', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names.pop().startswith('cas/'))
+        call_command('gc_media', grace_hours=0, stdout=StringIO())
+        self.assertFalse(default_storage.exists('clients/1.jpg'))
+        self.assertEqual(len(self.blobs()), 1)
+
+
+class ConditionalListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('client', password='x')
+        self.token = Token.objects.create(user=self.user)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_salon_data(2)
+
+    def revalidate(self, url, etag):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api.get(url, HTTP_IF_NONE_MATCH=etag)
+        return response, len(ctx.captured_queries)
+
+    def test_unchanged_list_is_not_modified_without_queries(self):
+        for url in ('/api/services/', '/api/masters/', '/api/async/services/', '/api/async/masters/'):
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Last-Modified', response)
+            response, queries = self.revalidate(url, response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(queries, 0)
+
+    def test_writes_change_etag(self):
+        service = Service.objects.first()
+        master = Master.objects.first()
+        writes = [
+            ('/api/services/', lambda: Service.objects.create(name='Маникюр', price=900, duration=30)),
+            ('/api/services/', lambda: Review.objects.create(
+                client=Client.objects.first(), service=service, rating=1, comment='Плохо')),
+            ('/api/masters/', lambda: master.services.remove(service)),
+            ('/api/masters/', lambda: service.delete()),
+        ]
+        for url, write in writes:
+            etag = self.api.get(url)['ETag']
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            response, _ = self.revalidate(url, etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_requires_authentication(self):
+        etag = self.api.get('/api/services/')['ETag']
+        self.api.credentials()
+        self.assertEqual(self.api.get('/api/services/', HTTP_IF_NONE_MATCH=etag).status_code, 401)
+
+
+def in_new_process(func, *args):
+    """Выполнить func в отдельном процессе, как в другом воркере gunicorn"""
+    with get_context('fork').Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def verify_otp_in_worker(user):
+    api = APIClient()
+    api.force_authenticate(user)
+    return api.post('/api/services/verify-otp/', {'code': '123456'}).json()['success']
+
+
+def otp_status_in_worker(user):
+    api = APIClient()
+    api.force_authenticate(user)
+    return api.get('/api/services/otp-status/').json()['otp_verified']
+
+
+def read_pid_through_cache(key):
+    return read_through(key, os.getpid, 60)
+
+
+def invalidate_namespace_in_worker(name):
+    CacheNamespace(name).invalidate()
+
+
+class SharedCacheTests(TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        override = override_settings(CACHES={'default': file_cache(location, environ={})})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user('client', password='x')
+
+    def test_otp_verified_in_one_worker_is_seen_by_another(self):
+        self.assertFalse(in_new_process(otp_status_in_worker, self.user))
+        self.assertTrue(in_new_process(verify_otp_in_worker, self.user))
+        self.assertTrue(in_new_process(otp_status_in_worker, self.user))
+
+    def test_read_through_computes_once_across_processes(self):
+        first = in_new_process(read_pid_through_cache, 'pid')
+        self.assertNotEqual(first, os.getpid())
+        self.assertEqual(in_new_process(read_pid_through_cache, 'pid'), first)
+        self.assertEqual(read_pid_through_cache('pid'), first)
+
+    def test_namespace_invalidation_is_shared(self):
+        namespace = CacheNamespace('reports')
+        key = namespace.key('all')
+        self.assertEqual(read_through(key, lambda: None, 60), None)
+        in_new_process(invalidate_namespace_in_worker, 'reports')
+        self.assertNotEqual(namespace.key('all'), key)
+
+    def test_concurrent_invalidations_are_not_merged(self):
+        namespace = CacheNamespace('reports')
+        namespace.invalidate()
+        started_from = cache.get(namespace.version_key)
+        namespace.invalidate()
+        first = namespace.key('all')
+        # Второй воркер начинал с той же версии и записал свою последним
+        cache.set(namespace.version_key, started_from, None)
+        namespace.invalidate()
+        self.assertNotEqual(namespace.key('all'), first)
+
+    def test_profiles(self):
+        self.assertEqual(cache_profile('file', settings.BASE_DIR)['LOCATION'], str(settings.BASE_DIR / 'cache'))
+        self.assertEqual(cache_profile('locmem', settings.BASE_DIR)['KEY_PREFIX'], 'beauty_salon')
+        with self.assertRaises(ValueError):
+            cache_profile('memcached', settings.BASE_DIR)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        create_salon_data(3)
+        self.user = User.objects.get(username='client0')
+
+    def api(self):
+        # Middleware собирается при первом запросе клиента - после override_settings нужен новый
+        api = APIClient()
+        api.force_authenticate(self.user)
+        return api
+
+    def series(self, metric, **labels):
+        return {values: data for values, data in metric.series.items()
+                if all(dict(zip(metric.labels, values)).get(k) == v for k, v in labels.items())}
+
+    def test_records_route_action_queries_and_serializer_time(self):
+        response = self.api().get('/api/services/')
+        self.assertEqual(response.status_code, 200)
+        labels = {'route': 'api/services/$', 'method': 'GET', 'action': 'list'}
+        [(_, queries)] = self.series(registry.db_queries, **labels).items()
+        self.assertEqual(queries[-1], 1)
+        self.assertGreater(queries[-2], 0)
+        [(_, serializer)] = self.series(registry.serializer_time, **labels).items()
+        self.assertGreater(serializer[-2], 0)
+        [(_, size)] = self.series(registry.response_size, **labels).items()
+        self.assertEqual(size[-2], len(response.content))
+
+        self.api().get('/api/services/stats/')
+        with override_settings(METRICS_PUBLIC=True):
+            text = self.client.get('/metrics').content.decode()
+        self.assertIn(
+            'salon_http_requests_total{route="api/services/$",method="GET",action="list",status="200"} 1', text
+        )
+        self.assertIn('action="get_stats"', text)
+        self.assertIn('# TYPE salon_http_request_duration_seconds histogram', text)
+        self.assertRegex(text, r'salon_http_request_duration_seconds_bucket\{[^}]*le="\+Inf"\} 1')
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_sampling_off_records_nothing(self):
+        self.assertEqual(self.api().get('/api/services/').status_code, 200)
+        self.assertEqual(registry.requests.series, {})
+
+    @override_settings(METRICS_LOG=True)
+    def test_structured_log_line(self):
+        with self.assertLogs('beauty_salon.metrics', 'INFO') as logs:
+            self.api().get('/api/masters/')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record['route'], record['action'], record['status']), ('api/masters/$', 'list', 200))
+        self.assertGreater(record['db_queries'], 0)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_without_token_are_hidden_unless_public(self):
+        # Тесты идут с DEBUG=False, как в работе
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(METRICS_PUBLIC=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class QueryWatchTests(TestCase):
+    def setUp(self):
+        create_salon_data(6)
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_superuser('danil', password='x'))
+
+    def test_fingerprint_ignores_literals_and_in_list_length(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+            fingerprint('SELECT *  FROM t WHERE id IN (%s) AND name = \'y\' LIMIT 1'),
+        )
+
+    def test_repeated_relation_access_in_api_fails(self):
+        self.assertEqual(self.api.get('/api/masters/export-excel/').status_code, 200)
+        # Без prefetch услуги каждого мастера - отдельный запрос из api.py
+        shapes = dict(MasterViewSet.queryset_shapes, export_excel={})
+        with mock.patch.object(MasterViewSet, 'queryset_shapes', shapes), \
+                self.assertLogs('beauty_salon.querywatch', 'WARNING'):
+            with self.assertRaisesRegex(NPlusOneError, r'6x from beauty_salon/api\.py:\d+ in <genexpr>'):
+                self.api.get('/api/masters/export-excel/')
+
+    def test_lazy_access_in_serializer_counts_for_api_view(self):
+        # Без select_related сводка рейтинга читается в serializers.py отдельным запросом на услугу
+        with mock.patch.object(ServiceViewSet, 'queryset_shapes', {'default': {}}), \
+                self.assertLogs('beauty_salon.querywatch', 'WARNING'):
+            with self.assertRaisesRegex(NPlusOneError, r'6x from beauty_salon/serializers\.py:\d+'):
+                self.api.get('/api/services/')
+
+    async def test_async_requests_are_watched_natively(self):
+        self.assertTrue(QueryWatchMiddleware.async_capable)
+        token = await Token.objects.acreate(user=await User.objects.aget(username='danil'))
+        # Соединение теста открыто раньше, чем загружен middleware: обертку ставит синхронный запрос.
+        # На сервере потоки sync_to_async открывают соединения позже и получают ее из connection_created
+        await sync_to_async(self.api.get)('/api/services/')
+        # Порог 1: любой запрос попадает в лог
+        with override_settings(QUERYWATCH_REPEAT_THRESHOLD=1), \
+                self.assertLogs('beauty_salon.querywatch', 'WARNING') as logs:
+            response = await self.async_client.get(
+                '/api/async/services/', headers={'Authorization': f'Token {token.key}'},
+            )
+        self.assertEqual(response.status_code, 200)
+        # Запросы из пула потоков sync_to_async видны наблюдателю запроса
+        self.assertIn('GET /api/async/services/', logs.output[0])
+        self.assertIn('beauty_salon_service', logs.output[0])
+
+    def test_slow_queries_keep_project_stack(self):
+        watcher = QueryWatcher(slow_ms=0)
+        with connection.execute_wrapper(watcher):
+            for master in Master.objects.all():
+                list(master.services.all())
+        [shape] = watcher.repeated
+        self.assertEqual(shape.count, 6)
+        self.assertIn('beauty_salon/tests.py', shape.location)
+        self.assertEqual(len(watcher.slow), 7)
+        self.assertIn('tests.py', watcher.slow[0].stack[-1])
+
+
+class ApiBenchmarkTests(TestCase):
+    def test_benchmark_covers_hot_paths_and_flags_regressions(self):
+        seed_dataset(clients=5, services=3, masters=4, appointments=20, reviews=10)
+        user = User.objects.create_superuser('bench_admin', password='x')
+        results = run_api_benchmark(user, 'x', requests=1, warmup=1)
+        self.assertLessEqual(
+            {'appointments-list', 'services-list', 'masters-list', 'reviews-list', 'auth-login',
+             'appointments-stats', 'reviews-stats', 'masters-export-excel', 'appointments-export-excel'},
+            set(results),
+        )
+        self.assertEqual(sum(name.endswith('-stats') for name in results), 5)
+        self.assertEqual(results['appointments-list']['queries_per_request'], 1)
+        self.assertGreater(results['masters-export-excel']['peak_memory_kib'], 0)
+
+        self.assertEqual(compare_results(results, results), [])
+        baseline = {name: dict(result) for name, result in results.items()}
+        baseline['masters-list']['queries_per_request'] -= 1
+        baseline['services-list']['p95_ms'] = results['services-list']['p95_ms'] / 2 - 1
+        self.assertEqual(
+            [line.split(':')[0] for line in compare_results(results, baseline)],
+            ['services-list', 'masters-list'],
+        )
+
+    def test_export_benchmark_reads_the_whole_file(self):
+        seed_dataset(clients=5, services=3, masters=4, appointments=0, reviews=0)
+        add_appointments(25, batch_size=10)
+        self.assertEqual(Appointment.objects.count(), 25)
+        api = APIClient()
+        api.force_authenticate(User.objects.create_superuser('bench_admin', password='x'))
+        result = measure_export(api, '/api/appointments/export-excel/')
+        self.assertGreater(result['bytes'], 0)
+        self.assertGreater(result['peak_memory_kib'], 0)
+        self.assertIsNone(measure_export(api, '/api/appointments/export-excel/', memory=False)['peak_memory_kib'])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('client', password='x')
+        self.client_profile = Client.objects.create(user=self.user, name='Клиент', phone='1', email='')
+        self.haircut = Service.objects.create(name='Женская стрижка', price=1000, duration=60)
+        self.manicure = Service.objects.create(name='Маникюр', price=1500, duration=60)
+        self.master = Master.objects.create(name='Анна', specialization='Стрижки и укладки')
+        self.review = Review.objects.create(
+            client=self.client_profile, service=self.manicure, rating=5, comment='Стрижкой довольна'
+        )
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def found(self, query, **params):
+        response = self.api.get('/api/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(item['kind'], item['id']) for item in response.json()['results']]
+
+    def test_stemmer_folds_word_forms(self):
+        self.assertEqual({stem(word) for word in ('стрижка', 'стрижки', 'стрижкой')}, {'стрижк'})
+        self.assertEqual(stem('ёлка'), stem('елка'))
+
+    def test_word_forms_match_and_name_ranks_first(self):
+        found = self.found('стрижки')
+        self.assertEqual(found[0], ('service', self.haircut.id))
+        self.assertEqual(set(found[1:]), {('master', self.master.id), ('review', self.review.id)})
+        # Последнее слово - префикс: поиск по мере набора
+        self.assertEqual(self.found('мани'), [('service', self.manicure.id)])
+        self.assertEqual(self.found('стрижка', kind='review'), [('review', self.review.id)])
+        self.assertEqual(self.found('!!!'), [])
+
+    def test_index_follows_writes(self):
+        self.haircut.name = 'Окрашивание'
+        self.haircut.save()
+        self.assertEqual(self.found('окрашивания'), [('service', self.haircut.id)])
+        self.assertNotIn(('service', self.haircut.id), self.found('стрижка'))
+        self.master.delete()
+        self.assertEqual(self.found('укладка'), [])
+
+        response = self.api.post('/api/reviews/bulk/', [
+            {'service': self.haircut.id, 'rating': 4, 'comment': 'Окрашивание отличное'},
+        ], format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(
+            [kind for kind, _ in self.found('окрашивания')], ['service', 'review']
+        )
+
+    def test_reviews_of_other_clients_are_hidden(self):
+        other = User.objects.create_user('other', password='x')
+        self.api.force_authenticate(other)
+        self.assertNotIn('review', [kind for kind, _ in self.found('стрижка')])
+        self.assertEqual(len(search('стрижка', user=User.objects.create_superuser('admin'))), 3)
+
+    def test_pagination(self):
+        Service.objects.bulk_create(
+            Service(name=f'Стрижка {i}', price=1000, duration=60) for i in range(5)
+        )
+        call_command('rebuild_search_index', stdout=StringIO())
+        response = self.api.get('/api/search/', {'q': 'стрижка', 'kind': 'service', 'page_size': 4})
+        body = response.json()
+        self.assertEqual(len(body['results']), 4)
+        self.assertIsNone(body['previous'])
+        second = self.api.get(body['next']).json()
+        self.assertEqual(len(second['results']), 2)
+        self.assertIsNone(second['next'])
+        self.assertEqual(self.api.get('/api/search/', {'kind': 'nope', 'q': 'x'}).status_code, 400)
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser('admin', password='x')
+        self.client.force_login(admin)
+        response = self.client.get('/admin/beauty_salon/service/', {'q': 'стрижки'})
+        self.assertEqual(list(response.context['cl'].queryset), [self.haircut])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin/beauty_salon/review/', {'q': 'Клиент'})
+        self.assertEqual(list(response.context['cl'].queryset), [self.review])
+        # Имя клиента ищется в индексе, а не LIKE по JOIN всей таблицы
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if 'LIKE' in q['sql']])
+        appointment = Appointment.objects.create(
+            client=self.client_profile, service=self.haircut, master=self.master, date=timezone.now(),
+        )
+        response = self.client.get('/admin/beauty_salon/appointment/', {'q': 'клиента'})
+        self.assertEqual(list(response.context['cl'].queryset), [appointment])
+        # Клиенты в индексе только для админки
+        self.assertEqual(self.found('клиент'), [])
+        self.assertEqual(self.api.get('/api/search/', {'q': 'x', 'kind': 'client'}).status_code, 400)
+
+    def test_admin_search_fields_must_be_indexed(self):
+        review_admin = ReviewAdmin(Review, admin_site)
+        self.assertEqual(review_admin.check(), [])
+        review_admin.search_fields = ['comment', 'service__price']
+        self.assertEqual([error.id for error in review_admin.check()], ['beauty_salon.E001'])
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='x')
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        create_salon_data(2)
+        urls = ('/admin/beauty_salon/appointment/', '/admin/beauty_salon/review/', '/admin/beauty_salon/client/')
+        few = [self.changelist_queries(url) for url in urls]
+        create_salon_data(8, start=2)
+        self.assertEqual([self.changelist_queries(url) for url in urls], few)
+
+    def test_change_form_has_no_client_dropdown(self):
+        create_salon_data(3)
+        response = self.client.get(f'/admin/beauty_salon/appointment/{Appointment.objects.first().pk}/change/')
+        self.assertContains(response, 'vForeignKeyRawIdAdminField')
+        self.assertNotContains(response, 'Клиент 2</option>')
+
+    @skipUnless(connection.vendor == 'sqlite', 'оценка из sqlite_stat1')
+    def test_counts_are_estimated_above_limit(self):
+        create_salon_data(6)
+        url = '/admin/beauty_salon/appointment/'
+        with mock.patch('beauty_salon.admin.EXACT_COUNT_LIMIT', 3):
+            # Без статистики оценка - наибольший id
+            last = Appointment.objects.latest('pk').pk
+            self.assertEqual(self.client.get(url).context['cl'].result_count, last)
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            Appointment.objects.filter(pk__in=[last, last - 1]).delete()
+            # Статистика не обновляется на каждую запись - это оценка
+            self.assertEqual(self.client.get(url).context['cl'].result_count, 6)
+            # С фильтром точный подсчет останавливается на границе
+            self.assertEqual(self.client.get(url, {'q': 'Клиент'}).context['cl'].result_count, 4)
+
+    def test_date_hierarchy_drilldown(self):
+        create_salon_data(3)
+        day = timezone.localtime(Appointment.objects.earliest('date').date)
+        response = self.client.get('/admin/beauty_salon/appointment/', {
+            'date__year': day.year, 'date__month': day.month, 'date__day': day.day,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(Appointment.objects.earliest('date'), response.context['cl'].result_list)
+
+    def test_date_hierarchy_years_from_bounds(self):
+        create_salon_data(3)
+        first, *_, last = Appointment.objects.order_by('pk')
+        Appointment.objects.filter(pk=first.pk).update(date=datetime(2021, 6, 1, 12, tzinfo=dt_timezone.utc))
+        Appointment.objects.filter(pk=last.pk).update(date=datetime(2024, 12, 31, 23, tzinfo=dt_timezone.utc))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin/beauty_salon/appointment/')
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if 'DISTINCT' in q['sql']])
+        # Пустые годы между границами тоже в списке
+        for year in range(2021, 2025):
+            self.assertContains(response, f'date__year={year}')
+
+
+@override_settings(TIME_ZONE='Europe/Moscow')
+class BookingRollupTests(ClientBookingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.coloring = Service.objects.create(name='Окрашивание', price=3000, duration=120)
+        # 23:30 UTC - уже следующий день по Москве
+        self.start = datetime(2026, 3, 1, 23, 30, tzinfo=dt_timezone.utc)
+        self.api.force_authenticate(User.objects.create_superuser('admin', password='x'))
+
+    def book(self, service, hours=0):
+        return Appointment.objects.create(
+            client=self.client_profile, service=service, master=self.master,
+            date=self.start + timedelta(hours=hours),
+        )
+
+    def rollups(self):
+        return {
+            model: sorted(model.objects.values_list(
+                field, 'service_id', 'master_id', 'bookings', 'booked_minutes', 'revenue'
+            ))
+            for model, field in ((DailyBookingRollup, 'day'), (HourlyBookingRollup, 'hour'))
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self.rollups()
+        rebuild_rollups()
+        self.assertEqual(incremental, self.rollups())
+
+    def test_writes_keep_rollups_in_sync(self):
+        first = self.book(self.service)
+        self.book(self.service, hours=1)
+        self.book(self.coloring, hours=30)
+        self.assertEqual(
+            list(DailyBookingRollup.objects.filter(service=self.service).values_list('day', 'bookings', 'revenue')),
+            [(datetime(2026, 3, 2).date(), 2, 2000)],
+        )
+        self.assertMatchesRebuild()
+
+        first = Appointment.objects.get(pk=first.pk)
+        first.service = self.coloring
+        first.date += timedelta(days=3)
+        first.save()
+        self.assertMatchesRebuild()
+
+        Appointment.objects.filter(service=self.coloring).delete()
+        self.assertMatchesRebuild()
+        self.assertEqual(DailyBookingRollup.objects.get().bookings, 1)
+
+        self.service.price = 1500
+        self.service.save()
+        self.assertEqual(DailyBookingRollup.objects.get().revenue, 1500)
+        self.assertMatchesRebuild()
+
+    def test_bulk_writes_update_rollups(self):
+        items = [
+            {'service': self.service.id, 'master': self.master.id, 'date': (self.start + timedelta(hours=i)).isoformat()}
+            for i in range(3)
+        ]
+        created = APIClient()
+        created.force_authenticate(self.user)
+        response = created.post('/api/appointments/bulk/', items, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(DailyBookingRollup.objects.get().booked_minutes, 180)
+        self.assertMatchesRebuild()
+
+    def test_timeseries_reads_rollups(self):
+        self.book(self.service)
+        self.book(self.coloring, hours=1)
+        self.book(self.coloring, hours=24 * 9)
+        response = self.api.get('/api/analytics/timeseries/', {
+            'metric': 'revenue', 'granularity': 'day', 'from': '2026-03-01', 'to': '2026-03-12',
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+        points = response.json()['points']
+        self.assertEqual(len(points), 12)
+        self.assertEqual(points[1], {'start': '2026-03-02', 'value': 4000.0})
+        self.assertEqual(points[10]['value'], 3000.0)
+        self.assertEqual(sum(point['value'] for point in points), 7000.0)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api.get('/api/analytics/timeseries/', {
+                'metric': 'bookings', 'granularity': 'week', 'from': '2026-03-01', 'to': '2026-03-31',
+                'service': self.coloring.id,
+            })
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(
+            [(point['start'], point['value']) for point in response.json()['points']],
+            [('2026-02-23', 0), ('2026-03-02', 1), ('2026-03-09', 1), ('2026-03-16', 0),
+             ('2026-03-23', 0), ('2026-03-30', 0)],
+        )
+
+        hours = self.api.get('/api/analytics/timeseries/', {
+            'metric': 'booked_minutes', 'granularity': 'hour', 'from': '2026-03-02', 'to': '2026-03-02',
+        }).json()['points']
+        self.assertEqual(len(hours), 24)
+        self.assertEqual(hours[0]['start'], '2026-03-02T00:00:00+03:00')
+        self.assertEqual([point['value'] for point in hours[2:4]], [60, 120])
+
+    def test_timeseries_validation_and_access(self):
+        url = '/api/analytics/timeseries/'
+        self.assertEqual(self.api.get(url, {'metric': 'profit', 'from': '2026-03-01', 'to': '2026-03-02'}).status_code, 400)
+        self.assertEqual(self.api.get(url, {'metric': 'bookings', 'from': '2026-03-02', 'to': '2026-03-01'}).status_code, 400)
+        response = self.api.get(url, {'metric': 'bookings', 'granularity': 'hour', 'from': '2026-01-01', 'to': '2026-12-31'})
+        self.assertEqual(response.status_code, 400)
+        # Число точек считается без построения интервалов: огромный диапазон отклоняется сразу
+        with mock.patch('beauty_salon.rollups.bucket_starts') as bucket_starts:
+            response = self.api.get(url, {'metric': 'bookings', 'granularity': 'hour', 'from': '0001-01-01', 'to': '9999-12-31'})
+        self.assertEqual(response.status_code, 400)
+        bucket_starts.assert_not_called()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get(url, {'metric': 'bookings', 'from': '2026-03-01', 'to': '2026-03-02'}).status_code, 403)
+
+    def test_bucket_count_matches_bucket_starts(self):
+        ranges = [(date(2026, 3, 1), date(2026, 3, 1)), (date(2026, 2, 25), date(2026, 5, 3)),
+                  (date(2025, 12, 31), date(2027, 1, 1))]
+        for granularity in GRANULARITIES:
+            for start, end in ranges:
+                self.assertEqual(
+                    bucket_count(granularity, start, end), len(bucket_starts(granularity, start, end)),
+                    (granularity, start, end),
+                )
+        # Переход на летнее время: в сутках 23 часа
+        with override_settings(TIME_ZONE='Europe/Berlin'):
+            self.assertEqual(bucket_count('hour', date(2026, 3, 29), date(2026, 3, 29)), 23)
+            self.assertEqual(len(bucket_starts('hour', date(2026, 3, 29), date(2026, 3, 29))), 23)
+
+    def test_service_stats_report_booked_revenue(self):
+        self.book(self.service)
+        self.book(self.service, hours=1)
+        stats = self.api.get('/api/services/stats/').json()
+        self.assertEqual(float(stats['total_revenue']), 2000)
+
+
+@override_settings(TIME_ZONE='Europe/Moscow')
+class MasterUtilizationTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('client', password='x')
+        self.client_profile = Client.objects.create(user=user, name='Клиент', phone='1', email='')
+        self.haircut = Service.objects.create(name='Стрижка', price=1000, duration=60)
+        self.coloring = Service.objects.create(name='Окрашивание', price=3000, duration=90)
+        self.anna = Master.objects.create(name='Анна', specialization='Парикмахер')
+        self.olga = Master.objects.create(name='Ольга', specialization='Колорист')
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('manager', password='x', is_staff=True))
+        self.client_api = APIClient()
+        self.client_api.force_authenticate(user)
+
+    def book(self, service, *when):
+        Appointment.objects.create(
+            client=self.client_profile, service=service, master=self.anna,
+            date=timezone.make_aware(datetime(*when)),
+        )
+
+    def test_heatmap_counts_busy_minutes_by_local_weekday_hour(self):
+        self.book(self.haircut, 2026, 3, 2, 10, 0)
+        # Пересекается с предыдущей: минуты 10:30-11:00 заняты один раз
+        self.book(self.haircut, 2026, 3, 2, 10, 30)
+        # Началась до периода (воскресенье 23:30), закончилась в понедельник в 01:00
+        self.book(self.coloring, 2026, 3, 1, 23, 30)
+        response = self.api.get('/api/masters/utilization/', {'from': '2026-03-02', 'to': '2026-03-08'})
+        self.assertEqual(response.status_code, 200, response.content)
+        anna, olga = response.json()['masters']
+        self.assertEqual((anna['name'], olga['name']), ('Анна', 'Ольга'))
+        monday = anna['heatmap'][0]
+        self.assertEqual((monday[0], monday[10], monday[11], monday[12]), (1.0, 1.0, 0.5, 0.0))
+        self.assertEqual(sum(map(sum, anna['heatmap'])), 2.5)
+        # 84 рабочих часа недели: занят полностью один и наполовину еще один
+        self.assertEqual(anna['average'], round(1.5 / 84, 4))
+        self.assertEqual(anna['percentiles'], {'p50': 0.0, 'p90': 0.0, 'p99': 0.585})
+        self.assertEqual(olga['average'], 0.0)
+
+        only = self.api.get('/api/masters/utilization/', {
+            'from': '2026-03-02', 'to': '2026-03-08', 'master': self.olga.id,
+        }).json()['masters']
+        self.assertEqual([item['master'] for item in only], [self.olga.id])
+
+    def test_clients_are_forbidden(self):
+        url = '/api/masters/utilization/'
+        params = {'from': '2026-03-02', 'to': '2026-03-08', 'master': self.anna.id}
+        self.assertEqual(self.client_api.get(url, params).status_code, 403)
+        self.assertEqual(APIClient().get(url, params).status_code, 401)
+
+    def test_validation(self):
+        url = '/api/masters/utilization/'
+        self.assertEqual(self.api.get(url, {'from': '2026-03-08', 'to': '2026-03-02'}).status_code, 400)
+        self.assertEqual(self.api.get(url, {'from': '2025-01-01', 'to': '2026-03-02'}).status_code, 400)
+
+    @skipUnless(np is not None, 'NumPy не установлен')
+    def test_numpy_and_python_agree(self):
+        period = Period(datetime(2026, 3, 1).date(), datetime(2026, 3, 31).date())
+        rng = random.Random(7)
+        first = period.first.timestamp() - 86400
+        masters = [rng.choice((1, 2, 5)) for _ in range(500)]
+        starts = [first + rng.randrange(0, 33 * 86400, 60) for _ in range(500)]
+        durations = [rng.choice((30, 60, 90, 240)) for _ in range(500)]
+        self.assertEqual(
+            compute_utilization(period, [1, 2, 5, 9], masters, starts, durations, use_numpy=True),
+            compute_utilization(period, [1, 2, 5, 9], masters, starts, durations, use_numpy=False),
+        )
+
+    @skipUnless(np is not None, 'NumPy не установлен')
+    def test_appointments_of_other_masters_are_ignored(self):
+        period = Period(datetime(2026, 3, 2).date(), datetime(2026, 3, 8).date())
+        start = period.first.timestamp() + 10 * 3600
+        expected = compute_utilization(period, [2, 5], [5], [start], [60], use_numpy=False)
+        # Мастера с id меньше, между и больше запрошенных
+        masters, starts, durations = [1, 3, 5, 40], [start] * 4, [60] * 4
+        for use_numpy in (True, False):
+            self.assertEqual(
+                compute_utilization(period, [2, 5], masters, starts, durations, use_numpy=use_numpy), expected,
+            )
+
+
+class ExportJobTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        create_salon_data(3)
+        self.user = User.objects.get(username='client0')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def download_rows(self, job_id):
+        response = self.api.get(f'/api/exports/{job_id}/download/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response['Content-Disposition'])
+        sheet = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True).active
+        return [row for row in sheet.iter_rows(min_row=2, values_only=True)]
+
+    def test_job_builds_file_and_download_returns_it(self):
+        response = self.api.post('/api/exports/', {'kind': 'appointments'}, format='json')
+        # EXPORT_WORKERS = 0 в тестах: файл готов уже в ответе на POST
+        self.assertEqual(response.status_code, 200, response.content)
+        job = response.json()
+        self.assertEqual((job['status'], job['rows']), ('done', 1))
+        self.assertTrue(job['download'].endswith(f'/api/exports/{job["id"]}/download/'))
+        self.assertEqual(self.api.get(f'/api/exports/{job["id"]}/').json()['status'], 'done')
+        # Только свои записи, как в GET export-excel
+        self.assertEqual([row[:3] for row in self.download_rows(job['id'])], [('Клиент 0', 'Услуга 0', 'Мастер 0')])
+
+    def test_identical_requests_reuse_the_job_within_window(self):
+        first = self.api.post('/api/exports/', {'kind': 'services'}, format='json').json()
+        second = self.api.post('/api/exports/', {'kind': 'services'}, format='json').json()
+        self.assertEqual(second['id'], first['id'])
+        # Список услуг общий: другой пользователь получает тот же файл
+        other = APIClient()
+        other.force_authenticate(User.objects.get(username='client1'))
+        self.assertEqual(other.post('/api/exports/', {'kind': 'services'}, format='json').json()['id'], first['id'])
+        # Записи у каждого свои
+        mine = self.api.post('/api/exports/', {'kind': 'appointments'}, format='json').json()
+        theirs = other.post('/api/exports/', {'kind': 'appointments'}, format='json').json()
+        self.assertNotEqual(mine['id'], theirs['id'])
+        self.assertEqual(other.get(f'/api/exports/{mine["id"]}/').status_code, 404)
+        self.assertEqual(other.get(f'/api/exports/{mine["id"]}/download/').status_code, 404)
+
+        ExportJob.objects.filter(pk=first['id']).update(
+            created_at=timezone.now() - timedelta(seconds=settings.EXPORT_REUSE_SECONDS + 1)
+        )
+        self.assertNotEqual(self.api.post('/api/exports/', {'kind': 'services'}, format='json').json()['id'], first['id'])
+
+    def test_failed_job_is_not_reused(self):
+        with mock.patch('beauty_salon.export_jobs.write_xlsx', side_effect=OSError('disk full')), \
+                self.assertLogs('beauty_salon.export_jobs', 'ERROR'):
+            failed = self.api.post('/api/exports/', {'kind': 'masters'}, format='json').json()
+        self.assertEqual((failed['status'], failed['error']), ('failed', 'disk full'))
+        self.assertEqual(self.api.get(f'/api/exports/{failed["id"]}/download/').status_code, 409)
+        retry = self.api.post('/api/exports/', {'kind': 'masters'}, format='json').json()
+        self.assertNotEqual(retry['id'], failed['id'])
+        self.assertEqual(retry['status'], 'done')
+        self.assertEqual(len(self.download_rows(retry['id'])), 3)
+
+    @override_settings(EXPORT_WORKERS=2)
+    def test_pool_receives_job_after_commit_and_runs_it_once(self):
+        with mock.patch('beauty_salon.export_jobs.submit') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.api.post('/api/exports/', {'kind': 'services'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual((job['status'], job['download']), ('pending', None))
+        self.assertTrue(response['Location'].endswith(f'/api/exports/{job["id"]}/'))
+        submit.assert_called_once_with(job['id'])
+        self.assertEqual(self.api.get(f'/api/exports/{job["id"]}/download/').status_code, 409)
+
+        # Задание берет только первый исполнитель
+        self.assertTrue(run_export_job(job['id']))
+        self.assertFalse(run_export_job(job['id']))
+        self.assertEqual(len(self.download_rows(job['id'])), 3)
+
+    @override_settings(EXPORT_WORKERS=2)
+    def test_run_export_jobs_command_runs_leftovers_and_purges(self):
+        with mock.patch('beauty_salon.export_jobs.submit'):
+            job_id = self.api.post('/api/exports/', {'kind': 'masters'}, format='json').json()['id']
+        call_command('run_export_jobs', stdout=StringIO())
+        job = ExportJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.rows), (ExportJob.DONE, 3))
+        self.assertTrue(default_storage.exists(job.file.name))
+
+        call_command('run_export_jobs', '--purge', '--keep-hours', '0', stdout=StringIO())
+        self.assertFalse(ExportJob.objects.filter(pk=job_id).exists())
+        self.assertFalse(default_storage.exists(job.file.name))
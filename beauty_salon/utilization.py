@@ -0,0 +1,214 @@
+"""
+Загрузка мастеров по дням недели и часам.
+
+Записи за период читаются одним values_list (мастер, время, длительность
+услуги), дальше считается с поминутной точностью: для каждого мастера
+строится разностный массив по границам интервалов (+1 в начале, -1 в
+конце, np.bincount), np.cumsum дает число записей в каждой минуте, занятой
+считается минута хотя бы с одной записью. Занятые минуты суммируются по
+часам местного времени, затем по дням недели.
+
+NumPy - необязательная зависимость: без нее тот же результат считается на
+чистом Python слиянием интервалов, заметно медленнее на больших периодах.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+from .availability import WORKDAY_END, WORKDAY_START
+from .models import Appointment
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MINUTES_PER_DAY = 24 * 60
+# Записи, начавшиеся до периода, но зашедшие в него
+LOOKBACK = timedelta(days=1)
+MAX_UTILIZATION_DAYS = 366
+PERCENTILES = (50, 90, 99)
+PRECISION = 4
+LOAD_CHUNK_SIZE = 10_000
+# Ячеек (мастер x минута) в одном разностном массиве: ограничивает память
+CHUNK_CELLS = 4_000_000
+
+
+class Period:
+    """
+    Дни start..end включительно в зоне по умолчанию. Переводит время
+    epoch (секунды) в минуты местного времени от полуночи start.
+    """
+    def __init__(self, start, end):
+        self.start, self.end = start, end
+        self.days = (end - start).days + 1
+        self.minutes = self.days * MINUTES_PER_DAY
+        tz = timezone.get_default_timezone()
+        self.first = timezone.make_aware(datetime.combine(start, time.min), tz)
+        self.last = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz)
+        # Полночь start как epoch «настенного» времени
+        self.origin = datetime.combine(start, time.min, tzinfo=dt_timezone.utc).timestamp()
+        # Смещение зоны для каждого часа UTC периода: переходы на летнее время идут по границам часов
+        self.table_start = (self.first - LOOKBACK).timestamp() // 3600 * 3600
+        hours = int((self.last.timestamp() - self.table_start) // 3600) + 1
+        self.offsets = [
+            datetime.fromtimestamp(self.table_start + hour * 3600, tz).utcoffset().total_seconds()
+            for hour in range(hours)
+        ]
+
+    def weekdays(self):
+        return [(self.start.weekday() + day) % 7 for day in range(self.days)]
+
+
+def load_appointments(period, master_ids=None):
+    """(master_id, epoch-секунды начала, длительность в минутах) записей периода"""
+    rows = Appointment.objects.filter(
+        date__gte=period.first - LOOKBACK, date__lt=period.last
+    ).order_by().values_list('master_id', 'date', 'service__duration')
+    if master_ids is not None:
+        rows = rows.filter(master_id__in=master_ids)
+    masters, starts, durations = [], [], []
+    for master_id, date, duration in rows.iterator(chunk_size=LOAD_CHUNK_SIZE):
+        masters.append(master_id)
+        starts.append(date.timestamp())
+        durations.append(duration)
+    return masters, starts, durations
+
+
+def _numpy_utilization(period, master_ids, masters, starts, durations):
+    order = np.asarray(sorted(master_ids), dtype=np.int64)
+    masters = np.asarray(masters, dtype=np.int64)
+    # id мастера -> строка результата; записи мастеров не из master_ids отбрасываются,
+    # как и в Python-версии
+    known = np.isin(masters, order)
+    index = np.searchsorted(order, masters[known])
+    starts = np.asarray(starts, dtype=np.float64)[known].astype(np.int64)
+    durations = np.asarray(durations, dtype=np.int64)[known]
+
+    offsets = np.asarray(period.offsets, dtype=np.int64)
+    hour = ((starts - int(period.table_start)) // 3600).clip(0, len(offsets) - 1)
+    begin = (starts + offsets[hour] - int(period.origin)) // 60
+    # Интервалы обрезаются по периоду; целиком вне его дают +1 и -1 в одной точке и исчезают
+    end = (begin + durations).clip(0, period.minutes)
+    begin = begin.clip(0, period.minutes)
+
+    # Разностные массивы сразу для нескольких мастеров: строка на мастера, минута на столбец.
+    # Записи группируются по пачкам мастеров устойчивой сортировкой малых целых (поразрядной)
+    width = period.minutes + 1
+    chunk = max(1, CHUNK_CELLS // width)
+    chunk_of = (index // chunk).astype(np.int16)
+    by_chunk = np.argsort(chunk_of, kind='stable')
+    index, begin, end = index[by_chunk], begin[by_chunk], end[by_chunk]
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(chunk_of, minlength=-(-len(order) // chunk)))))
+    busy_hours = np.empty((len(order), period.days * 24), dtype=np.int64)
+    for number, first in enumerate(range(0, len(order), chunk)):
+        count = min(chunk, len(order) - first)
+        rows = slice(bounds[number], bounds[number + 1])
+        offset = (index[rows] - first) * width
+        delta = np.bincount(offset + begin[rows], minlength=count * width)
+        delta -= np.bincount(offset + end[rows], minlength=count * width)
+        delta = delta.reshape(count, width)
+        # Число записей в каждой минуте - на месте, без еще одного массива того же размера
+        busy = np.cumsum(delta, axis=1, out=delta)[:, :period.minutes] > 0
+        busy_hours[first:first + count] = busy.reshape(count, -1, 60).sum(axis=2)
+
+    per_day = busy_hours.reshape(len(order), period.days, 24)
+    weekdays = np.asarray(period.weekdays())
+    capacity = np.bincount(weekdays, minlength=7) * 60
+    heat = np.stack([per_day[:, weekdays == weekday].sum(axis=1) for weekday in range(7)], axis=1)
+    heatmaps = heat / np.maximum(capacity, 1)[None, :, None]
+    work = per_day[:, :, WORKDAY_START.hour:WORKDAY_END.hour].reshape(len(order), -1) / 60
+    percentiles = np.percentile(work, PERCENTILES, axis=1)
+    averages = work.mean(axis=1)
+    return [
+        {
+            'master': int(master_id),
+            'heatmap': heatmaps[i].round(PRECISION).tolist(),
+            'average': round(float(averages[i]), PRECISION),
+            'percentiles': {
+                f'p{q}': round(float(percentiles[j, i]), PRECISION) for j, q in enumerate(PERCENTILES)
+            },
+        }
+        for i, master_id in enumerate(order)
+    ]
+
+
+def _add_busy(row, begin, end):
+    """Минуты [begin, end) в счетчики занятых минут по часам"""
+    for hour in range(begin // 60, (end - 1) // 60 + 1):
+        row[hour] += min(end, (hour + 1) * 60) - max(begin, hour * 60)
+
+
+def _percentile(values, q):
+    """Линейная интерполяция, как np.percentile по умолчанию"""
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def _python_utilization(period, master_ids, masters, starts, durations):
+    intervals = defaultdict(list)
+    for master_id, start, duration in zip(masters, starts, durations):
+        hour = min(max(int((start - period.table_start) // 3600), 0), len(period.offsets) - 1)
+        begin = int((start + period.offsets[hour] - period.origin) // 60)
+        end = min(max(begin + duration, 0), period.minutes)
+        begin = min(max(begin, 0), period.minutes)
+        if begin < end:
+            intervals[master_id].append((begin, end))
+
+    weekdays = period.weekdays()
+    capacity = [weekdays.count(weekday) * 60 for weekday in range(7)]
+    result = []
+    for master_id in sorted(master_ids):
+        busy_hours = [0] * (period.days * 24)
+        # Пересекающиеся записи сливаются: минута занята один раз
+        merged = None
+        for begin, end in sorted(intervals[master_id]):
+            if merged and begin <= merged[1]:
+                merged[1] = max(merged[1], end)
+                continue
+            if merged:
+                _add_busy(busy_hours, *merged)
+            merged = [begin, end]
+        if merged:
+            _add_busy(busy_hours, *merged)
+
+        heat = [[0] * 24 for _ in range(7)]
+        for day, weekday in enumerate(weekdays):
+            for hour in range(24):
+                heat[weekday][hour] += busy_hours[day * 24 + hour]
+        work = sorted(
+            busy_hours[day * 24 + hour] / 60
+            for day in range(period.days) for hour in range(WORKDAY_START.hour, WORKDAY_END.hour)
+        )
+        result.append({
+            'master': master_id,
+            'heatmap': [
+                [round(minutes / max(capacity[weekday], 1), PRECISION) for minutes in heat[weekday]]
+                for weekday in range(7)
+            ],
+            'average': round(sum(work) / len(work), PRECISION),
+            'percentiles': {f'p{q}': round(_percentile(work, q), PRECISION) for q in PERCENTILES},
+        })
+    return result
+
+
+def compute_utilization(period, master_ids, masters, starts, durations, use_numpy=None):
+    """
+    Тепловые карты загрузки мастеров master_ids: heatmap[день недели][час] -
+    доля занятых минут, average и percentiles - по часам рабочего дня.
+    masters, starts, durations - столбцы load_appointments (списки или массивы).
+    """
+    if use_numpy is None:
+        use_numpy = np is not None
+    compute = _numpy_utilization if use_numpy else _python_utilization
+    return compute(period, master_ids, masters, starts, durations)
+
+
+def master_utilization(start, end, master_ids, filter_masters=False):
+    """filter_masters - читать записи только мастеров master_ids, а не всех"""
+    period = Period(start, end)
+    columns = load_appointments(period, master_ids if filter_masters else None)
+    return compute_utilization(period, master_ids, *columns)
@@ -1,7 +1,9 @@
+import logging
 from typing import Any
 from django.shortcuts import render
 from django.http import HttpResponse
 from beauty_salon.models import Client
+from beauty_salon.authentication import forget_token
 from django.views.generic import TemplateView
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
@@ -11,6 +13,8 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import ensure_csrf_cookie
 
+logger = logging.getLogger(__name__)
+
 class ShowClients(TemplateView):
     template_name = 'clients/show_clients.html'
 
@@ -26,45 +30,42 @@ def login(request):
     username = request.data.get('username')
     password = request.data.get('password')
     
-    print(f"Login attempt for {username}")
-    print(f"Request data: {request.data}")
+    # Пароль и токен в лог не пишем
+    logger.debug('Login attempt for %s', username)
     
     try:
         user = User.objects.get(username=username)
-        print(f"Found user: {user.username}")
-        print(f"User active: {user.is_active}")
-        print(f"User staff: {user.is_staff}")
-        print(f"User superuser: {user.is_superuser}")
+        logger.debug('Found user %s: active=%s staff=%s superuser=%s',
+                     user.username, user.is_active, user.is_staff, user.is_superuser)
     except User.DoesNotExist:
-        print(f"User {username} not found")
+        logger.debug('User %s not found', username)
         return Response({'error': 'Invalid credentials'}, status=400)
     
     auth_user = authenticate(username=username, password=password)
-    print(f"Authentication result: {auth_user}")
     
     if auth_user:
         token, _ = Token.objects.get_or_create(user=auth_user)
-        print(f"Generated token: {token.key}")
+        logger.debug('User %s logged in', auth_user.username)
         return Response({
             'token': token.key,
             'user_id': auth_user.pk,
             'username': auth_user.username
         })
     
-    print("Authentication failed")
+    logger.debug('Authentication failed for %s', username)
     return Response({'error': 'Invalid credentials'}, status=400)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def logout(request):
     try:
-        print(f"Logout attempt for user: {request.user.username}")  # Для отладки
+        logger.debug('Logout attempt for user %s', request.user.username)
         if hasattr(request.user, 'auth_token'):
-            print(f"Deleting token: {request.user.auth_token.key}")  # Для отладки
+            forget_token(request.user.auth_token.key)
             request.user.auth_token.delete()
             return Response({'message': 'Successfully logged out'})
         return Response({'message': 'No token found'})
     except Exception as e:
-        print(f"Logout error: {str(e)}")  # Для отладки
+        logger.exception('Logout error')
         return Response({'error': str(e)}, status=400)
 
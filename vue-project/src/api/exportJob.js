@@ -0,0 +1,27 @@
+import axios from 'axios';
+
+const POLL_INTERVAL_MS = 1000;
+
+// Выгрузка в Excel через фоновое задание (POST /api/exports/): файл
+// собирается на сервере вне запроса, поэтому большая таблица не упирается
+// в таймаут прокси. Опрашиваем статус и скачиваем готовый файл.
+export async function downloadExport(kind, filename, config) {
+  let { data: job } = await axios.post('/api/exports/', { kind }, config);
+  while (job.status === 'pending' || job.status === 'running') {
+    await new Promise(resolve => setTimeout(resolve, POLL_INTERVAL_MS));
+    ({ data: job } = await axios.get(`/api/exports/${job.id}/`, config));
+  }
+  if (job.status !== 'done') {
+    throw new Error(job.error || `Export ${job.status}`);
+  }
+  const response = await axios.get(`/api/exports/${job.id}/download/`, { ...config, responseType: 'blob' });
+
+  const url = window.URL.createObjectURL(new Blob([response.data]));
+  const link = document.createElement('a');
+  link.href = url;
+  link.setAttribute('download', filename);
+  document.body.appendChild(link);
+  link.click();
+  link.remove();
+  window.URL.revokeObjectURL(url);
+}
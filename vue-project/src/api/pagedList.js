@@ -0,0 +1,38 @@
+import { ref } from 'vue';
+import axios from 'axios';
+
+// Списки в API отдаются страницами (cursor-пагинация): экран грузит только
+// первую страницу, следующую - по ссылке next, когда пользователь нажимает
+// "Показать еще". Таблица целиком не скачивается.
+export function usePagedList(url, config) {
+  const items = ref([]);
+  const next = ref(null);
+  const loadingMore = ref(false);
+
+  async function load() {
+    const response = await axios.get(url, config());
+    items.value = response.data.results;
+    next.value = response.data.next;
+  }
+
+  async function loadMore() {
+    if (!next.value || loadingMore.value) return;
+    loadingMore.value = true;
+    try {
+      const response = await axios.get(next.value, config());
+      items.value.push(...response.data.results);
+      next.value = response.data.next;
+    } finally {
+      loadingMore.value = false;
+    }
+  }
+
+  return { items, next, loadingMore, load, loadMore };
+}
+
+// Справочник для выпадающих списков и подписей (услуги, мастера):
+// одна страница наибольшего размера, только id и имя
+export async function fetchOptions(url, config) {
+  const response = await axios.get(url, { ...config, params: { fields: 'id,name', page_size: 200 } });
+  return response.data.results;
+}